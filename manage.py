@@ -176,5 +176,19 @@ def addsuperuser():
     register_superuser(email, password)
 
 
+@manager.command
+def compact_results(root_key, run, version, delete=False, rollups=False):
+    """
+    Convert a run version's CSV results into a Parquet dataset, optionally with monthly and annual rollups. Set the
+    scenarios' results data_location to "parquet" to read from the dataset.
+    """
+    from openagua.lib.results_store import compact_results as compact
+
+    version_path = 's3://{}/{}/results/{}/{}'.format(app.config['AWS_S3_BUCKET'], root_key, run, version)
+    print('Compacting {}...'.format(version_path))
+    nfiles, nrows = compact(app.s3fs, version_path, delete=delete, rollups=rollups)
+    print('Done! Converted {} files ({} rows).'.format(nfiles, nrows))
+
+
 if __name__ == "__main__":
     manager.run()
@@ -136,6 +136,11 @@ def check_data_session(response):
     return response
 
 
+from openagua.request_functions import release_connection, add_hydra_timing
+
+app.after_request(add_hydra_timing)
+app.teardown_request(release_connection)
+
 os.environ['AWS_ACCESS_KEY_ID'] = app.config['AWS_ACCESS_KEY_ID']
 os.environ['AWS_SECRET_ACCESS_KEY'] = app.config['AWS_SECRET_ACCESS_KEY']
 os.environ['AWS_S3_BUCKET'] = app.config.get('AWS_S3_BUCKET')
@@ -11,6 +11,7 @@ from openagua.lib.networks import get_network, update_network_on_mapbox, update_
     get_network_settings, add_update_network_settings, delete_network_settings
 from openagua.lib.sharing import set_resource_permissions, share_resource
 from openagua.lib.templates import get_default_types
+from openagua.lib.template_cache import get_template, get_template_lookups
 from openagua.lib.files import delete_all_network_files
 from openagua.lib.network_editor import add_link, add_network_reference, update_network_reference, \
     delete_network_references, update_links2, split_link_at_nodes2
@@ -235,9 +236,10 @@ class AttributeScenarios(Resource):
     def get(self, network_id):
         network = g.conn.call('get_network', network_id, include_data=False)
         template_id = g.conn.get_template_id_from_network(network)
-        template = g.conn.call('get_template', template_id)
+        lookups = get_template_lookups(g.conn, template_id)
+        template = lookups.template
 
-        tattrs = {tt.id: {ta.attr_id: ta for ta in tt.typeattrs} for tt in template.templatetypes}
+        tattrs = lookups.typeattrs_by_type
 
         def simplify(scenario):
             return {
@@ -282,7 +284,7 @@ class NetworkPreviewUrl(Resource):
     def get(self, network_id):
         network = g.conn.call('get_network', network_id, summary=True, include_resources=True)
         template_id = network.layout.get('active_template_id')
-        template = template_id and g.conn.call('get_template', template_id)
+        template = template_id and get_template(g.conn, template_id)
         svg = make_network_thumbnail(network, template)
         url = save_network_preview(
             network=network,
@@ -569,8 +571,9 @@ class Links(Resource):
         if incoming_links:
             network = g.conn.call('get_network', network_id, include_resources=True, include_data=False, summary=True)
             template_id = template_id or network.layout.get('active_template_id')
-            template = g.conn.call('get_template', template_id)
-            templatetypes = {tt.id: tt for tt in template.templatetypes}
+            lookups = get_template_lookups(g.conn, template_id)
+            template = lookups.template
+            templatetypes = lookups.ttypes
 
             # TODO: get inflow/outflow node time from template
             default_types = get_default_types(template)
@@ -815,7 +818,7 @@ def update_networks_map(network_id):
     template_id = network.layout.get('active_template_id')
     if not template_id:
         return '', 500
-    template = g.conn.call('get_template', template_id)
+    template = get_template(g.conn, template_id)
     update_network_on_mapbox(network, template, endpoint_url, dataset_id, mapbox_creation_token, is_public)
     return '', 200
 
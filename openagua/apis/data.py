@@ -1,12 +1,14 @@
-from flask import request, jsonify, g, current_app, json
+from flask import request, jsonify, g, current_app, json, Response, stream_with_context
 from flask_restx import Namespace, Resource
 from munch import Munch as AttrDict
 
 from openagua.security import current_user
 from openagua.lib.data import get_scenarios_data, make_eval_data, filter_input_data, prepare_dataset, \
-    filter_results_data
+    filter_results_data, iter_results_data, validate_functions
+from openagua.lib.streams import iter_ndjson, iter_arrow, NDJSON_MIMETYPE, ARROW_MIMETYPE, ARROW_AVAILABLE
 from openagua.lib.favorites import get_favorite
 from openagua.lib.pivot import save_pivot_input
+from openagua.lib.template_cache import get_template
 
 api = Namespace('Data API', path='/data',
                 description='Data API for the OpenAgua app. This varies significantly from Hydra, '
@@ -29,7 +31,8 @@ class ResourceScenarioData(Resource):
             'language': 'The default language input for text-based rules (default=python)。',
             'flavor': 'Language flavor. This can help with interpreting input for preview.',
             'settings': 'Time settings (start, end and step)',
-            'network_folder': 'Network folder. This is from the network layout.'
+            'network_folder': 'Network folder. This is from the network layout.',
+            'parallel': 'Evaluate the scenarios in the lineage concurrently (default=true)',
         }
     )
     def get(self):
@@ -44,6 +47,7 @@ class ResourceScenarioData(Resource):
         settings = request.args.get('settings', '{}', type=str)
         language = request.args.get('language', 'python', type=str)
         flavor = request.args.get('flavor', 'openagua')
+        parallel = request.args.get('parallel', 'true', type=str).lower() != 'false'
 
         time_settings = json.loads(settings)
         files_path = request.args.get('network_folder')
@@ -64,7 +68,8 @@ class ResourceScenarioData(Resource):
             nblocks=nblocks,
             flavor='json',
             for_eval=True,
-            function_language=(language, flavor)
+            function_language=(language, flavor),
+            parallel=parallel,
         )
         attr_data = get_scenarios_data(**kwargs)
 
@@ -189,6 +194,29 @@ class ResourceScenarioData(Resource):
         return jsonify(result=result, res_attr=res_attr, variation=variation)
 
 
+@api.route('/functions/validate')
+class ValidateFunctions(Resource):
+
+    @api.doc(
+        description='Compile all functions in a network ahead of time, reporting syntax errors and unresolved '
+                    'references.',
+        params={
+            'network_id': 'The network ID',
+            'scenario_ids': 'The scenario IDs to check (default: all of the network\'s scenarios)',
+        }
+    )
+    def post(self):
+        network_id = request.json['network_id']
+        scenario_ids = request.json.get('scenario_ids')
+
+        try:
+            result = validate_functions(g.conn, network_id, scenario_ids=scenario_ids)
+        except Exception as err:
+            return jsonify(error=str(err))
+
+        return jsonify(error=None, **result)
+
+
 @api.route('/pivot_input')
 class PivotInputData(Resource):
 
@@ -233,6 +261,11 @@ class PivotInputData(Resource):
             maxrows=100000,
         )
 
+        if type(result) == int:
+            return jsonify(error=result)
+        elif result is None:
+            return jsonify(data=[], pivot=pivot)
+
         if not favorite_id:
             if 'Block' in result:
                 blocks = result['Block'].unique()
@@ -240,7 +273,7 @@ class PivotInputData(Resource):
                     pivot['cols'].append('Block')
             pivot['vals'] = ['value']
 
-        pivot['hiddenFromAggregators'] = [c for c in result['columns'] if c != 'value']
+        pivot['hiddenFromAggregators'] = [c for c in result.columns if c != 'value']
 
         data = result.to_dict(orient='records')
 
@@ -255,16 +288,63 @@ class PivotInputData(Resource):
 
         network = g.conn.call('get_network', network_id, include_resources=True, include_data=False,
                               summary=False)
-        template = g.conn.call('get_template', network.layout.get('active_template_id'))
+        template = get_template(g.conn, network.layout.get('active_template_id'))
+
+        error, report = save_pivot_input(pivot, filters, data, network, template,
+                                         current_app.config['DATA_DATETIME_FORMAT'])
+
+        return jsonify(error=error, **report)
+
+
+def make_results_pivot(filters, data, perturbations):
+    '''Make the default pivot configuration for results'''
+
+    agg = filters.get('agg', {})
+    data_type = filters.get('attr_data_type', 'timeseries')
 
-        error = save_pivot_input(pivot, filters, data, network, template, current_app.config['DATA_DATETIME_FORMAT'])
+    default_chart_renderer = current_app.config['DEFAULT_CHART_RENDERER']
+    pivot = {
+        'renderer': default_chart_renderer,
+        'rendererName': 'Line Chart',
+        'aggregatorName': 'Average',
+        'rows': [],
+        'cols': [],
+        'type': 'results'
+    }
 
-        return jsonify(error=error)
+    time_step = agg.get('time', {}).get('step')
+    if len(filters.get('scenarios', [])) > 1:
+        pivot['rows'].append('Scenario')
+
+    if data_type == 'timeseries':  # TODO: add more types
+        pivot['renderer'] = default_chart_renderer
+        if len(filters.get('resources', [])) > 1 and not agg.get('space'):
+            pivot['rows'].append('Feature')
+        if not filters.get('unstack'):
+            pivot['rows'].append('Variable')
+        if 'block' in data and len(set(data.block)) > 1:
+            pivot['rows'].append('Block')
+
+        if time_step == 'year':
+            pivot['cols'] = ['Year']
+        else:
+            pivot['cols'] = ['Date']
+
+    if perturbations:
+        pivot['rows'].extend(perturbations)
+
+    return pivot
 
 
 @api.route('/pivot_results')
 class PivotResultsData(Resource):
 
+    @api.doc(
+        params={
+            'stream': 'Stream the results in chunks, as "ndjson" or "arrow". Streaming can also be requested with '
+                      'an Accept header of {} or {}.'.format(NDJSON_MIMETYPE, ARROW_MIMETYPE)
+        }
+    )
     def get(self):
 
         favorite_id = request.args.get('favorite_id', type=int)
@@ -274,11 +354,41 @@ class PivotResultsData(Resource):
         filters_str = request.args.get('filters', '{}')
         filters = AttrDict(json.loads(filters_str))
 
-        agg = filters.get('agg', {})
+        stream = request.args.get('stream')
+        if not stream:
+            accept = request.headers.get('Accept', '')
+            if ARROW_MIMETYPE in accept:
+                stream = 'arrow'
+            elif NDJSON_MIMETYPE in accept:
+                stream = 'ndjson'
 
         if not favorite_id:
             filters['attr_data_type'] = 'timeseries'  # TODO: get from user filters
-        data_type = filters.get('attr_data_type', 'timeseries')
+
+        pivot = None
+        if favorite_id:
+            favorite = get_favorite(favorite_id=favorite_id)
+            if favorite:
+                pivot = favorite.pivot
+            else:
+                return jsonify(error=1)  # no favorite found
+
+        if stream == 'arrow' and not ARROW_AVAILABLE:
+            return jsonify(error='Arrow output is not available')
+
+        if stream:
+
+            def make_header(df, perturbations):
+                return {'pivot': pivot or make_results_pivot(filters, df, perturbations), 'error': None}
+
+            chunks = iter_results_data(
+                conn=g.conn, filters=filters, network_id=network_id, template_id=template_id,
+                project_id=project_id, maxrows=500000, include_tags=False)
+
+            if stream == 'arrow':
+                return Response(stream_with_context(iter_arrow(chunks, make_header)), mimetype=ARROW_MIMETYPE)
+            else:
+                return Response(stream_with_context(iter_ndjson(chunks, make_header)), mimetype=NDJSON_MIMETYPE)
 
         # filter and organize the data
         data, perturbations = filter_results_data(
@@ -290,43 +400,8 @@ class PivotResultsData(Resource):
         elif data is None:
             return jsonify(error=-3)
 
-        if favorite_id:
-            favorite = get_favorite(favorite_id=favorite_id)
-            if favorite:
-                pivot = favorite.pivot
-            else:
-                return jsonify(error=1)  # no favorite found
-        else:
-            default_chart_renderer = current_app.config['DEFAULT_CHART_RENDERER']
-            pivot = {
-                'renderer': default_chart_renderer,
-                'rendererName': 'Line Chart',
-                'aggregatorName': 'Average',
-                'rows': [],
-                'cols': [],
-                'type': 'results'
-            }
-
-            time_step = agg.get('time', {}).get('step')
-            if len(filters.get('scenarios', [])) > 1:
-                pivot['rows'].append('Scenario')
-
-            if data_type == 'timeseries':  # TODO: add more types
-                pivot['renderer'] = default_chart_renderer,
-                if len(filters.get('resources', [])) > 1 and not agg.get('space'):
-                    pivot['rows'].append('Feature')
-                if not filters.get('unstack'):
-                    pivot['rows'].append('Variable')
-                if 'block' in data and len(set(data.block)) > 1:
-                    pivot['rows'].append('Block')
-
-                if time_step == 'year':
-                    pivot['cols'] = ['Year']
-                else:
-                    pivot['cols'] = ['Date']
-
-            if perturbations:
-                pivot['rows'].extend(perturbations)
+        if not pivot:
+            pivot = make_results_pivot(filters, data, perturbations)
 
         columns = list(data.columns)
         data = data.to_json(orient='values', date_format='iso')
@@ -1,6 +1,11 @@
+from os import environ
+
 from flask import jsonify, g, request
 from flask_restx import Namespace, Resource, fields
 
+# the most calls allowed in one batch
+HYDRA_BATCH_SIZE = int(environ.get('OA_HYDRA_BATCH_SIZE', 1000))
+
 hydra = Namespace('Hydra Platform RPC API', path='/hydra',
                   description='A pass-through to Hydra Platform functions.'
                               ' Good for when you can\'t find what you need in the core API.')
@@ -10,6 +15,57 @@ hydra_fields = hydra.model('HydraRPC', {
     'kwargs': fields.String
 })
 
+hydra_call_fields = hydra.model('HydraBatchCall', {
+    'function': fields.String(required=True),
+    'args': fields.List(fields.Raw),
+    'kwargs': fields.Raw
+})
+
+hydra_batch_fields = hydra.model('HydraBatch', {
+    'calls': fields.List(fields.Nested(hydra_call_fields), required=True),
+    'concurrent': fields.Boolean(default=False)
+})
+
+
+@hydra.route('/_batch')
+class HydraBatch(Resource):
+
+    @hydra.doc(
+        description='Run several Hydra Platform functions in order, on one connection. On a local data source, the '
+                    'calls run in one transaction, which is rolled back if any call fails. Calls after a failed call '
+                    'are skipped. With concurrent, consecutive get_ calls run concurrently, each on its own connection '
+                    '(remote sources only). The results are returned in the same order as the calls, each with either '
+                    'result, error or skipped.',
+        body=hydra_batch_fields
+    )
+    def post(self):
+        data = request.json or {}
+        calls = data.get('calls') if isinstance(data, dict) else data
+        concurrent = data.get('concurrent', False) if isinstance(data, dict) else False
+
+        if not isinstance(calls, list):
+            return jsonify(error='calls must be a list'), 400
+        if len(calls) > HYDRA_BATCH_SIZE:
+            return jsonify(error='Too many calls; the most allowed is {}'.format(HYDRA_BATCH_SIZE)), 400
+        for i, call in enumerate(calls):
+            if not isinstance(call, dict) or not isinstance(call.get('function'), str) \
+                    or not isinstance(call.get('args', []), list) or not isinstance(call.get('kwargs', {}), dict):
+                return jsonify(error='Call {} must have a function, and optionally a list of args and a dictionary '
+                                     'of kwargs'.format(i)), 400
+
+        if g.get('conn') is None:
+            return jsonify(error='No data connection'), 401
+
+        uid = g.datauser.userid if g.get('datauser') else None
+        calls = [{
+            'function': call['function'],
+            'args': call.get('args', []),
+            'kwargs': dict(call.get('kwargs', {}), uid=call.get('kwargs', {}).get('uid', uid)),
+        } for call in calls]
+
+        results = g.conn.call_batch(calls, concurrent=concurrent)
+        return jsonify(results=results)
+
 
 @hydra.route('/<string:function_name>')
 class Hydra(Resource):
@@ -26,7 +82,7 @@ class Hydra(Resource):
             if not hydra_args and not hydra_kwargs:
                 hydra_kwargs = data
             hydra_kwargs['uid'] = hydra_kwargs.pop('uid', g.datauser.userid)
-            resp = g.conn.call(function_name, *hydra_args, **hydra_kwargs)
+            resp = g.conn.call(function_name, *hydra_args, raw=True, **hydra_kwargs)
             return jsonify(resp)
         except AttributeError:
             return "Server error. g.conn not defined?"
@@ -1,13 +1,33 @@
 from flask import current_app as app
 from munch import Munch as AttrDict
 
+from openagua.lib.fetch import fetch_ordered, log_timings
+from openagua.lib.lazy import LazyAttrDict, LazyList
+from openagua.lib import template_cache
+
 import hydra_base as hb
 from hydra_base.lib import objects
 import hydra_client as hc
+import json
 import logging
+import pickle
+import time
+from os import environ
+from threading import Lock
 
 log = logging.getLogger(__name__)
 
+# idle connections kept for reuse, over all keys
+CONNECTION_POOL_SIZE = int(environ.get('OA_CONNECTION_POOL_SIZE', 100))
+# idle connections older than this are dropped
+CONNECTION_IDLE_SECONDS = float(environ.get('OA_CONNECTION_IDLE_SECONDS', 300))
+# idle connections older than this are checked before they are reused
+CONNECTION_CHECK_SECONDS = float(environ.get('OA_CONNECTION_CHECK_SECONDS', 60))
+
+
+def is_read_call(fn):
+    return fn[:4] == 'get_'
+
 
 class HydraConnection(object):
     def __init__(self, url, is_root=False, session_id=None, app_name=None, user_id=None, username=None,
@@ -19,6 +39,11 @@ class HydraConnection(object):
         self.session_id = session_id
         self.username = username
         self.user_id = user_id
+        self.in_transaction = False
+        self.memo = {}
+        self.report = {}
+        self.memo_lock = Lock()
+        self.reset_memo()
 
         if url == 'base':
             self.hc = hc.JSONConnection(
@@ -34,6 +59,30 @@ class HydraConnection(object):
             if username is not None and password is not None:
                 self.login(username, password)
 
+    @property
+    def pool_key(self):
+        '''The key the connection is pooled by: root connections by root user, others by user and data session'''
+        if self.is_root:
+            return self.url, 'root', self.username
+        return self.url, self.user_id, self.session_id
+
+    def copy(self):
+        '''Make a new connection with the same data session, e.g., for another thread, since connections have state'''
+        return HydraConnection(url=self.url, is_root=self.is_root, session_id=self.session_id, app_name=self.app_name,
+                               user_id=self.user_id, username=self.username)
+
+    def close(self):
+        '''Release the database session of the current thread, for local sources'''
+        if self.url == 'base':
+            hb.db.DBSession.remove()
+
+    def is_healthy(self):
+        '''Check that the connection (and its data session) still works, with a cheap call'''
+        if not self.username:
+            return True
+        user = self.call('get_user_by_name', self.username)
+        return bool(user) and 'error' not in user
+
     def login(self, username, password):
         self.session_id = None
         self.username = username
@@ -41,7 +90,23 @@ class HydraConnection(object):
         self.user_id = self.hc.user_id
         self.session_id = self.hc.session_id
 
-    def call(self, fn, *args, **kwargs):
+    def call(self, fn, *args, raw=False, **kwargs):
+        """
+        Call a Hydra function.
+
+        Responses are wrapped for attribute access (see lib.lazy), which wraps nested values only as they are used.
+        Callers that only pass a response on, e.g., with jsonify, can ask for the raw response instead.
+
+        Responses to get_ calls are remembered until the next call that isn't a get_ call, or until reset_memo is
+        called at the start of the next request, so repeated reads in a request call Hydra only once. A response is
+        kept as it is and only copied (pickled) when it is read again, so reads made once cost nothing extra; changes
+        the first reader makes to its nested values, without writing them, are seen by later reads. Calls, hits and
+        time spent in Hydra are counted in the connection's report.
+
+        :param fn: The Hydra function name
+        :param raw: Return the response as Hydra returns it, without wrapping it
+        :return: The response, or a dictionary with the error
+        """
 
         # Convert any boolean parameters to 'Y' or 'N'.
         # This is conditional - some Hydra functions take Y/N, others take True/False.
@@ -53,19 +118,156 @@ class HydraConnection(object):
                 if item in kwargs and 'owners' in kwargs[item]:
                     del kwargs[item]['owners']
         args = tuple([dict(arg) if isinstance(arg, AttrDict) else arg for arg in list(args)])
+
+        memo_key = None
+        if is_read_call(fn):
+            try:
+                memo_key = json.dumps([fn, args, kwargs], sort_keys=True, default=str)
+            except TypeError:
+                pass  # e.g., keys of mixed types, which can't be sorted
+            data = None
+            with self.memo_lock:
+                if memo_key is not None and memo_key in self.memo:
+                    data = self.memo[memo_key]
+                    if not isinstance(data, bytes):
+                        # the response is pickled on its first repeat, so each later caller gets its own copy
+                        try:
+                            data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+                            self.memo[memo_key] = data
+                        except Exception as err:
+                            log.debug('Could not remember the response to {}: {}'.format(fn, err))
+                            del self.memo[memo_key]
+                            data = None
+                    if data is not None:
+                        self.report['hits'] += 1
+            if data is not None:
+                resp = pickle.loads(data)
+                return resp if raw else self.wrap(resp)
+        else:
+            # a write might change anything read so far
+            with self.memo_lock:
+                self.memo.clear()
+
+        start = time.time()
         try:
             # TODO: this is potentially dangerous. double check that this doesn't have unintended consequences
-            self.hc.autocommit = fn[:4] != 'get_'
+            self.hc.autocommit = not is_read_call(fn) and not self.in_transaction
             resp = self.hc.call(fn, *args, **kwargs)
         except Exception as err:
             return {'error': str(err)}
+        finally:
+            with self.memo_lock:
+                self.report['calls'] += 1
+                self.report['seconds'] += time.time() - start
+            if template_cache.is_template_write(fn):
+                template_cache.invalidate(self.url)
+
+        if memo_key is not None:
+            with self.memo_lock:
+                self.memo[memo_key] = resp
+        if raw:
+            return resp
+        # hb.db.DBSession.close()
+        return self.wrap(resp)
+
+    @staticmethod
+    def wrap(resp):
         if isinstance(resp, objects.JSONObject):
-            resp = AttrDict(resp)
+            resp = LazyAttrDict(resp)
         elif type(resp) == list:
-            resp = [AttrDict(x) for x in resp]
-        # hb.db.DBSession.close()
+            resp = LazyList(resp, wrap_all=True)
         return resp
 
+    def reset_memo(self):
+        '''Forget the reads remembered for the current request and start a new report of its Hydra calls'''
+        with self.memo_lock:
+            self.memo.clear()
+            self.report = {'calls': 0, 'hits': 0, 'seconds': 0.0}
+
+    def call_batch(self, calls, concurrent=False):
+        """
+        Call several Hydra functions in order.
+
+        On a local source (url 'base') the calls run in one transaction, which is committed if all of them succeed and
+        rolled back otherwise. Calls after a failed call are skipped, since they may depend on it.
+
+        :param calls: The calls, as dictionaries of function, args and kwargs
+        :param concurrent: Run consecutive read (get_) calls concurrently, each on its own pooled connection, since
+            connections have state. This is only done for remote sources, since reads on a local source share the
+            batch's database session and transaction.
+        :return: The results, in the same order as the calls, as dictionaries of either result, error or skipped
+        """
+
+        is_local = self.url == 'base'
+        key = self.pool_key
+
+        def call_one(call):
+            return self.call(call['function'], *call.get('args', []), raw=True, **call.get('kwargs', {}))
+
+        def call_read(call):
+            conn = connection_pool.checkout(key, self.copy)
+            try:
+                resp = conn.call(call['function'], *call.get('args', []), raw=True, **call.get('kwargs', {}))
+                return resp, dict(conn.report)
+            finally:
+                connection_pool.checkin(conn, key)
+
+        results = []
+        failed = False
+        self.in_transaction = is_local
+        try:
+            i = 0
+            while i < len(calls):
+                if failed:
+                    results.append({'skipped': True})
+                    i += 1
+                    continue
+
+                j = i + 1
+                if concurrent and not is_local and is_read_call(calls[i]['function']):
+                    while j < len(calls) and is_read_call(calls[j]['function']):
+                        j += 1
+                group = calls[i:j]
+
+                if len(group) > 1:
+                    outcomes, errors, timings = fetch_ordered(call_read, group, retries=0)
+                    log_timings(timings, label='hydra batch')
+                    resps = []
+                    for outcome, error in zip(outcomes, errors):
+                        if error:
+                            resps.append({'error': str(error)})
+                            continue
+                        resp, report = outcome
+                        with self.memo_lock:
+                            self.report['calls'] += report['calls']
+                            self.report['seconds'] += report['seconds']
+                        resps.append(resp)
+                else:
+                    resps = [call_one(group[0])]
+
+                for call, resp in zip(group, resps):
+                    if isinstance(resp, dict) and 'error' in resp:
+                        results.append({'error': resp['error']})
+                        failed = True
+                    else:
+                        results.append({'result': resp})
+                i = j
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.in_transaction = False
+            if is_local:
+                if failed:
+                    hb.rollback_transaction()
+                else:
+                    hb.commit_transaction()
+                if any(template_cache.is_template_write(call['function']) for call in calls):
+                    # templates may have been read and cached from the session before the batch was committed
+                    template_cache.invalidate(self.url)
+
+        return results
+
     def update_add_data_user(self, admin_username, admin_password, username, password, role='modeller'):
 
         # login with admin account
@@ -87,7 +289,7 @@ class HydraConnection(object):
     def get_user_by_name(self, username):
         user = self.call('get_user_by_name', username)
         if user:
-            del user['password']
+            user.pop('password', None)
         return user
 
     def get_link(self, link_id):
@@ -142,6 +344,165 @@ class HydraConnection(object):
 
         return result
 
+    def get_res_attrs_data(self, keys, scenario_id):
+        """
+        Get the data for several resource attributes from one scenario in a single call.
+
+        :param keys: Resource attribute keys of the form [network_id/]resource_type/resource_id/attr_id
+        :param scenario_id: The scenario ID
+        :return: A dictionary of datasets keyed by resource attribute key. Keys without data are omitted.
+        """
+
+        lookup = {}
+        resource_ids = {}
+        attr_ids = set()
+        for key in keys:
+            resource_type, resource_id, attr_id = key.split('/')[-3:]
+            ref_key = resource_type.upper()
+            resource_ids.setdefault(ref_key, set()).add(int(resource_id))
+            attr_ids.add(int(attr_id))
+            lookup[(ref_key, int(resource_id), int(attr_id))] = key
+
+        if not lookup:
+            return {}
+
+        kwargs = {'{}_ids'.format(ref_key.lower()): list(ids) for ref_key, ids in resource_ids.items()}
+        scenarios = self.call('get_scenarios_data', scenario_id=[scenario_id], attr_id=list(attr_ids), **kwargs)
+        if 'error' in scenarios:
+            return {}
+
+        data = {}
+        for scenario in scenarios:
+            for rs in scenario.get('resourcescenarios', []):
+                res_attr = rs.get('resourceattr') or rs
+                ref_key = res_attr.get('ref_key')
+                if not ref_key:
+                    continue
+                ref_id = res_attr.get('{}_id'.format(ref_key.lower()))
+                key = lookup.get((ref_key, ref_id, res_attr.get('attr_id')))
+                dataset = rs.get('value') or rs.get('dataset')
+                if key is None or not dataset:
+                    continue
+                metadata = dataset.get('metadata')
+                if isinstance(metadata, dict) and 'function' in metadata:
+                    metadata['function'] = str(metadata['function'])
+                data[key] = dataset
+
+        return data
+
+
+class ConnectionPool(object):
+    """
+    A pool of idle Hydra connections, so that each request doesn't create (and, for root connections, log in) a new
+    connection and its HTTP session.
+
+    A connection is checked out by one request at a time, so greenlets never share one, and the pool's lock is
+    gevent's once the app is monkey patched. Connections idle for longer than idle_seconds are dropped, and those idle
+    for longer than check_seconds are checked before they are reused.
+    """
+
+    def __init__(self, maxsize=CONNECTION_POOL_SIZE, idle_seconds=CONNECTION_IDLE_SECONDS,
+                 check_seconds=CONNECTION_CHECK_SECONDS):
+        self.maxsize = maxsize
+        self.idle_seconds = idle_seconds
+        self.check_seconds = check_seconds
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self.failed_checks = 0
+        self._idle = {}
+        self._size = 0
+        self._lock = Lock()
+
+    def _evict_expired(self, now):
+        for key in list(self._idle):
+            idle = [(conn, last_used) for conn, last_used in self._idle[key] if now - last_used < self.idle_seconds]
+            self.evicted += len(self._idle[key]) - len(idle)
+            self._size -= len(self._idle[key]) - len(idle)
+            if idle:
+                self._idle[key] = idle
+            else:
+                del self._idle[key]
+
+    def _evict_oldest(self):
+        key, i = min(((key, i) for key, idle in self._idle.items() for i in range(len(idle))),
+                     key=lambda ki: self._idle[ki[0]][ki[1]][1])
+        self._idle[key].pop(i)
+        if not self._idle[key]:
+            del self._idle[key]
+        self._size -= 1
+        self.evicted += 1
+
+    def checkout(self, key, make):
+        """
+        Get an idle connection for a key, or make a new one.
+
+        :param key: The pool key, as given by HydraConnection.pool_key
+        :param make: A function to make a new connection
+        :return: The connection
+        """
+
+        while True:
+            with self._lock:
+                now = time.time()
+                self._evict_expired(now)
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                conn, last_used = idle.pop()  # the most recently used, which is least likely to have gone stale
+                if not idle:
+                    del self._idle[key]
+                self._size -= 1
+
+            if now - last_used < self.check_seconds or conn.is_healthy():
+                self.reused += 1
+                conn.reset_memo()
+                return conn
+            self.failed_checks += 1
+            log.info('Dropped pooled connection to {} that failed its check'.format(conn.url))
+
+        self.created += 1
+        return make()
+
+    def checkin(self, conn, key):
+        """
+        Return a connection to the pool.
+
+        Connections whose key has changed since they were checked out, e.g., by logging in as another user, are not
+        kept, so they can't be handed to the wrong user.
+
+        :param conn: The connection
+        :param key: The key the connection was checked out with
+        """
+
+        if conn is None or conn.pool_key != key or not self.maxsize:
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.time()))
+            self._size += 1
+            while self._size > self.maxsize:
+                self._evict_oldest()
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': self._size,
+                'keys': len(self._idle),
+                'maxsize': self.maxsize,
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'failed_checks': self.failed_checks,
+            }
+
+
+connection_pool = ConnectionPool()
+
 
 def root_connection(url=None):
     conn = HydraConnection(
@@ -152,3 +513,10 @@ def root_connection(url=None):
             is_root=True
         )
     return conn
+
+
+def pooled_root_connection(url=None):
+    '''Check out a root connection from the connection pool, logging in only if there isn't one'''
+    url = url or app.config['DATA_URL']
+    key = (url, 'root', app.config['DATA_ROOT_USERNAME'])
+    return connection_pool.checkout(key, lambda: root_connection(url)), key
@@ -20,6 +20,7 @@ from openagua.lib.utils import readfromzip, shapefile2geojson, get_resource_name
 from openagua.security import current_user
 from openagua.lib.files import bulk_upload_data
 from openagua.lib.templates import get_default_types, prepare_template_for_import
+from openagua.lib.template_cache import get_template_by_name
 from openagua.lib.networks import add_network, make_node
 
 from openagua.lib.misc import striprtf
@@ -42,7 +43,7 @@ def import_from_weap(conn, file, project_id, network_name=None, template_name=No
     bucket_name = current_app.config.get('AWS_S3_BUCKET')
 
     # prepare template
-    template = conn.call('get_template_by_name', template_name)
+    template = get_template_by_name(conn, template_name)
     new_template = prepare_template_for_import(template, internal=True)
     new_template['layout']['project_id'] = project_id
 
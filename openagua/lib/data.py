@@ -3,22 +3,29 @@ from copy import copy
 from munch import Munch as AttrDict
 from itertools import product
 from ast import literal_eval
-import queue
+from os import environ
 
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool, Process, Queue
 
 from datetime import datetime
 # import dask.dataframe as dd
+import numpy
 import pandas as pd
 
 from flask import g, json, current_app
 
-from openagua.lib.evaluators import OpenAguaEvaluator, PywrEvaluator, BasicEvaluator
-from openagua.lib.evaluators.utils import make_default_value, empty_data_timeseries, make_timesteps
+from openagua.lib.evaluators import OpenAguaEvaluator, PywrEvaluator, BasicEvaluator, codec
+from openagua.lib.evaluators.openagua_evaluator import compile_function, get_function, get_referenced_keys
+from openagua.lib.evaluators.utils import make_default_value, empty_data_timeseries, make_timesteps, get_timestep_grid
 
-from openagua.utils import get_tattrs
+from openagua.connection import connection_pool
+from openagua.lib.template_cache import get_template_lookups
 from openagua.lib.scenarios import get_data_scenarios
+from openagua.lib.fetch import fetch_ordered, log_timings
+from openagua.lib.frames import LongFrame, concat_frames, format_dates, to_categoricals, to_dates
+from openagua.lib.results_cache import get_results
+from openagua.lib.results_store import read_results, get_date_range, get_rollup, has_rollup
 
 
 def make_eval_data(conn=None, dataset=None, function_language=('python', 'openagua'), **kwargs):
@@ -45,19 +52,57 @@ def get_evaluator(function_language, **kwargs):
     return evaluator
 
 
-def get_scenarios_data(conn, scenario_ids, function_language=('python', 'openagua'), **kwargs):
+# scenarios in a lineage are evaluated concurrently by a bounded, process-wide pool of workers; under gevent the
+# workers are greenlets, so this overlaps the scenarios' Hydra reads rather than their evaluation
+SCENARIO_WORKERS = int(environ.get('OA_SCENARIO_WORKERS', 4))
+scenario_pool = ThreadPoolExecutor(max_workers=SCENARIO_WORKERS) if SCENARIO_WORKERS > 1 else None
+
+
+def eval_scenario_data(conn, scenario_id, function_language, **kwargs):
+    kwargs['scenario_id'] = scenario_id
     evaluator = get_evaluator(function_language, conn=conn, **kwargs)
+    kwargs.pop('scenario_id')
+    return get_scenario_data(evaluator, **kwargs)
+
+
+def eval_scenario_data_in_worker(conn, scenario_id, function_language, **kwargs):
+    '''Evaluate a scenario's data in a worker thread, with a connection of its own from the connection pool'''
+    key = conn.pool_key
+    worker_conn = connection_pool.checkout(key, conn.copy)
+    try:
+        return eval_scenario_data(worker_conn, scenario_id, function_language, **kwargs)
+    finally:
+        worker_conn.close()
+        connection_pool.checkin(worker_conn, key)
+
+
+def get_scenarios_data(conn, scenario_ids, function_language=('python', 'openagua'), parallel=True, **kwargs):
+    """
+    Get and evaluate a resource attribute's data for each scenario in a lineage.
+
+    Each scenario gets its own evaluator; the evaluators share the timestep grid and compiled functions. If parallel,
+    the scenarios are evaluated concurrently, each with its own connection. Results are returned in lineage order
+    either way.
+    """
+
+    if parallel and scenario_pool is not None and len(scenario_ids) > 1:
+        futures = [
+            scenario_pool.submit(eval_scenario_data_in_worker, conn, scenario_id, function_language, **kwargs)
+            for scenario_id in scenario_ids
+        ]
+        results = [future.result() for future in futures]
+    else:
+        results = [eval_scenario_data(conn, scenario_id, function_language, **kwargs) for scenario_id in scenario_ids]
+
     scenarios_data = []
-    for i, scenario_id in enumerate(scenario_ids):
-        evaluator.scenario_id = scenario_id
-        scenario_data = get_scenario_data(evaluator, **kwargs)
+    for i, scenario_data in enumerate(results):
 
         # scenario_data['note'] = ''
 
         if scenario_data['dataset'] is None and i:
             scenario_data = copy(scenarios_data[i - 1])
             scenario_data.update({
-                'id': scenario_id,
+                'id': scenario_ids[i],
                 'dataset': None,
                 'error': 2,
             })
@@ -131,6 +176,112 @@ def get_scenario_data(evaluator, **kwargs):
     return scenario_data
 
 
+def get_resource_attribute_keys(network):
+    '''Get the get() keys of each resource attribute in a network, keyed by resource attribute ID'''
+    keys = {ra.id: 'network/{}/{}'.format(network.id, ra.attr_id) for ra in network.get('attributes', [])}
+    for ref_key in ['node', 'link']:
+        for resource in network.get(ref_key + 's', []):
+            for ra in resource.attributes:
+                keys[ra.id] = '{}/{}/{}'.format(ref_key, resource.id, ra.attr_id)
+    return keys
+
+
+def compile_dataset_function(func, data_type):
+    '''Compile a function, returning an error description if it can't be compiled'''
+    try:
+        compile_function(func, data_type)
+    except SyntaxError as err:
+        return {'error': 'syntax', 'message': err.msg, 'text': (err.text or '').strip()}
+    except Exception as err:
+        return {'error': 'compile', 'message': str(err)}
+
+
+def validate_functions(conn, network_id, scenario_ids=None, max_workers=None):
+    """
+    Compile every function in a network's scenarios ahead of time.
+
+    Compiling warms the process-wide compiled function cache. Syntax errors and get() keys that don't refer to an
+    existing resource attribute are reported.
+
+    :param conn: The Hydra connection
+    :param network_id: The network ID
+    :param scenario_ids: The scenarios to check (default: all of the network's scenarios)
+    :param max_workers: The maximum number of functions compiled at the same time
+    :return: A dictionary with the number of functions found and lists of errors and unresolved keys
+    """
+
+    network = conn.call('get_network', network_id, include_resources=True, include_data=False, summary=False)
+    if 'error' in network:
+        raise Exception(network['error'])
+    scenario_ids = scenario_ids or [s.id for s in network.scenarios]
+    keys = get_resource_attribute_keys(network)
+
+    kwargs = {'network_ids': [network_id]}
+    node_ids = [n.id for n in network.get('nodes', [])]
+    link_ids = [l.id for l in network.get('links', [])]
+    if node_ids:
+        kwargs['node_ids'] = node_ids
+    if link_ids:
+        kwargs['link_ids'] = link_ids
+    scens = conn.call('get_scenarios_data', scenario_id=scenario_ids, **kwargs)
+    if 'error' in scens:
+        raise Exception(scens['error'])
+
+    # collect the functions, compiling each distinct function only once
+    functions = []
+    compiles = {}
+    for sc in scens:
+        for rs in sc.resourcescenarios:
+            dataset = rs.get('dataset') or rs.get('value')
+            func = dataset and get_function(dataset)
+            if not func:
+                continue
+            data_type = dataset.get('type')
+            functions.append((sc.id, rs.resource_attr_id, func, data_type))
+            compiles[(func, data_type)] = None
+
+    with ThreadPoolExecutor(max_workers=max_workers or SCENARIO_WORKERS) as pool:
+        futures = {key: pool.submit(compile_dataset_function, *key) for key in compiles}
+    compiles = {key: future.result() for key, future in futures.items()}
+
+    # resolve get() keys against this network and any other networks referenced
+    other_networks = {}
+    for scenario_id, resource_attr_id, func, data_type in functions:
+        for key in get_referenced_keys(func):
+            parts = key.split('/')
+            if len(parts) == 4 and int(parts[0]) != network_id:
+                other_networks[int(parts[0])] = None
+    for other_network_id in other_networks:
+        other_network = conn.call('get_network', other_network_id, include_resources=True, include_data=False,
+                                  summary=False)
+        if 'error' not in other_network:
+            other_networks[other_network_id] = set(get_resource_attribute_keys(other_network).values())
+    existing_keys = set(keys.values())
+
+    errors = []
+    unresolved = []
+    for scenario_id, resource_attr_id, func, data_type in functions:
+        item = {'scenario_id': scenario_id, 'resource_attr_id': resource_attr_id, 'key': keys.get(resource_attr_id)}
+        error = compiles[(func, data_type)]
+        if error:
+            errors.append(dict(item, **error))
+        for key in get_referenced_keys(func):
+            parts = key.split('/')
+            if len(parts) == 4 and int(parts[0]) != network_id:
+                found = key.split('/', 1)[1] in (other_networks.get(int(parts[0])) or ())
+            else:
+                found = '/'.join(parts[-3:]) in existing_keys
+            if not found:
+                unresolved.append(dict(item, reference=key))
+
+    return {
+        'functions': len(functions),
+        'compiled': len([e for e in compiles.values() if e is None]),
+        'errors': errors,
+        'unresolved': unresolved,
+    }
+
+
 def prepare_dataset(scenario_data, unit_id, attr, data_type, user_id, user_email):
     dataset = scenario_data['dataset']
     # dataset = data['value'] if data is not None and 'value' in data else {}
@@ -169,7 +320,7 @@ def prepare_dataset(scenario_data, unit_id, attr, data_type, user_id, user_email
             value = json.dumps(value)
         elif data_type == 'array':
             def parse_row(item):
-                if type(item) != list:
+                if not isinstance(item, list):
                     try:
                         val = literal_eval(item)
                         if type(val) in [float, int]:
@@ -289,6 +440,28 @@ def save_data(conn, res_attr_id, attr, unit, data_type, scenario_data, metadata)
     return returncode
 
 
+def get_time_settings(scenario, get_scenario):
+    """
+    Get the start, end and time step of a scenario, inherited from its nearest ancestor if it doesn't have them.
+
+    :param scenario: The scenario
+    :param get_scenario: A function to get a scenario by ID
+    :return: The time settings, or None if the scenario's ancestry doesn't have them
+    """
+
+    visited = set()
+    while scenario is not None and scenario.get('id') not in visited:
+        if scenario.get('start_time') and scenario.get('end_time') and scenario.get('time_step'):
+            return {'start': scenario['start_time'], 'end': scenario['end_time'], 'span': scenario['time_step']}
+        layout = scenario.get('layout') or {}
+        if layout.get('class') == 'baseline':
+            return None
+        visited.add(scenario.get('id'))
+        scenario = get_scenario(layout.get('parent'))
+
+    return None
+
+
 def filter_input_data(conn, network_id, template_id, filters, maxrows=None, include_tags=False):
     scenarios = filters.get('scenarios', [])
     attrs = filters.get('attrs')
@@ -298,9 +471,6 @@ def filter_input_data(conn, network_id, template_id, filters, maxrows=None, incl
 
     data_type = filters.get('data_type', 'timeseries')
 
-    dfs = []
-    # nRows = 0
-
     if input_method != 'native':
         idx_names = ['Scenario', 'Feature type', 'Feature', 'Variable']
     else:
@@ -311,86 +481,77 @@ def filter_input_data(conn, network_id, template_id, filters, maxrows=None, incl
         elif data_type == 'periodic timeseries':
             idx_names = ['Year', 'Month', 'Scenario', 'Feature type', 'Feature', 'Variable', 'Block']
 
-    tag_names = []
-
     # get resource_attributes
-    template = conn.call('get_template', template_id)
+    lookups = get_template_lookups(conn, template_id)
 
-    ttype_dict = {tt.id: tt for tt in template.templatetypes}
-    tattr_dict = get_tattrs(template)
+    template = lookups.template
+    ttype_dict = lookups.ttypes
+    tattr_dict = lookups.tattrs
 
+    # only resources with the requested attributes are queried
     res_info = {}
-    scenario_data_kwargs = {'scenario_id': scenarios}
-    networks = []
-    nodes = []
-    links = []
+    resource_ids = {'NETWORK': [], 'NODE': [], 'LINK': []}
 
     resources = conn.call('get_resources_of_type', network_id=network_id, type_id=ttypes)
     for resource in resources:
-        ref_key = resource['ref_key']
-        if ref_key == 'LINK':
-            links.append(resource.id)
-        elif ref_key == 'NODE':
-            nodes.append(resource.id)
-        else:
-            networks.append(resource.id)
-        type_id = [t.id for t in resource.types if t.template_id == template.id][0]
+        type_ids = [t.id for t in resource.types if t.template_id == template.id]
+        if not type_ids or ttypes and type_ids[0] not in ttypes:
+            continue
+        type_id = type_ids[0]
         for ra in resource.attributes:
             # if not incl_vars and ra.attr_is_var == 'Y':
             #     continue
-            if ra.attr_id not in attrs:
-                continue
-            if type_id not in ttypes:
+            if attrs and ra.attr_id not in attrs or ra.attr_id not in tattr_dict:
                 continue
-            # res_attr = {'res_name': resource.name, 'res_type': ttype}
-            # res_attr.update(tattrs[ra.attr_id])
             res_info[ra.id] = {
                 'name': resource.name,
                 'type_name': ttype_dict[type_id]['name'],
                 'attr_name': tattr_dict[ra.attr_id]['attr']['name']
             }
+            ref_ids = resource_ids.get(resource['ref_key'], resource_ids['NETWORK'])
+            if resource.id not in ref_ids:
+                ref_ids.append(resource.id)
 
-    if networks:
-        scenario_data_kwargs['network_ids'] = networks
-    if nodes:
-        scenario_data_kwargs['node_ids'] = nodes
-    if links:
-        scenario_data_kwargs['link_ids'] = links
+    if not res_info:
+        return None
+
+    scenario_data_kwargs = {'scenario_id': scenarios}
+    for ref_key, ids in resource_ids.items():
+        if ids:
+            scenario_data_kwargs['{}_ids'.format(ref_key.lower())] = ids
     if attrs:
         scenario_data_kwargs['attr_id'] = attrs
     if ttypes:  # doesn't appear to have any effect in Hydra
         scenario_data_kwargs['type_id'] = ttypes
 
     scens = g.conn.call('get_scenarios_data', **scenario_data_kwargs)
+    if 'error' in scens:
+        return None
 
-    if 'timeseries' in data_type:
-        network = conn.call('get_network', network_id, include_data=True, include_resources=False,
-                            summary=False)
-        scenario_lookup = {s.id: s for s in network.scenarios}
+    # scenarios without time settings inherit them; ancestors are looked up without their data, and only if needed
+    scenario_lookup = {}
 
-    nrows = 0
-    for sc in scens:
-        scen_name = sc.name
+    def get_scenario(scenario_id):
+        if not scenario_lookup:
+            scenario_lookup.update({s['id']: s for s in conn.call('get_scenarios', network_id)})
+        return scenario_lookup.get(scenario_id)
 
-        if 'timeseries' in data_type:
-            start_time = sc.get('start_time')
-            end_time = sc.get('end_time')
-            time_step = sc.get('time_step')
+    frame = LongFrame(labels=['Scenario', 'Feature type', 'Feature', 'Variable'])
+    timeseries = input_method == 'native' and data_type in ['timeseries', 'periodic timeseries']
 
-            child = sc
+    if include_tags:
+        value_tags = get_scenarios_value_tags(conn, network_id, [sc.id for sc in scens])
 
-            while not (start_time and end_time and time_step):
-                if child.layout.get('class') == 'baseline':
-                    return None
-                else:
-                    parent_id = child.layout.get('parent')
-                    ancestor = scenario_lookup.get(parent_id)
-                    start_time = ancestor.get('start_time')
-                    end_time = ancestor.get('end_time')
-                    time_step = ancestor.get('time_step')
-                    child = ancestor
+    for sc in scens:
+        scen_name = sc.name
+
+        if timeseries:
+            time_settings = get_time_settings(sc, get_scenario)
+            if not time_settings:
+                return None
 
-                empty_timeseries = make_empty_timeseries(scenario=sc)
+            grid = get_timestep_grid(time_settings)
+            empty_timeseries = codec.Timeseries(grid.dates, [0], numpy.full((len(grid.dates), 1), numpy.nan), False)
 
         resourcescenarios = {rs.resource_attr_id: rs for rs in sc.resourcescenarios}
 
@@ -406,19 +567,18 @@ def filter_input_data(conn, network_id, template_id, filters, maxrows=None, incl
                     else:
                         value = metadata['data']
                 else:
-                    if data_type == 'timeseries':
-                        value = pd.read_json(rs.value.value or '{}')
-                        if value.empty:
-                            value = empty_timeseries.copy(deep=True)
+                    if timeseries:
+                        value = codec.loads(rs.value.value)
+                        if not len(value.dates):
+                            value = empty_timeseries
                     else:
                         value = rs.value.value
 
-
             else:
                 if input_method != 'native':
                     value = ''
-                elif data_type == 'timeseries':
-                    value = empty_timeseries.copy(deep=True)
+                elif timeseries:
+                    value = empty_timeseries
                 elif data_type == 'scalar':
                     value = ''
                 elif data_type == 'descriptor':
@@ -426,64 +586,52 @@ def filter_input_data(conn, network_id, template_id, filters, maxrows=None, incl
                 metadata = {}
                 # continue
 
-            if input_method != 'native' or data_type not in ['timeseries', 'periodic timerseries', 'array']:
-                df = pd.DataFrame([value], columns=['value'])
+            labels = {
+                'Scenario': scen_name,
+                'Feature': res['name'],
+                'Feature type': res['type_name'],
+                'Variable': res['attr_name'],
+            }
+
+            # add value tags
+            if include_tags:
+                labels.update(value_tags[sc.id])
+
+            if not timeseries:
+                frame.append(labels, value=numpy.array([value], dtype=object))
 
             # the following needs updating if more than one timeseries item, but it is otherwise effective
-            elif data_type in ['timeseries', 'periodic timeseries']:
-                # df = pd.read_json(value)
-                df = value
-                df.index.name = 'date'
-                df.reset_index(inplace=True)
-                df = pd.melt(df, id_vars=['date'], var_name='Block', value_name='value')
-                # df.set_index(['date','Block'])
-
-                if data_type == 'timeseries':
-                    df['Date'] = df.date.dt.strftime('%Y-%m-%d')
-                df['Year'] = df.date.dt.year
-                df['Month'] = df.date.dt.month  # TODO: get smallest time unit from settings?
+            else:
+                columns = codec.to_long(value.dates, value.blocks, value.values)
 
                 # TODO: Delete these - "has_blocks" should be specified in template attribute layout
                 attr_name = res['attr_name'].lower()
                 if 'demand' not in attr_name or 'priority' not in attr_name:
-                    df['Block'] = 'None'
+                    labels['Block'] = 'None'
+                else:
+                    labels['Block'] = columns['block']
 
-            df['Scenario'] = scen_name
-            df['Feature'] = res['name']
-            df['Feature type'] = res['type_name']
-            df['Variable'] = res['attr_name']
-            if 'date' in df:
-                del df['date']
+                frame.append(labels, date=columns['date'], value=columns['value'])
 
-            nrows += len(df)
-            if maxrows and nrows > maxrows:
+            if maxrows and frame.nrows > maxrows:
                 return -1
 
-            # add value tags
-            if include_tags:
-                value_tags = get_value_tags(conn, sc.id)
-
-                if value_tags:
-                    for vt in value_tags:
-                        df[vt.name] = vt.value
-                        tag_names.append(vt.name)
-
-            dfs.append(df)
+    if frame.nrows:
+        data = frame.to_frame()
 
-    if dfs:
-        data = pd.concat(dfs)
-        data.fillna('', inplace=True)
+        if timeseries:
+            dates = pd.DatetimeIndex(data.pop('date'))
+            if data_type == 'timeseries':
+                data['Date'] = format_dates(dates, '%Y-%m-%d')
+            data['Year'] = dates.year.to_numpy().astype('int16')
+            data['Month'] = dates.month.to_numpy().astype('int8')  # TODO: get smallest time unit from settings?
 
-        data.set_index(idx_names, inplace=True)
+        # missing values (e.g., from empty timeseries) are "", as NaN isn't valid JSON
+        values = data['value']
+        if values.isnull().any():
+            data['value'] = values.astype(object).where(values.notnull(), '')
 
-        # variables = data.index.get_level_values('Variable').unique()
-
-        data.reset_index(col_level=0, inplace=True)
-
-        if type(data) == int and data == -1:
-            return
-
-        return data
+        return data[idx_names + [c for c in data.columns if c not in idx_names]]
 
 
 def make_empty_timeseries(scenario, dates_as_string=None, res_info=None):
@@ -496,9 +644,9 @@ def make_empty_timeseries(scenario, dates_as_string=None, res_info=None):
             if not res:
                 continue
 
-            val = json.loads(rs.value.value)
-            if val:
-                empty_timeseries = pd.read_json(rs.value.value) * 0
+            ts = codec.loads(rs.value.value)
+            if len(ts.dates):
+                empty_timeseries = codec.to_pandas(ts.dates, ts.blocks, ts.values * 0)
                 break
 
     return empty_timeseries
@@ -524,7 +672,7 @@ def get_data_from_hydra(conn, network_id, scenarios, networks, nodes, links, tty
 
     # 2. Organize the data to send back to the client
 
-    dfs = []
+    frame = LongFrame()
     tag_names = []
     empty_timeseries = None
 
@@ -540,13 +688,17 @@ def get_data_from_hydra(conn, network_id, scenarios, networks, nodes, links, tty
         source_scenarios = conn.call('get_scenarios', network_id, scenario_ids=source_scenario_ids)
         source_scenarios = {s['id']: s for s in source_scenarios}
 
-    nrows = 0
-
     perturbations = []
 
+    scenario_tags = {}
+    if include_tags:
+        scenario_tags = get_scenarios_value_tags(conn, network_id, [sc.id for sc in scens])
+
     for sc in scens:
         # scen_name = sc.name
 
+        # add variations/perturbations
+        variations = {}
         variation = sc.layout.get('variation', [])  # variation = perturbation
         for v in variation:
             source_scenario = source_scenarios[v['scenario_id']]
@@ -555,6 +707,18 @@ def get_data_from_hydra(conn, network_id, scenarios, networks, nodes, links, tty
             variation_set_name = variation_set['name']
             if variation_set_name not in perturbations:
                 perturbations.append(variation_set_name)
+            variation_val = v['variation']
+            if isinstance(variation_val, dict):
+                variation_val = variation_val['name']
+
+            # variation_name = f'{variation_set_name} {variation_val:02}'
+            variations[variation_set_name] = variation_val
+
+        # add value tags
+        value_tags = scenario_tags.get(sc.id, {})
+        for tag_name in value_tags:
+            if tag_name not in tag_names:
+                tag_names.append(tag_name)
 
         for rs in sc['resourcescenarios']:
             dataset = rs.get('dataset')
@@ -564,70 +728,42 @@ def get_data_from_hydra(conn, network_id, scenarios, networks, nodes, links, tty
                 dataset = conn.call('get_dataset', dataset_id)
             if not dataset:
                 continue
-            value = dataset['value']
-            if not json.loads(value):
+            ts = codec.loads(dataset['value'])
+            if not len(ts.dates):
                 if empty_timeseries is None:
-                    timesteps = make_timesteps(start=sc.start_time, end=sc.end_time, span=sc.time_step)
-                    dates_as_string = [t.date_as_string for t in timesteps]
-                    empty_timeseries = make_empty_timeseries(scenario=sc, dates_as_string=dates_as_string)
-                df = empty_timeseries
-            else:
-                # the following needs updating if more than one timeseries item, but it is otherwise effective
-                df = pd.read_json(value)
-            df.index.name = 'date'
-            df.reset_index(inplace=True)
-            df['scenario_id'] = sc.id
-            df['resource_attr_id'] = rs.resource_attr_id
+                    grid = get_timestep_grid({'start': sc.start_time, 'end': sc.end_time, 'span': sc.time_step})
+                    empty_timeseries = codec.Timeseries(grid.dates, [0], numpy.full((len(grid.dates), 1), numpy.nan),
+                                                        False)
+                ts = empty_timeseries
 
             if rs.resource_attr_id not in res_attrs:
                 res_attrs[rs.resource_attr_id] = g.conn.call('get_resource_attribute', rs.resource_attr_id)
-            df['attr_id'] = res_attrs[rs.resource_attr_id].attr_id
-
-            # # add variations/perturbations
-            for v in variation:
-                source_scenario = source_scenarios[v['scenario_id']]
-                variation_sets = {v['id']: v for v in source_scenario['layout'].get('variation_sets', [])}
-                variation_set = variation_sets[v['variation_set_id']]
-                variation_set_name = variation_set['name']
-                variation_val = v['variation']
-                if isinstance(variation_val, dict):
-                    variation_val = variation_val['name']
-
-                # variation_name = f'{variation_set_name} {variation_val:02}'
-                df[variation_set_name] = variation_val
-
-            id_vars = ['scenario_id'] + perturbations + ['resource_attr_id', 'attr_id', 'date']
-            df = pd.melt(df, id_vars=id_vars, var_name='block', value_name='value')
-
-            nrows += len(df)
-            if maxrows and nrows > maxrows:
-                return -1
 
-            # add value tags
-            if include_tags:
-                value_tags = get_value_tags(conn, sc.id)
-
-                if value_tags:
-                    for vt in value_tags:
-                        df[vt['name']] = vt.value
-                        tag_names.append(vt.name)
+            # the following needs updating if more than one timeseries item, but it is otherwise effective
+            columns = codec.to_long(ts.dates, ts.blocks, ts.values)
+            labels = {
+                'scenario_id': sc.id,
+                'resource_attr_id': rs.resource_attr_id,
+                'attr_id': res_attrs[rs.resource_attr_id].attr_id,
+                'block': columns['block'],
+            }
+            labels.update(variations)
+            labels.update(value_tags)
+            frame.append(labels, date=columns['date'], value=columns['value'])
 
-            dfs.append(df)
+            if maxrows and frame.nrows > maxrows:
+                return -1
 
-    if include_tags:
-        tag_names = set(tag_names)
-        for i in range(len(dfs)):
-            for tag_name in tag_names:
-                if tag_name not in dfs[i]:
-                    dfs[i][tag_name] = None
-    else:
-        tag_names = []
+    dfs = []
+    if frame.nrows:
+        columns = ['scenario_id'] + perturbations + ['resource_attr_id', 'attr_id', 'date', 'block', 'value']
+        dfs.append(frame.to_frame(columns=columns + tag_names))
 
     return dfs, perturbations, tag_names
 
 
 def get_data_from_store(network, template_id, scenario, version, network_ids, node_ids, link_ids, attr_ids, root_key,
-                        data_location='s3', include_tags=False, maxrows=100000):
+                        data_location='s3', include_tags=False, maxrows=100000, start=None, end=None, rollup=None):
     bucket_name = current_app.config['AWS_S3_BUCKET']
 
     run_name = scenario.layout.get('run')
@@ -686,14 +822,15 @@ def get_data_from_store(network, template_id, scenario, version, network_ids, no
     else:
         base_path = 's3://'
 
-    scenariokey = '{base_path}{bucket_name}/{root_key}/results/{run_name}/{version}/{scenario}'.format(
+    version_path = '{base_path}{bucket_name}/{root_key}/results/{run_name}/{version}'.format(
         base_path=base_path,
         bucket_name=bucket_name,
         root_key=root_key,
         run_name=run_name,
         version=version_id,
-        scenario=scenario.name if human_readable else scenario.id
     )
+    scenario_name = scenario.name if human_readable else scenario.id
+    scenariokey = '{}/{}'.format(version_path, scenario_name)
 
     scenario_key = None
     subscenarios = [1]  # default if no variations
@@ -731,12 +868,9 @@ def get_data_from_store(network, template_id, scenario, version, network_ids, no
 
     def bulk_download_data(s3fs, resource_type, combos, scenario_key):
 
-        dfs = []
-
-        def get_single_csv(s3fs, scenario_id, empty_timeseries, combo, q=None):
+        def make_key(combo):
             subscenario, resource_id, attr_id = combo
-
-            key = csv_path_template.format(
+            return csv_path_template.format(
                 scenariokey=scenariokey,
                 subscenario=subscenario,
                 type=resource_type,
@@ -745,110 +879,102 @@ def get_data_from_store(network, template_id, scenario, version, network_ids, no
                 attr=attr_id
             )
 
-            # if human_readable:
-            #     key = csv_path_template.format(
-            #         scenariokey=scenariokey,
-            #         subscenario=subscenario,
-            #         type=resource_type,
-            #         subtype=rt_lookup[(resource_type, resource_id)],
-            #         resource=resource_id,
-            #         attr=attr_id
-            #     )
-            # else:
-            #     key = csv_path_template.format(
-            #         scenariokey=scenariokey,
-            #         subscenario=subscenario,
-            #         type=resource_type,
-            #         subtype=rt_lookup[(resource_type, resource_id)],
-            #         resource=resource_id,
-            #         attr=attr_id
-            #     )
-
-            # df = empty_timeseries
-            try:
-                if data_location == 's3':
-                    if scenariokey[0] == '/':
-                        df = pd.read_csv(key, skiprows=1, names=['date', 0])
-                    else:
-                        df = pd.read_csv(s3fs.open(key, mode='rb'), skiprows=1, names=['date', 0])
-                elif data_location == 'hdf5':
-                    df = pd.read_hdf('~/store.hdf5', key.replace(base_path, ''))
-            except:
-                if empty_timeseries is None:
-                    dates_as_string = make_timesteps(start=scenario.start_time, end=scenario.end_time,
-                                                     span=scenario.time_step, format='iso')
-                    empty_timeseries = make_empty_timeseries(scenario=scenario, dates_as_string=dates_as_string)
-                    empty_timeseries[0] = None
-                    empty_timeseries.reset_index(inplace=True)
-                df = empty_timeseries
-
-            # df['scenario_id'] = scenario_id
-            #
-            # if human_readable:
-            #     resource_id = res_id_lookup.get((resource_type, resource_id))
-            #     attr_id = attr_id_lookup.get(attr_id)
-            # df['resource_key'] = '%s/%s' % (resource_type, resource_id)
-            # df['attr_id'] = attr_id
-            #
-            # id_vars = ['scenario_id']
-            # if scenario_key is not None:
-            #     for col in scenario_key.columns:
-            #         df[col] = scenario_key[col][subscenario]
-            #         id_vars.append(col)
-            # df = pd.melt(df, id_vars=id_vars + ['resource_key', 'attr_id', 'date'], var_name='block',
-            #              value_name='value')
-
-            if q:
-                q.put(df)
-            else:
-                return df
+        def read_single_csv(key):
+            if data_location == 's3':
+                if scenariokey[0] == '/':
+                    return pd.read_csv(key, skiprows=1, names=['date', 0])
+                else:
+                    return pd.read_csv(s3fs.open(key, mode='rb'), skiprows=1, names=['date', 0])
+            elif data_location == 'hdf5':
+                return pd.read_hdf('~/store.hdf5', key.replace(base_path, ''))
 
-        if scenario_key_path[0] == '/':
-            dfs = [get_single_csv(s3fs, scenario.id, empty_timeseries, combo) for combo in combos]
+        # results are returned in the order of the combos; HDF5 reads aren't thread safe
+        keys = [make_key(combo) for combo in combos]
+        dfs, errors, timings = fetch_ordered(read_single_csv, keys, parallel=data_location != 'hdf5')
+        log_timings(timings, label='results {}'.format(scenario.id))
 
-        else:
-            processes = []
-            q = queue.Queue()
-            for combo in combos:
-                thread = Thread(target=get_single_csv, args=(s3fs, scenario.id, empty_timeseries, combo, q,))
-                thread.start()
-                processes.append(thread)
-            for p in processes:
-                p.join()
-
-            while not q.empty():
-                df = q.get()
-                dfs.append(df)
-
-        updated = []
+        empty_dates = None
+        frame = LongFrame()
         for i, df in enumerate(dfs):
             subscenario, resource_id, attr_id = combos[i]
 
-            df['scenario_id'] = scenario.id
-
             if human_readable:
                 resource_id = res_id_lookup.get((resource_type, resource_id))
                 attr_id = attr_id_lookup.get(attr_id)
-            df['resource_key'] = '%s/%s' % (resource_type, resource_id)
-            df['attr_id'] = attr_id
-
-            id_vars = ['scenario_id']
+            labels = {
+                'scenario_id': scenario.id,
+                'resource_key': '%s/%s' % (resource_type, resource_id),
+                'attr_id': attr_id,
+            }
             if scenario_key is not None:
                 for col in scenario_key.columns:
-                    df[col] = scenario_key[col][subscenario]
-                    id_vars.append(col)
-            df = pd.melt(df, id_vars=id_vars + ['resource_key', 'attr_id', 'date'], var_name='block',
-                         value_name='value')
-            updated.append(df)
+                    labels[col] = scenario_key[col][subscenario]
+
+            if errors[i] is not None or df is None:
+                if empty_dates is None:
+                    empty_dates = get_timestep_grid(
+                        {'start': scenario.start_time, 'end': scenario.end_time, 'span': scenario.time_step}).dates
+                labels['block'] = 0
+                frame.append(labels, date=empty_dates.values, value=numpy.full(len(empty_dates), numpy.nan))
+                continue
+
+            dates = df['date'].values
+            for block in df.columns:
+                if block != 'date':
+                    labels['block'] = block
+                    frame.append(labels, date=dates, value=pd.to_numeric(df[block], errors='coerce').values)
 
-        return updated
+        if not frame.nrows:
+            return []
+
+        id_vars = ['scenario_id'] + (list(scenario_key.columns) if scenario_key is not None else [])
+        df = frame.to_frame(columns=id_vars + ['resource_key', 'attr_id', 'date', 'block', 'value'])
+        df['date'] = to_dates(df['date'])
+
+        return [df]
 
     tag_names = []
     nrows = 0
 
     all_dfs = []
 
+    def get_parquet_data(resource_type, resources):
+        if resource_type == 'network':
+            resource_keys = ['network']
+        else:
+            resource_keys = ['{}/{}'.format(resource_type, r) for r in resources]
+        stored_rollup = rollup if rollup and has_rollup(current_app.s3fs, version_path, rollup[0]) else None
+        df = read_results(current_app.s3fs, version_path, scenario_name, resource_keys=resource_keys,
+                          attrs=attr_names if human_readable else attr_ids, start=start, end=end,
+                          rollup=stored_rollup)
+
+        # labels are mapped by category, rather than by row
+        df['scenario_id'] = pd.Categorical.from_codes(numpy.zeros(len(df), dtype=int), categories=[scenario.id])
+        if resource_type == 'network':
+            df['resource_key'] = pd.Categorical.from_codes(numpy.zeros(len(df), dtype=int),
+                                                           categories=['network/{}'.format(network_ids[0])])
+        elif human_readable:
+            df['resource_key'] = df['resource_key'].astype('category').map(
+                lambda key: '%s/%s' % (resource_type, res_id_lookup.get((resource_type, key.split('/', 1)[1]))))
+        else:
+            df['resource_key'] = df['resource_key'].astype('category')
+        if human_readable:
+            df['attr_id'] = df['attr_id'].astype('category').map(attr_id_lookup)
+        else:
+            df['attr_id'] = df['attr_id'].astype('category').map(int)
+        df['block'] = df['block'].astype('category')
+
+        id_vars = ['scenario_id']
+        if scenario_key is not None:
+            subscenario = df['subscenario'].astype('category')
+            for col in scenario_key.columns:
+                df[col] = subscenario.map(scenario_key[col])
+                id_vars.append(col)
+        return [df[id_vars + ['resource_key', 'attr_id', 'date', 'block', 'value']]]
+
     def get_resource_type_data(resource_type, resources):
+        if data_location == 'parquet':
+            return get_parquet_data(resource_type, resources)
         combos = list(product(*[subscenarios, resources, attr_names if human_readable else attr_ids]))
         return bulk_download_data(current_app.s3fs, resource_type=resource_type, combos=combos,
                                   scenario_key=scenario_key)
@@ -871,64 +997,83 @@ def get_data_from_store(network, template_id, scenario, version, network_ids, no
     return all_dfs, perturbations, tag_names
 
 
+AGG_FUNCTIONS = ['sum', 'mean', 'min', 'max', 'median', 'std', 'count']
+
+
+def get_agg_function(f):
+    '''Get an aggregation function by name, or the quantile of a percentile such as "p90"'''
+    if f in AGG_FUNCTIONS:
+        return f
+    if type(f) == str and f[:1] == 'p' and f[1:].isdigit() and int(f[1:]) <= 100:
+        return int(f[1:]) / 100
+    return None
+
+
+def group_values(data, by, f):
+    grouped = data.groupby(by, observed=True, sort=True)['value']
+    values = grouped.quantile(f) if type(f) == float else grouped.agg(f)
+    return values.reset_index()
+
+
 def aggregate_data(data, agg, idx_names):
+    """
+    Filter and aggregate data by time and space.
+
+    Index columns are grouped as categoricals and dates as datetime64, so grouping works on integer codes.
+
+    :param data: The data, indexed by idx_names, with a value column
+    :param agg: The aggregation: a time "range" (used if its mode is "custom"), a "space" function and a "time"
+        function and "step" ("month" or "year"). Functions are sum, mean, min, max, median, std, count or a
+        percentile, such as "p90".
+    :param idx_names: The index names of the data
+    :return: The aggregated data, indexed by all columns other than value
+    """
     if agg:
 
+        idx_names = list(idx_names)
         data = data.reset_index()
-        data['date'] = pd.to_datetime(data['date'])
+        if not pd.api.types.is_datetime64_any_dtype(data['date']):
+            # each date is repeated for every resource, attribute and block, so parse each only once
+            codes, dates = pd.factorize(data['date'])
+            data['date'] = pd.to_datetime(dates)[codes]
+        for col in idx_names:
+            if col != 'date' and data[col].dtype == object:
+                data[col] = data[col].astype('category')
 
         # time filter
         range = agg.get('range', {})
         if range and range.get('mode') == 'custom':
             start = range.get('start')
             end = range.get('end')
-            if start or end:
-                data.set_index(['date'])
-                if start and end:
-                    mask = (data['date'] >= start) & (data['date'] <= end)
-                elif start and not end:
-                    mask = data['date'] >= start
-                else:
-                    mask = data['date'] <= end
-                data = data.loc[mask]
-                data.reset_index()
+            if start:
+                data = data[data['date'] >= pd.Timestamp(start)]
+            if end:
+                data = data[data['date'] <= pd.Timestamp(end)]
 
         # spatial aggregation
         spatial = agg.get('space', {})
-        f = spatial.get('function')
-        if f in ['sum', 'mean']:
-            idx_names.remove('resource_key')
-            data = data.groupby(idx_names).agg(f).reset_index()
+        f = get_agg_function(spatial.get('function'))
+        if f is not None:
+            idx_names = [c for c in idx_names if c not in ['resource_key', 'resource_attr_id']]
+            data = group_values(data, idx_names, f)
 
         # temporal aggregation
         temporal = agg.get('time', {})
-        f = temporal.get('function')
+        f = get_agg_function(temporal.get('function'))
         p = temporal.get('step')
 
-        if p and f in ['sum', 'mean']:
-            # https://stackoverflow.com/questions/35295689/how-to-aggregate-data-by-date-and-string-multiindex-using-pandas-then-print-to
-            idx_names.remove('date')
+        if f is not None and p in ['month', 'year']:
+            # the period replaces the date, in the same position
             if p == 'month':
-                time_group = ['year', 'month', 'day']
-                data['year'] = data['date'].dt.year
-                data['month'] = data['date'].dt.month
-                data['day'] = 1
-                data = data.groupby(idx_names + time_group).agg(f).reset_index()
-                data['date'] = pd.to_datetime(data[time_group])
-                cols = list(data.columns)
-                cols.remove('date')
-                for tg in time_group:
-                    cols.remove(tg)
-                cols.insert(cols.index('block'), 'date')
-                data = data[cols]
-            elif p == 'year':
-                data['Year'] = data['date'].dt.year
-                del data['date']
-                data = data.groupby(idx_names + ['Year']).agg(f).reset_index()
-                cols = list(data.columns)
-                cols.remove('Year')
-                cols.insert(cols.index('block'), 'Year')
-                data = data[cols]
+                data = data.assign(date=data['date'].values.astype('datetime64[M]').astype('datetime64[ns]'))
+            else:
+                data = data.assign(date=data['date'].dt.year).rename(columns={'date': 'Year'})
+                idx_names[idx_names.index('date')] = 'Year'
+            data = group_values(data, idx_names, f)
+
+        for col in data.columns:
+            if data[col].dtype.name == 'category':
+                data[col] = data[col].cat.remove_unused_categories()
 
         new_cols = list(data.columns)
         new_cols.remove('value')
@@ -937,8 +1082,12 @@ def aggregate_data(data, agg, idx_names):
     return data
 
 
-def filter_results_data(conn, filters, project_id=None, network_id=None, template_id=None, maxrows=None,
-                        include_tags=False):
+def iter_results_sources(conn, filters, network_id=None, template_id=None, maxrows=None, include_tags=False):
+    """
+    Get results data from each data source (a Hydra scenario or a stored scenario version) in turn.
+
+    :return: A generator of (dataframes, perturbations, tag names) for each data source, or of an error code
+    """
     # TODO: Move this to Hydra or otherwise improve Hydra functions to make these queries as efficient as possible
 
     nodes = filters.get('nodes', [])
@@ -948,12 +1097,9 @@ def filter_results_data(conn, filters, project_id=None, network_id=None, templat
     versions = filters.get('versions', {})
     attrs = filters.get('attrs')
     ttypes = filters.get('ttypes')
-    unstack = filters.get('unstack', False)
-    agg = filters.get('agg', {})
 
-    data = []
-    perturbations = None
-    tag_names = []
+    # results are cached by source, so only the filters that select data are part of the key
+    filters_key = (template_id, networks, nodes, links, attrs, ttypes, include_tags, maxrows)
 
     for scenario_id in scenarios:
         scenario = conn.call('get_scenario', scenario_id, include_data=False)
@@ -977,12 +1123,14 @@ def filter_results_data(conn, filters, project_id=None, network_id=None, templat
             else:
                 scenario_ids = [scenario_id]
 
-            dfs, perturbations, tag_names = get_data_from_hydra(
-                conn, network_id, scenario_ids, networks, nodes, links, ttypes, attrs,
-                include_tags=include_tags, maxrows=maxrows)
-            data.extend(dfs)
+            # a new run of the scenario records a new version, which gives its results a new key
+            run_marker = (run_name, all_versions[-1] if all_versions else None)
+            yield get_results(network_id, (conn.url, data_location, scenario_ids, run_marker) + filters_key,
+                              lambda: get_data_from_hydra(
+                                  conn, network_id, scenario_ids, networks, nodes, links, ttypes, attrs,
+                                  include_tags=include_tags, maxrows=maxrows))
 
-        elif data_location in ['s3', 'hdf5']:
+        elif data_location in ['s3', 'hdf5', 'parquet']:
 
             root_key = None
             network = None
@@ -991,38 +1139,60 @@ def filter_results_data(conn, filters, project_id=None, network_id=None, templat
                                     include_resources=False)
                 root_key = network.layout.get('storage', {}).get('folder')
 
+            # aggregated results can be read from precomputed rollups, and a custom time range only for its dates
+            rollup = get_rollup(filters.get('agg')) if data_location == 'parquet' else None
+            start, end = get_date_range(filters.get('agg')) if data_location == 'parquet' else (None, None)
+
+            def get_store_results(scenario, version):
+                version_key = version and version.get(scenario.layout.get('version_key', 'date'))
+                return get_results(
+                    network_id,
+                    (conn.url, data_location, root_key, run_name, version_key, rollup, start, end) + filters_key,
+                    lambda: get_data_from_store(network, template_id, scenario, version, networks,
+                                                nodes, links,
+                                                attrs, root_key,
+                                                data_location=data_location,
+                                                include_tags=include_tags, maxrows=maxrows, start=start, end=end,
+                                                rollup=rollup))
+
             if not versions:
                 if not all_versions:
                     version = None
                 else:
                     version = all_versions[-1]
 
-                dfs, perturbations, tag_names = get_data_from_store(network, template_id, scenario, version, networks,
-                                                                    nodes, links,
-                                                                    attrs, root_key,
-                                                                    data_location=data_location,
-                                                                    include_tags=include_tags, maxrows=maxrows)
-                data.extend(dfs)
+                yield get_store_results(scenario, version)
 
             else:
                 version_lookup = {version['number']: version for version in all_versions}
                 for version_id in versions.get(str(scenario_id)):
                     version = version_lookup.get(version_id)
-                    dfs, perturbations, tag_names = get_data_from_store(network, template_id, scenario, version,
-                                                                        networks,
-                                                                        nodes, links,
-                                                                        attrs, root_key,
-                                                                        data_location=data_location,
-                                                                        include_tags=include_tags, maxrows=maxrows)
-                    data.extend(dfs)
+                    yield get_store_results(scenario, version)
 
-    if data:
 
-        data = pd.concat(data)
-        data.fillna('', inplace=True)
+def filter_results_data(conn, filters, project_id=None, network_id=None, template_id=None, maxrows=None,
+                        include_tags=False):
+
+    unstack = filters.get('unstack', False)
+    agg = filters.get('agg', {})
+
+    data = []
+    perturbations = None
+    tag_names = []
+
+    for result in iter_results_sources(conn, filters, network_id=network_id, template_id=template_id,
+                                       maxrows=maxrows, include_tags=include_tags):
+        if type(result) == int:
+            return result, None
+        dfs, perturbations, tag_names = result
+        data.extend(dfs)
 
-        idx_names = [c for c in data.columns if c != 'value'] + tag_names
-        data.set_index(idx_names, inplace=True)
+    if data:
+
+        # the data may be shared with the results cache, so it isn't modified in place
+        data = concat_frames(data)
+        idx_names = [c for c in data.columns if c != 'value']
+        data = to_categoricals(data, [c for c in idx_names if c != 'date']).set_index(idx_names)
 
         if agg:
             data = aggregate_data(data, agg, idx_names=idx_names)
@@ -1042,20 +1212,92 @@ def filter_results_data(conn, filters, project_id=None, network_id=None, templat
     return data, perturbations
 
 
-def get_value_tags(conn, scenario_id):
+def iter_results_data(conn, filters, project_id=None, network_id=None, template_id=None, maxrows=None,
+                      include_tags=False, chunksize=10000):
+    """
+    Get results data in chunks, as filter_results_data does, without first combining all the data.
+
+    Aggregated or unstacked results need all the data, so they are combined first and then chunked.
+
+    :return: A generator of (dataframe, perturbations) tuples, each dataframe having at most chunksize rows, or
+        of (error code, None) if the data can't be read
+    """
+
+    if filters.get('agg') or filters.get('unstack'):
+        data, perturbations = filter_results_data(conn, filters, project_id=project_id, network_id=network_id,
+                                                  template_id=template_id, maxrows=maxrows,
+                                                  include_tags=include_tags)
+        if type(data) == int:
+            yield data, None
+            return
+        for i in range(0, len(data), chunksize):
+            yield data.iloc[i:i + chunksize], perturbations
+        return
+
+    for result in iter_results_sources(conn, filters, network_id=network_id, template_id=template_id,
+                                       maxrows=maxrows, include_tags=include_tags):
+        if type(result) == int:
+            yield result, None
+            return
+        dfs, perturbations, tag_names = result
+        for df in dfs:
+            labels = [c for c in df.columns if c not in ['date', 'value']]
+            df = to_categoricals(df, labels)
+            df = df[[c for c in df.columns if c != 'value'] + ['value']]
+            for i in range(0, len(df), chunksize):
+                yield df.iloc[i:i + chunksize], perturbations
+
+
+def get_value_tags(conn, scenario_id, scenarios=None):
+    """
+    Get the value tags of a scenario and, in turn, of its source and parent scenarios.
+
+    :param conn: The Hydra connection
+    :param scenario_id: The scenario ID
+    :param scenarios: Scenarios by ID to look up the ancestry in, if already fetched; others are fetched one by one
+    :return: A list of value tags
+    """
+
     value_tags = []
+    visited = set()
 
     def collect_tags_from(scenario_id):
-        scenario = conn.call('get_scenario', scenario_id)
-        if 'value_tags' in scenario.layout:
-            for vt in scenario.layout.value_tags:
-                value_tags.append(vt)
-        if 'sources' in scenario.layout:
-            for source_id in scenario.layout.sources:
-                collect_tags_from(source_id)
-        if 'parent' in scenario.layout:
-            collect_tags_from(scenario.layout.parent)
+        if scenario_id in visited:
+            return
+        visited.add(scenario_id)
+        scenario = scenarios.get(scenario_id) if scenarios is not None else None
+        if scenario is None:
+            scenario = conn.call('get_scenario', scenario_id)
+            if 'error' in scenario:
+                return
+        layout = scenario.get('layout') or {}
+        for vt in layout.get('value_tags', []):
+            value_tags.append(vt)
+        for source_id in layout.get('sources', []):
+            collect_tags_from(source_id)
+        if 'parent' in layout:
+            collect_tags_from(layout['parent'])
 
     collect_tags_from(scenario_id)
 
     return value_tags
+
+
+def get_scenarios_value_tags(conn, network_id, scenario_ids):
+    """
+    Get the value tags of several scenarios, walking their ancestry in the network's scenarios, fetched once.
+
+    :return: A dictionary of {tag name: value} for each scenario ID. Later tags in a scenario's ancestry (see
+        get_value_tags) take precedence.
+    """
+
+    scenarios = conn.call('get_scenarios', network_id)
+    scenarios = {s['id']: s for s in scenarios} if isinstance(scenarios, list) else {}
+
+    tags = {}
+    for scenario_id in scenario_ids:
+        if scenario_id not in tags:
+            value_tags = get_value_tags(conn, scenario_id, scenarios=scenarios)
+            tags[scenario_id] = {vt['name']: vt['value'] for vt in value_tags}
+
+    return tags
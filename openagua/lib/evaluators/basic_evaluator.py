@@ -1,7 +1,7 @@
 from os import environ
 import json
 
-from .utils import make_timesteps, make_default_value, EMPTY_VALUES, \
+from .utils import get_timestep_grid, make_default_value, EMPTY_VALUES, \
     eval_array, eval_descriptor, eval_scalar, eval_timeseries
 
 
@@ -16,9 +16,9 @@ class Evaluator:
         self.end_date = None
 
         if data_type in [None, 'timeseries', 'periodic timeseries']:
-            dates = make_timesteps(data_type=data_type, **time_settings)
-            self.dates = dates
-            self.dates_as_string = [d.isoformat(' ') for d in dates]
+            grid = get_timestep_grid(time_settings, data_type=data_type)
+            self.dates = grid.date_list
+            self.dates_as_string = grid.dates_as_string
             self.start_date = self.dates[0].date
             self.end_date = self.dates[-1].date
 
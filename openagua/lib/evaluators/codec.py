@@ -0,0 +1,155 @@
+"""
+Encoding and decoding of OpenAgua's timeseries JSON, {block: {date: value}}, without intermediate DataFrames.
+
+Decoded timeseries are a date index plus a float64 array of shape (dates, blocks), with missing values as NaN.
+Periodic timeseries are stored with the year 9999, which is replaced by 1678 (the first year pandas supports) when
+decoding and restored when encoding.
+"""
+
+import json
+from collections import namedtuple
+from os import environ
+
+import numpy
+import pandas
+
+from openagua.lib.cache import LRUCache
+
+# parsing JSON is most of the cost of decoding, so use orjson if it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    json_loads = json.loads
+
+PERIODIC_YEAR = '1678'
+STORED_PERIODIC_YEAR = '9999'
+
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+Timeseries = namedtuple('Timeseries', ['dates', 'blocks', 'values', 'periodic'])
+
+# most timeseries in a network share the same dates, so parsed and formatted dates are reused
+parsed_dates = LRUCache(maxsize=int(environ.get('OA_TIMESERIES_DATES_CACHE_SIZE', 100)))
+formatted_dates = LRUCache(maxsize=int(environ.get('OA_TIMESERIES_DATES_CACHE_SIZE', 100)))
+
+
+def parse_dates(keys):
+    '''Parse date keys (ISO strings or epoch milliseconds) into a naive DatetimeIndex'''
+
+    dates = parsed_dates.get(keys)
+    if dates is None:
+        labels = keys
+        periodic = bool(labels) and labels[0].startswith(STORED_PERIODIC_YEAR)
+        if periodic:
+            labels = [PERIODIC_YEAR + k[4:] if k.startswith(STORED_PERIODIC_YEAR) else k for k in labels]
+        if labels and labels[0].lstrip('-').isdigit():
+            dates = pandas.to_datetime(numpy.array(labels, dtype=numpy.int64), unit='ms')
+        else:
+            dates = pandas.to_datetime(list(labels), utc=True).tz_localize(None)
+        dates = (pandas.DatetimeIndex(dates), periodic)
+        parsed_dates.set(keys, dates)
+
+    return dates
+
+
+def format_dates(dates, date_format='iso', periodic=False):
+    '''Format dates as strings; "iso" gives the same strings as pandas' to_json(date_format='iso')'''
+
+    key = (dates.asi8.tobytes(), date_format, periodic)
+    strings = formatted_dates.get(key)
+    if strings is None:
+        if date_format == 'iso':
+            strings = [d[:-3] for d in dates.strftime(ISO_FORMAT)]
+        else:
+            strings = list(dates.strftime(date_format))
+        if periodic:
+            strings = [STORED_PERIODIC_YEAR + d[4:] if d.startswith(PERIODIC_YEAR) else d for d in strings]
+        formatted_dates.set(key, strings)
+
+    return strings
+
+
+def to_floats(values):
+    try:
+        return numpy.array(values, dtype=numpy.float64)
+    except (ValueError, TypeError):
+        return pandas.to_numeric(pandas.Series(values, dtype=object), errors='coerce').to_numpy(dtype=numpy.float64)
+
+
+def block_label(label):
+    return int(label) if type(label) == str and label.isdigit() else label
+
+
+def loads(text):
+    """
+    Decode timeseries JSON.
+
+    :param text: The JSON string, or an already decoded dictionary
+    :return: A Timeseries of dates, block labels, a (dates, blocks) float64 array and whether it is periodic
+    """
+
+    data = json_loads(text or '{}') if isinstance(text, (str, bytes)) else (text or {})
+    if data and not isinstance(next(iter(data.values())), dict):
+        data = {0: data}
+
+    blocks = [block_label(b) for b in data]
+    keys = [tuple(block.keys()) for block in data.values()]
+    if not keys or not keys[0]:
+        return Timeseries(pandas.DatetimeIndex([]), blocks or [0], numpy.empty((0, len(blocks) or 1)), False)
+
+    dates, periodic = parse_dates(keys[0])
+    values = numpy.empty((len(dates), len(blocks)), dtype=numpy.float64)
+    for i, block in enumerate(data.values()):
+        if keys[i] == keys[0]:
+            values[:, i] = to_floats(list(block.values()))
+        else:
+            # blocks with different dates are aligned to the dates of the first block
+            block_dates, _ = parse_dates(keys[i])
+            column = numpy.full(len(dates), numpy.nan)
+            positions = dates.get_indexer(block_dates)
+            found = positions >= 0
+            column[positions[found]] = to_floats(list(block.values()))[found]
+            values[:, i] = column
+
+    return Timeseries(dates, blocks, values, periodic)
+
+
+def to_native(dates, blocks, values, date_format='iso', periodic=False, flatten=False):
+    '''Convert to {block: {date: value}}, or {date: value} if flatten, with missing values as None'''
+
+    strings = format_dates(dates, date_format=date_format, periodic=periodic)
+    if flatten:
+        column = numpy.nansum(values, axis=1) if values.shape[1] else numpy.zeros(len(dates))
+        return dict(zip(strings, column.tolist()))
+    nulls = numpy.isnan(values)
+    native = {}
+    for i, b in enumerate(blocks):
+        column = values[:, i].tolist()
+        if nulls[:, i].any():
+            column = [None if null else v for v, null in zip(column, nulls[:, i])]
+        native[b] = dict(zip(strings, column))
+    return native
+
+
+def dumps(dates, blocks, values, date_format='iso', periodic=False, flatten=False):
+    '''Encode a timeseries as JSON'''
+    native = to_native(dates, blocks, values, date_format=date_format, periodic=periodic, flatten=flatten)
+    if not flatten:
+        native = {str(b): block for b, block in native.items()}
+    return json.dumps(native)
+
+
+def to_pandas(dates, blocks, values, flatten=False):
+    '''Convert to a DataFrame, or a Series if flatten'''
+    if flatten:
+        return pandas.Series(numpy.nansum(values, axis=1), index=dates)
+    return pandas.DataFrame(values, index=dates, columns=blocks)
+
+
+def to_long(dates, blocks, values):
+    '''Convert to long columns of date, block and value, block by block'''
+    return {
+        'date': numpy.tile(dates.values, len(blocks)),
+        'block': numpy.repeat(numpy.array(blocks, dtype=object), len(dates)),
+        'value': values.T.ravel(),
+    }
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+from os import environ
+
+import boto3
+import pandas
+
+from openagua.lib.cache import LRUCache
+
+try:
+    import pyarrow
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+# parsed files, keyed by content (ETag) and read arguments
+files = LRUCache(maxsize=int(environ.get('OA_EXTERNAL_CACHE_SIZE', 50)))
+
+# reindexed/interpolated variants of parsed files, keyed by file, arguments and date grid
+variants = LRUCache(maxsize=int(environ.get('OA_EXTERNAL_VARIANT_CACHE_SIZE', 200)))
+
+# parsed files are also kept on local disk as Parquet, if pyarrow is available
+CACHE_DIR = environ.get('OA_EXTERNAL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'openagua-external'))
+
+_s3 = None
+
+
+def get_s3_client():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client('s3')
+    return _s3
+
+
+def make_key(*parts):
+    return hashlib.sha224(str.encode(repr(parts))).hexdigest()
+
+
+def read_parquet(key):
+    if pyarrow is None:
+        return None
+    path = os.path.join(CACHE_DIR, key + '.parquet')
+    if not os.path.exists(path):
+        return None
+    try:
+        return pandas.read_parquet(path)
+    except Exception as err:
+        log.warning('Could not read cached file {}: {}'.format(path, err))
+        return None
+
+
+def write_parquet(key, df):
+    if pyarrow is None:
+        return
+    path = os.path.join(CACHE_DIR, key + '.parquet')
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as err:
+        # e.g., non-string column names can't be stored as Parquet; the memory tier still works
+        log.warning('Could not cache file {}: {}'.format(path, err))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_external_csv(bucket, key, **kwargs):
+    """
+    Read a CSV file from S3, using the process-wide cache if the file's content (ETag) hasn't changed.
+
+    :param bucket: The S3 bucket
+    :param key: The S3 key of the file
+    :param kwargs: Keyword arguments passed to pandas.read_csv
+    :return: The parsed DataFrame, which is shared and should not be modified
+    """
+
+    client = get_s3_client()
+    etag = client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    filekey = make_key(etag, sorted(kwargs.items()))
+
+    df = files.get(filekey)
+    if df is None:
+        df = read_parquet(filekey)
+        if df is None:
+            obj = client.get_object(Bucket=bucket, Key=key)
+            df = pandas.read_csv(BytesIO(obj['Body'].read()), **kwargs)
+            write_parquet(filekey, df)
+        files.set(filekey, df)
+
+    return filekey, df
+
+
+def fit_external_data(filekey, df, dates, dates_key, fill_method=None, interp_method=None, fit=True):
+    """
+    Fill, interpolate and reindex a parsed file to a date grid, reusing a previously computed variant if possible.
+
+    :param filekey: The key of the parsed file, from read_external_csv
+    :param df: The parsed file
+    :param dates: The dates to reindex to
+    :param dates_key: A hashable key identifying the dates
+    :return: The DataFrame, which is shared and should not be modified
+    """
+
+    variantkey = (filekey, fill_method, interp_method, fit, dates_key)
+    data = variants.get(variantkey)
+    if data is None:
+        data = df
+        if fill_method:
+            interp_args = {}
+            if fill_method == 'interpolate':
+                if interp_method in ['time', 'akima', 'quadratic']:
+                    interp_args['method'] = interp_method
+                data = data.interpolate(**interp_args)
+        if fit and type(data.index) == pandas.DatetimeIndex:
+            data = data.reindex(dates, fill_value=None)
+        variants.set(variantkey, data)
+
+    return data
@@ -1,12 +1,19 @@
+import ast
 import hashlib
 from os import environ
 import json
+import re
 import sys
 import traceback
+import types
 import pandas
 import numpy
 
-from .utils import make_timesteps, make_default_value, EMPTY_VALUES,\
+from openagua.lib.cache import LRUCache
+from . import codec
+from .external import read_external_csv, fit_external_data
+from .series import DateIndex, Series
+from .utils import TimestepGrid, get_timestep_grid, make_default_value, EMPTY_VALUES,\
     eval_array, eval_descriptor, eval_scalar, eval_timeseries
 
 from pandas import Timestamp
@@ -21,6 +28,99 @@ from math import log, isnan
 import random
 
 
+# arguments passed to functions evaluated over the whole series at once (see is_vectorized)
+VECTOR_ARGNAMES = ['dates', 'years', 'months', 'days', 'water_years', 'periodic_timesteps', 'timesteps']
+
+# arguments accepted by the function evaluator
+ARGNAMES = [
+    'parentkey',
+    'depth',
+    'timestep',
+    'date',
+    'start_date',
+    'end_date',
+    'water_year',
+    'flavor',
+]
+
+MODULES = ['pandas', 'numpy', 'isnan', 'log', 'random', 'math']
+
+
+def get_free_names(user_code):
+    '''Find the names a function reads without defining them, ignoring comments, strings and its own variables'''
+    lines = user_code.rstrip().split('\n')
+    if 'return ' not in lines[-1]:
+        lines[-1] = 'return ' + lines[-1]
+    try:
+        tree = ast.parse('def f():\n    ' + '\n    '.join(lines))
+    except SyntaxError:
+        return set()
+
+    loaded = set()
+    defined = set()
+    for node in ast.walk(tree.body[0]):
+        if isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else defined).add(node.id)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node is not tree.body[0]:
+            defined.add(node.name)
+        elif isinstance(node, ast.alias):
+            defined.add((node.asname or node.name).split('.')[0])
+    return loaded - defined
+
+
+vector_argnames_cache = LRUCache(maxsize=int(environ.get('OA_FUNCTION_CACHE_SIZE', 1000)))
+
+
+def get_vector_argnames(user_code):
+    '''Get the whole-series arguments a function reads without defining them itself'''
+    argnames = vector_argnames_cache.get(user_code)
+    if argnames is None:
+        free_names = get_free_names(user_code)
+        argnames = [arg for arg in VECTOR_ARGNAMES if arg in free_names]
+        vector_argnames_cache.set(user_code, argnames)
+    return argnames
+
+
+def is_vectorized(user_code):
+    '''Check if a function opts in to whole-series evaluation by reading any of the vector arguments'''
+    return bool(get_vector_argnames(user_code))
+
+
+# keys referenced by self.get/self.GET, of the form [network_id/]resource_type/resource_id/attr_id
+GET_KEY_REGEX = re.compile(r'''\.(?:get|GET)\(\s*['"]((?:\d+/)?(?:node|link|network)/\d+/\d+)['"]''', re.IGNORECASE)
+
+
+def get_referenced_keys(user_code):
+    '''Find the keys of the variables referenced by a function, in order of first use'''
+    keys = []
+    for key in GET_KEY_REGEX.findall(user_code or ''):
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def get_function(dataset):
+    '''Get the function from a dataset, if the dataset uses one'''
+    metadata = dataset.get('metadata') or {}
+    if isinstance(metadata, bytes):
+        metadata = metadata.decode()
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            return ''
+    input_method = metadata.get('input_method')
+    use_function = input_method and input_method == 'function' or metadata.get('use_function', 'N') == 'Y'
+    func = metadata.get('function')
+    return func if use_function and type(func) == str else ''
+
+
+# process-wide cache of compiled user function code objects, keyed by code and data type
+function_cache = LRUCache(maxsize=int(environ.get('OA_FUNCTION_CACHE_SIZE', 1000)))
+
+
 def parse_function(user_code, name, argnames, modules=()):
     '''Parse a function into usable Python'''
 
@@ -44,7 +144,8 @@ def parse_function(user_code, name, argnames, modules=()):
     # modules = spaces.join('import {}'.format(m) for m in modules if m in user_code)
 
     # getargs (these pass to self.GET)
-    kwargs = spaces.join(['{arg} = kwargs.get("{arg}")'.format(arg=arg) for arg in argnames if arg in user_code])
+    argnames = [arg for arg in argnames if arg in user_code] + get_vector_argnames(user_code)
+    kwargs = spaces.join(['{arg} = kwargs.get("{arg}")'.format(arg=arg) for arg in argnames])
 
     # final function
     func = '''def {name}(self, **kwargs):{spaces}{spaces}{kwargs}{spaces}{code}''' \
@@ -53,51 +154,25 @@ def parse_function(user_code, name, argnames, modules=()):
     return func
 
 
-class Timestep(object):
-    index = -1
-    periodic_timestep = 1
+def compile_function(code_string, data_type, argnames=ARGNAMES, modules=MODULES):
+    '''
+    Compile a user function, reusing the cached code object if the function has been compiled before.
 
-    def __init__(self, date, start_date, span):
-        if date == start_date:
-            type(self).index = 0
-            type(self).periodic_timestep = 1
-        else:
-            type(self).index += 1
-        self.index = type(self).index
-        self.timestep = self.index + 1
-        self.date = date
-        self.year = date.year
-        self.month = date.month
-        self.day = date.day
-        self.date_as_string = date.isoformat(' ')
-
-        if start_date:
-            if date.month < start_date.month:
-                self.water_year = date.year
-            else:
-                self.water_year = date.year + 1
+    The function is created with this module's globals, so nothing is added to the module namespace.
+    '''
 
-        if span:
-            self.span = span
-            self.set_periodic_timestep(date, start_date, span)
+    hashkey = hashlib.sha224(str.encode(code_string + str(data_type))).hexdigest()
 
-    def set_periodic_timestep(self, date, start_date, span):
+    code = function_cache.get(hashkey)
+    if code is None:
+        # Note: functions can't start with a number so pre-pend "func_"
+        func_name = "func_{}".format(hashkey)
+        func = parse_function(code_string, name=func_name, argnames=argnames, modules=modules)
+        module_code = compile(func, '<{}>'.format(func_name), 'exec')
+        code = [c for c in module_code.co_consts if isinstance(c, types.CodeType)][0]
+        function_cache.set(hashkey, code)
 
-        if span == 'day':
-            if (date.month, date.day) == (start_date.month, start_date.day):
-                type(self).periodic_timestep = 1
-            else:
-                type(self).periodic_timestep += 1
-            self.periodic_timestep = type(self).periodic_timestep
-
-        elif span == 'week':
-            self.periodic_timestep = self.index % 52 + 1
-
-        elif span == 'month':
-            self.periodic_timestep = self.index % 12 + 1
-
-        elif span == 'thricemonthly':
-            self.periodic_timestep = self.index % 36 + 1
+    return hashkey, types.FunctionType(code, globals(), code.co_name)
 
 
 class InnerSyntaxError(SyntaxError):
@@ -119,8 +194,44 @@ class EvalException(Exception):
         self.code = code
 
 
-class namespace:
-    pass
+def topological_sort(graph):
+    '''
+    Order the keys of a dependency graph so that each key comes after the keys it references.
+
+    References from a key to itself are allowed, since they refer to previous time steps; any other circular
+    reference raises an EvalException that describes the cycle.
+
+    :param graph: A dictionary of referenced keys, keyed by referencing key
+    :return: The ordered list of keys
+    '''
+
+    order = []
+    state = {}  # 1 = being visited, 2 = done
+    for root in graph:
+        if root in state:
+            continue
+        state[root] = 1
+        path = [root]
+        stack = [(root, iter(graph.get(root, ())))]
+        while stack:
+            key, refs = stack[-1]
+            for ref in refs:
+                if ref == key or state.get(ref) == 2:
+                    continue
+                if state.get(ref) == 1:
+                    cycle = path[path.index(ref):] + [ref]
+                    raise EvalException('Circular reference: {}'.format(' -> '.join(cycle)), 4)
+                state[ref] = 1
+                path.append(ref)
+                stack.append((ref, iter(graph.get(ref, ()))))
+                break
+            else:
+                stack.pop()
+                path.pop()
+                state[key] = 2
+                order.append(key)
+
+    return order
 
 
 class Evaluator:
@@ -131,18 +242,26 @@ class Evaluator:
         self.dates = []
         self.dates_as_string = []
         self.timesteps = []
+        self.grid = None
+        self.index = None
         self.start_date = None
         self.end_date = None
 
         if data_type in [None, 'timeseries', 'periodic timeseries']:
             span = kwargs.get('span') or kwargs.get('timestep') or kwargs.get('time_step')
-            dates = make_timesteps(data_type=data_type, **time_settings)
-            self.timesteps = [Timestep(d, dates[0], span) for d in dates]
-            self.dates = [t.date for t in self.timesteps]
-            self.dates_as_string = [t.date_as_string for t in self.timesteps]
+            grid = get_timestep_grid(time_settings, data_type=data_type, span=span)
+            self.grid = grid
+            self.timesteps = grid.timesteps
+            self.dates = grid.date_list
+            self.dates_as_string = grid.dates_as_string
+            self.index = grid.date_index
             self.start_date = self.dates[0].date
             self.end_date = self.dates[-1].date
 
+        # shared date index for all timeseries evaluated here
+        if self.index is None:
+            self.index = DateIndex(self.dates, self.dates_as_string)
+
         self.date_format = date_format
         self.tsi = None
         self.tsf = None
@@ -156,20 +275,9 @@ class Evaluator:
         self.bucket = environ.get('AWS_S3_BUCKET')
         self.files_path = files_path
 
-        self.namespace = namespace
-
         # arguments accepted by the function evaluator
-        self.argnames = [
-            'parentkey',
-            'depth',
-            'timestep',
-            'date',
-            'start_date',
-            'end_date',
-            'water_year',
-            'flavor',
-        ]
-        self.modules = ['pandas', 'numpy', 'isnan', 'log', 'random', 'math']
+        self.argnames = ARGNAMES
+        self.modules = MODULES
 
         self.calculators = {}
 
@@ -181,6 +289,24 @@ class Evaluator:
         self.store = {}
         self.hashstore = {}
 
+        self._vector_args = None
+
+    def vector_args(self):
+        '''Whole-series arguments passed to vectorized functions, computed once per evaluator'''
+        if self._vector_args is None:
+            # the grid's arrays are read-only, so they are passed as they are
+            grid = self.grid if self.grid is not None else TimestepGrid([])
+            self._vector_args = dict(
+                dates=self.index.dates,
+                years=grid.year,
+                months=grid.month,
+                days=grid.day,
+                water_years=grid.water_year,
+                periodic_timesteps=grid.periodic_timestep,
+                timesteps=grid.timestep,
+            )
+        return self._vector_args
+
     def eval_data(self, dataset, func=None, flavor=None, depth=0, flatten=False, fill_value=None,
                   tsidx=None, date_format=None, has_blocks=False, data_type=None, parentkey=None, for_eval=False):
         """
@@ -218,6 +344,9 @@ class Evaluator:
 
             if use_function:
                 func = func if type(func) == str else ''
+                if parentkey is None:
+                    self.prefetch(func)
+                    self.eval_dependencies(func)
                 try:
                     result = self.eval_function(
                         func,
@@ -240,13 +369,15 @@ class Evaluator:
                 except Exception as err:
                     print(err)
                     raise
-                if result is None and data_type == 'timeseries':
-                    if self.default_timeseries:
-                        result = self.default_timeseries
-                    else:
+                if result is None and data_type == 'timeseries' and flavor == 'series':
+                    result = Series(self.index)
+                elif result is None and data_type == 'timeseries':
+                    if not self.default_timeseries:
                         self.default_timeseries = make_default_value(data_type=data_type, dates=self.dates)
+                    result = self.default_timeseries
                     if flavor == 'pandas':
-                        result = pandas.read_json(result)
+                        ts = codec.loads(result)
+                        result = codec.to_pandas(ts.dates, ts.blocks, ts.values)
                     elif flavor == 'native':
                         result = json.loads(result)
 
@@ -271,8 +402,10 @@ class Evaluator:
                         flatten=(flatten if flatten is not None else not has_blocks),
                         date_format=date_format,
                         fill_value=fill_value,
-                        flavor=flavor,
+                        flavor='codec' if flavor == 'series' else flavor,
                     )
+                    if flavor == 'series':
+                        result = Series.from_arrays(self.index, result.dates, result.blocks, result.values)
                 except:
                     raise
 
@@ -290,28 +423,108 @@ class Evaluator:
         except:
             raise
 
-    def update_hashstore(self, hashkey, data_type, date_as_string, value):
-        if data_type == 'timeseries':
-            if hashkey not in self.hashstore:
-                self.hashstore[hashkey] = {}
-            if type(value) == dict and date_as_string in value:
-                self.hashstore[hashkey][date_as_string] = value.get(date_as_string)
+    def prefetch(self, code_string):
+        '''
+        Fetch the data referenced by a function, and recursively by the functions it references, in bulk.
+
+        Any key not returned here is still fetched individually by get.
+        '''
+
+        keys = [key for key in get_referenced_keys(code_string) if key not in self.resource_scenarios]
+        seen = set(keys)
+        while keys and self.conn is not None:
+            res_attrs_data = self.conn.get_res_attrs_data(keys, scenario_id=self.scenario_id)
+            next_keys = []
+            for key in keys:
+                rs_value = res_attrs_data.get(key)
+                if rs_value is None:
+                    continue
+                self.resource_scenarios[key] = rs_value
+                for ref_key in get_referenced_keys(get_function(rs_value)):
+                    if ref_key not in seen and ref_key not in self.resource_scenarios:
+                        seen.add(ref_key)
+                        next_keys.append(ref_key)
+            keys = next_keys
+
+    def dependency_graph(self, code_string):
+        '''Map each key referenced by a function, directly or indirectly, to the keys it references'''
+
+        graph = {}
+        keys = get_referenced_keys(code_string)
+        while keys:
+            key = keys.pop()
+            if key in graph:
+                continue
+            rs_value = self.resource_scenarios.get(key)
+            graph[key] = get_referenced_keys(get_function(rs_value)) if rs_value is not None else []
+            keys.extend(graph[key])
+
+        return graph
+
+    def eval_dependencies(self, code_string):
+        '''
+        Evaluate the data referenced by a function once each, in dependency order, before evaluating the function.
+
+        Circular references are reported before anything is evaluated. Results are memoized in the store, so
+        datasets referenced by several functions are only evaluated once per run.
+        '''
+
+        order = topological_sort(self.dependency_graph(code_string))
+
+        if not self.timesteps:
+            return
+
+        for key in order:
+            if key in self.store or key not in self.resource_scenarios:
+                continue
+            try:
+                self.get(key)
+            except Exception:
+                # the error is raised again, in context, when the key is referenced by the function
+                self.store.pop(key, None)
+
+    def update_hashstore(self, hashkey, data_type, timestep, value):
+        if data_type in ['timeseries', 'periodic timeseries']:
+            series = self.hashstore.get(hashkey)
+            if type(series) != Series:
+                series = Series(self.index)
+                self.hashstore[hashkey] = series
+            if isinstance(value, dict) and timestep.date_as_string in value:
+                series.set(timestep.index, value.get(timestep.date_as_string))
             elif type(value) in [pandas.DataFrame, pandas.Series]:
                 # TODO: add to documentation that returning a dataframe or series from a function
                 # will only be done once
-                if type(value.index) == pandas.DatetimeIndex:
-                    value.index = value.index.strftime(self.date_format)
-                value = value.to_dict()
-                self.hashstore[hashkey] = value
+                self.hashstore[hashkey] = Series.from_pandas(self.index, value)
                 return False
             else:
-                self.hashstore[hashkey][date_as_string] = value
+                series.set(timestep.index, value)
         else:
             self.hashstore[hashkey] = value
             return False
 
         return True
 
+    def update_hashstore_vectorized(self, hashkey, value):
+        '''Store the whole-series result of a vectorized function'''
+
+        if value is None or type(value) in [int, float, str]:
+            self.hashstore[hashkey] = value
+            return
+        if isinstance(value, numpy.generic):
+            self.hashstore[hashkey] = value.item()
+            return
+
+        if type(value) in [pandas.DataFrame, pandas.Series]:
+            if type(value.index) != pandas.DatetimeIndex and len(value.index) != len(self.index):
+                raise Exception("Vectorized functions must return one value per time step")
+            self.hashstore[hashkey] = Series.from_pandas(self.index, value)
+            return
+
+        values = numpy.asarray(value, dtype=float)
+        if values.ndim not in [1, 2] or values.shape[0] != len(self.index):
+            raise Exception("Vectorized functions must return one value per time step")
+        self.hashstore[hashkey] = Series(self.index, values)
+
     def eval_function(self, code_string, depth=0, parentkey=None, flavor=None, data_type=None, flatten=False,
                       tsidx=None, has_blocks=False, date_format=None, for_eval=False):
 
@@ -329,27 +542,25 @@ class Evaluator:
         :param tsidx: Timestep index starting at 0
         :param data_type:
         :return:
-        """
 
-        hashkey = hashlib.sha224(str.encode(code_string + str(data_type))).hexdigest()
+        Functions that read any of the whole-series arguments (dates, years, months, days, water_years,
+        periodic_timesteps, timesteps) without defining them are called once with arrays covering all time steps and should return
+        one value per time step; all other functions are called once per time step.
+        """
 
         # check if we already know about this function so we don't
-        # have to do duplicate (possibly expensive) execs
-        if not hasattr(self.namespace, hashkey):
-            try:
-                # create the string defining the wrapper function
-                # Note: functions can't start with a number so pre-pend "func_"
-                func_name = "func_{}".format(hashkey)
-                func = parse_function(code_string, name=func_name, argnames=self.argnames, modules=self.modules)
-                # TODO : exec is unsafe
-                exec(func, globals())
-                setattr(self.namespace, hashkey, eval(func_name))
-            except SyntaxError as err:  # syntax error
-                print(err)
-                raise
-            except Exception as err:
-                print(err)
-                raise
+        # have to do duplicate (possibly expensive) compiles
+        try:
+            # TODO : running user code is unsafe
+            hashkey, f = compile_function(code_string, data_type, argnames=self.argnames, modules=self.modules)
+        except SyntaxError as err:  # syntax error
+            print(err)
+            raise
+        except Exception as err:
+            print(err)
+            raise
+
+        timestep = None
 
         try:
             # CORE EVALUATION ROUTINE
@@ -361,8 +572,6 @@ class Evaluator:
                     return self.hashstore[hashkey]
 
             # MAIN ENTRY POINT TO FUNCTION
-            f = getattr(self.namespace, hashkey)
-
             if data_type in ['scalar', 'array', 'descriptor']:
                 value = f(self)
                 self.hashstore[hashkey] = value
@@ -381,6 +590,12 @@ class Evaluator:
                 #         raise Exception("Error evaluating function. Invalid dates.")
                 timesteps = self.timesteps
 
+                if is_vectorized(code_string):
+                    # evaluate the whole series in one call
+                    value = f(self, depth=depth + 1, parentkey=parentkey, **self.vector_args())
+                    self.update_hashstore_vectorized(hashkey, value)
+                    timesteps = []
+
                 might_be_scalar = True
                 for timestep in timesteps:
                     # if stored_value and date_as_string in stored_value:
@@ -401,7 +616,7 @@ class Evaluator:
                                 value = None
                             else:
                                 raise
-                    if self.update_hashstore(hashkey, data_type, timestep.date_as_string, value) is False:
+                    if self.update_hashstore(hashkey, data_type, timestep, value) is False:
                         break
 
             values = self.hashstore[hashkey]
@@ -412,56 +627,21 @@ class Evaluator:
                 data_type = 'descriptor'
 
             if data_type in ['timeseries', 'periodic timeseries']:
-                if type(values) == list:
-                    if flavor == 'json':
-                        result = pandas.DataFrame(data=values, index=self.dates_as_string).to_json(date_format='iso')
-                    elif flavor == 'native':
-                        result = pandas.DataFrame(data=values, index=self.dates_as_string).to_dict()
-                    elif flavor == 'pandas':
-                        result = pandas.DataFrame(data=values, index=self.dates_as_string)
-                    else:
-                        result = pandas.DataFrame(data=values, index=self.dates_as_string).to_json(date_format='iso')
-
-                elif type(values) == dict:
-                    first_col = list(values.values())[0]
-                    if type(first_col) in (list, tuple):
-                        cols = range(len(values))
-                        # TODO: add native flavor
-                        if flavor == 'pandas':
-                            result = pandas.DataFrame.from_records(data=values, index=self.dates_as_string,
-                                                                   columns=cols)
-                        elif flavor == 'native':
-                            result = pandas.DataFrame.from_records(data=values, index=self.dates_as_string,
-                                                                   columns=cols).to_dict()
-                        else:
-                            result = pandas.DataFrame.from_records(data=values, index=self.dates_as_string,
-                                                                   columns=cols).to_json(date_format='iso')
-
-                    else:
-                        if type(first_col) != dict:
-                            values = {0: values}
-                        # if type(first_col) != dict and has_blocks:
-                        #     values = {0: values}
-                        # elif type(first_col) == dict and not has_blocks:
-                        #     values = first_col
-                        if flavor == 'json':
-                            result = pandas.DataFrame(data=values).to_json()
-                        elif flavor == 'native':
-                            result = values
-                        elif flavor == 'pandas':
-                            result = pandas.DataFrame(data=values)
-                        else:
-                            result = pandas.DataFrame(data=values).to_json()
+                if type(values) != Series:
+                    raise Exception("Incorrect data format for expression.")
 
-                    if not has_blocks and flatten:
-                        flattened = {}
-                        for col, vals in result.items():
-                            for date, val in vals.items():
-                                flattened[date] = flattened.get(date, 0) + val
-                        result = flattened
+                if not has_blocks and flatten:
+                    values = values.flatten()
 
+                if flavor == 'series':
+                    result = values
+                elif flavor == 'native':
+                    result = values.to_native(flatten=not has_blocks and flatten)
+                elif flavor == 'pandas':
+                    result = values.to_pandas()
                 else:
-                    raise Exception("Incorrect data format for expression.")
+                    result = values.to_json(flatten=not has_blocks and flatten)
+
             else:
                 result = values
 
@@ -474,7 +654,7 @@ class Evaluator:
             line_number = traceback.extract_tb(tb)[-1][1]
             line_number -= 11
             errormsg = "%s at line %d: %s" % (err_class, line_number, detail)
-            if for_eval and timestep.index > 0:
+            if for_eval and timestep is not None and timestep.index > 0:
                 errormsg += '\n\nThis error was encountered after the first time step, and might not occur during a model run.'
             # if for_eval:
             #     raise EvalException(errormsg, 3)
@@ -500,7 +680,7 @@ class Evaluator:
 
             parentkey = kwargs.get('parentkey')
             date = kwargs.get('date')
-            depth = kwargs.get('depth')
+            depth = kwargs.get('depth') or 0
             timestep = kwargs.get('timestep')
             flatten = kwargs.get('flatten', True)
             default = kwargs.get('default')
@@ -510,6 +690,7 @@ class Evaluator:
             start = None
             end = None
             offset_date_as_string = None
+            offset_position = None
 
             rs_value = self.resource_scenarios.get(key)
             if rs_value is None:
@@ -552,7 +733,8 @@ class Evaluator:
                 # calculate offset
                 offset_date_as_string = None
                 if offset:
-                    offset_timestep = self.dates.index(date) + offset + 1
+                    position = self.index.position(date) if date is not None else timestep.index
+                    offset_timestep = position + offset + 1
                     if offset_timestep < 1 or offset_timestep > len(self.dates):
                         raise Exception("Invalid offset")
                 else:
@@ -563,8 +745,12 @@ class Evaluator:
                             or type(stored_result) in [int, float, str, list]:
                         pass
                     elif data_type == 'timeseries':
-                        offset_date_as_string = self.dates_as_string[offset_timestep - 1]
-                        stored_result = stored_result.get(offset_date_as_string)
+                        offset_position = offset_timestep - 1
+                        offset_date_as_string = self.dates_as_string[offset_position]
+                        if type(stored_result) == Series:
+                            stored_result = stored_result.get(offset_position)
+                        else:
+                            stored_result = None
                     else:
                         pass
 
@@ -583,11 +769,11 @@ class Evaluator:
             # has_blocks = properties.get('has_blocks', False)
             has_blocks = False
             if key != parentkey:  # tracking parent key prevents stack overflows
-                if self.store.get(key) is None or 'timeseries' in data_type and timestep and timestep.timestep not in \
-                        self.store[key]:
+                stored_value = self.store.get(key)
+                if stored_value is None or 'timeseries' in data_type and type(stored_value) != Series:
                     eval_data = self.eval_data(
                         dataset=rs_value,
-                        flavor=flavor,
+                        flavor='series' if data_type == 'timeseries' else flavor,
                         flatten=flatten,
                         depth=depth,
                         parentkey=key,
@@ -620,46 +806,29 @@ class Evaluator:
                             end = pandas.to_datetime(end)
 
                         if key != parentkey:
-                            start_as_string = start.isoformat(' ')
-                            end_as_string = end.isoformat(' ')
                             agg = kwargs.get('agg', 'mean')
-                            if default_flavor == 'pandas':
-                                result = value.loc[start_as_string:end_as_string].agg(agg)[0]
-                            elif default_flavor == 'native':
-                                if flatten:
-                                    values = value
-                                else:
-                                    values = list(value.values())[0]
-                                vals = [values[k] for k in values.keys() if start_as_string <= k <= end_as_string]
-                                if agg == 'mean':
-                                    result = numpy.mean(vals)
-                                elif agg == 'sum':
-                                    result = numpy.sum(vals)
+                            result = value.aggregate(start, end, agg=agg)
                         else:
                             result = None
 
                     elif offset_date_as_string:
 
                         if key == parentkey:
-                            result = self.store.get(key, {}).get(offset_date_as_string)
+                            stored_value = self.store.get(key)
+                            if type(stored_value) == Series:
+                                result = stored_value.get(offset_position)
                             if result is None:
                                 raise Exception(
                                     "No result found for this variable for date {}".format(offset_date_as_string))
 
                         else:
-                            if flavor == 'pandas':
-                                if has_blocks:
-                                    result = value.loc[offset_date_as_string]
-                                else:
-                                    result = value.loc[offset_date_as_string][0]
+                            result = value.get(offset_position, has_blocks=has_blocks)
 
-                            else:
-                                if has_blocks:
-                                    # temp = value.get(0) or value.get('0') or {}
-                                    # result = temp.get(offset_date_as_string)
-                                    result = {c: value[c][offset_date_as_string] for c in value.keys()}
-                                else:
-                                    result = value.get(offset_date_as_string)
+                    elif type(value) == Series:
+                        if flavor == 'pandas':
+                            result = value.to_pandas()
+                        else:
+                            result = value.to_native(flatten=flatten)
 
                 elif data_type == 'array':
 
@@ -676,7 +845,9 @@ class Evaluator:
                     result = value
 
             else:
-                if rs_value.type in ['timeseries', 'periodic timeseries']:
+                if type(result) == Series:
+                    result = result.get(offset_position) if offset_position is not None else result.to_native()
+                elif rs_value['type'] in ['timeseries', 'periodic timeseries']:
                     result = result.get(offset_date_as_string)
                 self.store[key] = result
 
@@ -702,32 +873,22 @@ class Evaluator:
             interp_method = kwargs.pop('interp_method', None)
             fit = kwargs.pop('fit', True)
 
-            path = 's3://{}/{}/{}'.format(self.bucket, self.files_path, path)
+            key = '{}/{}'.format(self.files_path, path)
             try:
-                df = pandas.read_csv(path, **kwargs)
+                filekey, df = read_external_csv(self.bucket, key, **kwargs)
             except:
                 self.external[externalkey] = None
                 raise Exception("read_csv failed")
 
-            # client = boto3.client('s3')
-            # obj = client.get_object(Bucket=self.bucket, Key=fullpath)
-            # df = pandas.read_csv(BytesIO(obj['Body'].read()), **kwargs)
-
-            if fill_method:
-                interp_args = {}
-                if fill_method == 'interpolate':
-                    if interp_method in ['time', 'akima', 'quadratic']:
-                        interp_args['method'] = interp_method
-                    df.interpolate(inplace=True, **interp_args)
-            if fit and type(df.index) == pandas.DatetimeIndex:
-                df = df.reindex(self.dates, fill_value=None)
+            dates_key = (len(self.dates), self.dates_as_string[0], self.dates_as_string[-1]) if self.dates else None
+            df = fit_external_data(filekey, df, self.dates, dates_key, fill_method=fill_method,
+                                   interp_method=interp_method, fit=fit)
 
+            # the cached frame is shared by all evaluators, so give this one its own copy
             if flavor == 'native':
                 data = df.to_dict()
-            elif flavor == 'dataframe':
-                data = df
             else:
-                data = df
+                data = df.copy()
 
             self.external[externalkey] = data
 
@@ -6,7 +6,7 @@ import traceback
 import pandas
 import numpy
 
-from .utils import make_timesteps, make_default_value, EMPTY_VALUES, \
+from .utils import get_timestep_grid, make_default_value, EMPTY_VALUES, \
     eval_array, eval_descriptor, eval_scalar, eval_timeseries
 
 
@@ -42,53 +42,6 @@ def parse_function(user_code, name, argnames, modules=()):
     return func
 
 
-class Timestep(object):
-    index = -1
-    periodic_timestep = 1
-
-    def __init__(self, date, start_date, span):
-        if date == start_date:
-            type(self).index = 0
-            type(self).periodic_timestep = 1
-        else:
-            type(self).index += 1
-        self.index = type(self).index
-        self.timestep = self.index + 1
-        self.date = date
-        self.year = date.year
-        self.month = date.month
-        self.day = date.day
-        self.date_as_string = date.isoformat(' ')
-
-        if start_date:
-            if date.month < start_date.month:
-                self.water_year = date.year
-            else:
-                self.water_year = date.year + 1
-
-        if span:
-            self.span = span
-            self.set_periodic_timestep(date, start_date, span)
-
-    def set_periodic_timestep(self, date, start_date, span):
-
-        if span == 'day':
-            if (date.month, date.day) == (start_date.month, start_date.day):
-                type(self).periodic_timestep = 1
-            else:
-                type(self).periodic_timestep += 1
-            self.periodic_timestep = type(self).periodic_timestep
-
-        elif span == 'week':
-            self.periodic_timestep = self.index % 52 + 1
-
-        elif span == 'month':
-            self.periodic_timestep = self.index % 12 + 1
-
-        elif span == 'thricemonthly':
-            self.periodic_timestep = self.index % 36 + 1
-
-
 class InnerSyntaxError(SyntaxError):
     """Exception for syntax errors that will be defined only where the SyntaxError is made.
 
@@ -122,10 +75,10 @@ class Evaluator(object):
 
         if data_type in [None, 'timeseries', 'periodic timeseries']:
             span = kwargs.get('span') or kwargs.get('timestep') or kwargs.get('time_step')
-            dates = make_timesteps(data_type=data_type, **time_settings)
-            self.timesteps = [Timestep(d, dates[0], span) for d in dates]
-            self.dates = [t.date for t in self.timesteps]
-            self.dates_as_string = [t.date_as_string for t in self.timesteps]
+            grid = get_timestep_grid(time_settings, data_type=data_type, span=span)
+            self.timesteps = grid.timesteps
+            self.dates = grid.date_list
+            self.dates_as_string = grid.dates_as_string
             self.start_date = self.dates[0].date
             self.end_date = self.dates[-1].date
 
@@ -0,0 +1,176 @@
+import json
+from math import isnan
+import numpy
+import pandas
+
+AGGREGATORS = {
+    'mean': numpy.nanmean,
+    'sum': numpy.nansum,
+    'min': numpy.nanmin,
+    'max': numpy.nanmax,
+}
+
+
+class DateIndex(object):
+    """
+    An immutable date index shared by all the timeseries of an evaluator.
+
+    Dates are kept both as a DatetimeIndex, for slicing by date, and as strings, which are the keys used in the
+    native and json flavors.
+    """
+
+    def __init__(self, dates, dates_as_string=None):
+        self.dates = pandas.DatetimeIndex(dates)
+        if dates_as_string is None:
+            dates_as_string = [d.isoformat(' ') for d in self.dates]
+        self.dates_as_string = tuple(dates_as_string)
+        self.positions = {d: i for i, d in enumerate(self.dates_as_string)}
+
+    def __len__(self):
+        return len(self.dates_as_string)
+
+    def position(self, date):
+        '''Get the position of a date, given as a string or date, or None if the date is not in the index'''
+        if isinstance(date, str):
+            return self.positions.get(date)
+        positions = self.dates.get_indexer([pandas.Timestamp(date)])
+        return int(positions[0]) if positions[0] >= 0 else None
+
+    def get_indexer(self, labels):
+        '''Get the positions of date labels (strings or dates), with -1 for labels not in the index'''
+        if isinstance(labels, pandas.DatetimeIndex):
+            return self.dates.get_indexer(labels)
+        positions = numpy.array([self.positions.get(str(label), -1) for label in labels], dtype=int)
+        if len(positions) and (positions == -1).all():
+            try:
+                return self.dates.get_indexer(pandas.to_datetime(labels))
+            except (ValueError, TypeError):
+                pass
+        return positions
+
+    def slice(self, start, end):
+        '''Get the slice of positions between two dates, inclusive'''
+        i = self.dates.searchsorted(pandas.Timestamp(start), side='left')
+        j = self.dates.searchsorted(pandas.Timestamp(end), side='right')
+        return slice(i, j)
+
+
+class Series(object):
+    """
+    A timeseries stored as a float64 array of shape (time steps, blocks) over a shared DateIndex.
+
+    Missing values are stored as NaN and returned as None.
+    """
+
+    __slots__ = ('index', 'values', 'blocks')
+
+    def __init__(self, index, values=None, blocks=None):
+        self.index = index
+        if values is None:
+            values = numpy.full((len(index), len(blocks) if blocks else 1), numpy.nan)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        self.values = values
+        self.blocks = list(blocks) if blocks is not None else list(range(values.shape[1]))
+
+    @classmethod
+    def from_pandas(cls, index, data):
+        '''Create a series from a pandas DataFrame or Series, aligned by date or, failing that, by position'''
+
+        if isinstance(data, pandas.Series):
+            data = data.to_frame(0)
+        values = numpy.full((len(index), data.shape[1]), numpy.nan)
+        frame = data.to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+        if data.index.inferred_type == 'integer' and len(data.index) == len(index):
+            values[:] = frame
+        else:
+            positions = index.get_indexer(data.index)
+            found = positions >= 0
+            values[positions[found]] = frame[found]
+        return cls(index, values, blocks=list(data.columns))
+
+    @classmethod
+    def from_arrays(cls, index, dates, blocks, values):
+        '''Create a series from decoded timeseries arrays (see codec.loads), aligned by date'''
+
+        if len(dates) == len(index) and (dates == index.dates).all():
+            return cls(index, values.copy(), blocks=blocks)
+        aligned = numpy.full((len(index), values.shape[1]), numpy.nan)
+        positions = index.get_indexer(dates)
+        found = positions >= 0
+        aligned[positions[found]] = values[found]
+        return cls(index, aligned, blocks=blocks)
+
+    @classmethod
+    def from_dict(cls, index, data):
+        '''Create a series from a native dictionary, either {date: value} or {block: {date: value}}'''
+
+        if data and not isinstance(next(iter(data.values())), dict):
+            data = {0: data}
+        values = numpy.full((len(index), len(data) or 1), numpy.nan)
+        for b, block in enumerate(data.values()):
+            positions = index.get_indexer(list(block.keys()))
+            found = positions >= 0
+            block_values = numpy.array([numpy.nan if v is None else v for v in block.values()], dtype=numpy.float64)
+            values[positions[found], b] = block_values[found]
+        return cls(index, values, blocks=list(data.keys()) or None)
+
+    def set(self, position, value):
+        '''Set the value(s) at a time step position; lists, tuples and dicts are treated as block values'''
+
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, (list, tuple, numpy.ndarray)):
+            n = len(value)
+            if n > self.values.shape[1]:
+                self.values = numpy.pad(self.values, ((0, 0), (0, n - self.values.shape[1])),
+                                        constant_values=numpy.nan)
+                self.blocks = list(range(n))
+            self.values[position, :n] = [numpy.nan if v is None else v for v in value]
+        else:
+            self.values[position, 0] = numpy.nan if value is None else value
+
+    def get(self, position, has_blocks=False):
+        '''Get the value at a time step position, or a {block: value} dictionary if has_blocks'''
+
+        row = self.values[position]
+        if has_blocks:
+            return {b: None if isnan(v) else float(v) for b, v in zip(self.blocks, row)}
+        value = row[0]
+        return None if isnan(value) else float(value)
+
+    def flatten(self):
+        '''Sum the blocks into a single-block series, skipping missing values, as codec.to_native does'''
+        if self.values.shape[1] == 1 and not numpy.isnan(self.values).any():
+            return self
+        return Series(self.index, numpy.nansum(self.values, axis=1))
+
+    def aggregate(self, start, end, agg='mean'):
+        '''Aggregate the first block between two dates, inclusive'''
+        if agg not in AGGREGATORS:
+            raise Exception('Unsupported aggregation "{}"'.format(agg))
+        values = self.values[self.index.slice(start, end), 0]
+        if not len(values):
+            return None
+        return float(AGGREGATORS[agg](values))
+
+    def to_native(self, flatten=False):
+        '''Convert to {block: {date: value}}, or {date: value} if flattened'''
+        dates = self.index.dates_as_string
+        if flatten:
+            values = self.flatten().values[:, 0]
+            return {d: None if isnan(v) else v for d, v in zip(dates, values.tolist())}
+        return {
+            b: {d: None if isnan(v) else v for d, v in zip(dates, self.values[:, i].tolist())}
+            for i, b in enumerate(self.blocks)
+        }
+
+    def to_pandas(self):
+        return pandas.DataFrame(self.values, index=list(self.index.dates_as_string), columns=self.blocks)
+
+    def to_json(self, flatten=False):
+        native = self.to_native(flatten=flatten)
+        if not flatten:
+            native = {str(b): block for b, block in native.items()}
+        return json.dumps(native)
@@ -1,8 +1,14 @@
 import pandas
+import numpy
 import json
-from calendar import isleap
+from pandas.tseries.offsets import MonthEnd
+from os import environ
 from datetime import datetime
 
+from openagua.lib.cache import LRUCache
+from . import codec
+from .series import DateIndex
+
 EMPTY_VALUES = {
     'timeseries': {},
     'periodic timeseries': {},
@@ -12,8 +18,56 @@ EMPTY_VALUES = {
 }
 
 
-def make_timesteps(data_type='timeseries', **kwargs):
-    # TODO: Make this more advanced
+def make_weekly_dates(start_date, nweeks):
+    """
+    Make weekly dates, skipping a day whenever a week would start on Mar 4 of a leap year or on Dec 31.
+
+    Weeks are generated in vectorized runs between skips, so the loop runs at most about twice per year.
+    """
+
+    runs = []
+    base = start_date
+    remaining = nweeks
+    while remaining > 0:
+        dates = base + pandas.to_timedelta(7 * numpy.arange(remaining), unit='D')
+        skips = (dates.is_leap_year & (dates.month == 3) & (dates.day == 4)) \
+                | ((dates.month == 12) & (dates.day == 31))
+        if not skips.any():
+            runs.append(dates)
+            break
+        k = int(skips.argmax())
+        skipped = dates[k] + pandas.Timedelta(days=1)
+        runs.append(dates[:k].append(pandas.DatetimeIndex([skipped])))
+        base = skipped + pandas.Timedelta(days=7)
+        remaining -= k + 1
+
+    if not runs:
+        return pandas.DatetimeIndex([])
+    return runs[0].append(runs[1:]) if len(runs) > 1 else runs[0]
+
+
+def make_thricemonthly_dates(start, end):
+    '''Make dates on the 10th, 20th and last day of each month'''
+
+    month_ends = pandas.date_range(start=start, end=end, freq=MonthEnd()).normalize()
+    month_starts = month_ends - pandas.to_timedelta(month_ends.day - 1, unit='D')
+    dates = numpy.stack([
+        (month_starts + pandas.Timedelta(days=9)).values,
+        (month_starts + pandas.Timedelta(days=19)).values,
+        month_ends.values,
+    ], axis=1)
+    return pandas.DatetimeIndex(dates.ravel())
+
+
+def make_timesteps(data_type='timeseries', as_index=False, **kwargs):
+    """
+    Make the dates of a model time horizon.
+
+    :param data_type: 'timeseries' or 'periodic timeseries'
+    :param as_index: return a pandas DatetimeIndex instead of a list of dates
+    :param kwargs: start, end and span (or their alternative names), and format ('native' or 'iso')
+    :return: the dates
+    """
 
     span = kwargs.get('span') or kwargs.get('timestep') or kwargs.get('time_step')
     start = kwargs.get('start') or kwargs.get('start_time')
@@ -21,7 +75,7 @@ def make_timesteps(data_type='timeseries', **kwargs):
 
     format = kwargs.get('format', 'native')
 
-    dates = []
+    dates = pandas.DatetimeIndex([])
 
     if start and end and span:
 
@@ -35,37 +89,120 @@ def make_timesteps(data_type='timeseries', **kwargs):
         span = span.lower()
 
         if data_type == 'periodic timeseries':
-            start_date = datetime(1678, 1, 1)
-            end_date = datetime(1678, 12, 31, 23, 59)
+            start_date = pandas.Timestamp(1678, 1, 1)
+            end_date = pandas.Timestamp(1678, 12, 31, 23, 59)
 
         if span == 'day':
             dates = pandas.date_range(start=start, end=end, freq='D')
         elif span == 'week':
-            dates = []
-            for i in range(52 * (end_date.year - start_date.year)):
-                if i == 0:
-                    date = start_date
-                else:
-                    date = dates[-1] + pandas.DateOffset(days=7)
-                if isleap(date.year) and date.month == 3 and date.day == 4:
-                    date += pandas.DateOffset(days=1)
-                if date.month == 12 and date.day == 31:
-                    date += pandas.DateOffset(days=1)
-                dates.append(date)
+            dates = make_weekly_dates(start_date, 52 * (end_date.year - start_date.year))
         elif span == 'month':
-            dates = pandas.date_range(start=start, end=end, freq='M')
+            dates = pandas.date_range(start=start, end=end, freq=MonthEnd())
         elif span == 'thricemonthly':
-            dates = []
-            for date in pandas.date_range(start=start, end=end, freq='M'):
-                d1 = pandas.datetime(date.year, date.month, 10)
-                d2 = pandas.datetime(date.year, date.month, 20)
-                d3 = pandas.datetime(date.year, date.month, date.daysinmonth)
-                dates.extend([d1, d2, d3])
+            dates = make_thricemonthly_dates(start, end)
 
     if format == 'iso':
-        dates = [d.isoformat() for d in dates]
+        return [d.isoformat() for d in dates]
+
+    if as_index:
+        return dates
+
+    return list(dates)
+
+
+class Timestep(object):
+    '''A single time step of a TimestepGrid'''
+
+    def __init__(self, grid, i):
+        self.index = i
+        self.timestep = i + 1
+        self.date = grid.date_list[i]
+        self.year = int(grid.year[i])
+        self.month = int(grid.month[i])
+        self.day = int(grid.day[i])
+        self.date_as_string = grid.dates_as_string[i]
+        self.water_year = int(grid.water_year[i])
+        self.periodic_timestep = int(grid.periodic_timestep[i])
+        if grid.span:
+            self.span = grid.span
+
+
+class TimestepGrid(object):
+    """
+    Read-only arrays describing every time step of a model time horizon.
+
+    Grids are shared between evaluators (see get_timestep_grid), so none of their attributes should be modified.
+    """
+
+    def __init__(self, dates, span=None):
+        self.span = span
+        self.dates = pandas.DatetimeIndex(dates)
+        self.date_list = list(self.dates)
+        self.dates_as_string = tuple(d.isoformat(' ') for d in self.date_list)
+        self.date_index = DateIndex(self.dates, self.dates_as_string)
+
+        n = len(self.dates)
+        self.index = numpy.arange(n)
+        self.timestep = self.index + 1
+        self.year = self.dates.year.to_numpy()
+        self.month = self.dates.month.to_numpy()
+        self.day = self.dates.day.to_numpy()
+
+        if n:
+            start_date = self.dates[0]
+            self.water_year = numpy.where(self.month < start_date.month, self.year, self.year + 1)
+        else:
+            self.water_year = self.year.copy()
+
+        if span == 'day' and n:
+            # restart the count each year on the month and day of the start date
+            restarts = (self.month == start_date.month) & (self.day == start_date.day)
+            restarts[0] = True
+            last_restart = numpy.maximum.accumulate(numpy.where(restarts, self.index, 0))
+            self.periodic_timestep = self.index - last_restart + 1
+        elif span in PERIODS:
+            self.periodic_timestep = self.index % PERIODS[span] + 1
+        else:
+            self.periodic_timestep = numpy.ones(n, dtype=int)
+
+        for array in [self.index, self.timestep, self.year, self.month, self.day, self.water_year,
+                      self.periodic_timestep]:
+            array.flags.writeable = False
+
+        self.timesteps = [Timestep(self, i) for i in range(n)]
+
+    def __len__(self):
+        return len(self.timesteps)
+
+
+# number of time steps in a year, by span
+PERIODS = {
+    'week': 52,
+    'month': 12,
+    'thricemonthly': 36,
+}
+
+# timestep grids shared across evaluators, keyed by time settings
+timestep_grids = LRUCache(maxsize=int(environ.get('OA_TIMESTEP_GRID_CACHE_SIZE', 100)))
+
+
+def get_timestep_grid(time_settings, data_type='timeseries', span=None):
+    '''Get the (cached) timestep grid for a set of time settings'''
 
-    return dates
+    start = time_settings.get('start') or time_settings.get('start_time')
+    end = time_settings.get('end') or time_settings.get('end_time')
+    # the dates are made with the time settings' own span; the span given is only recorded with the grid
+    dates_span = time_settings.get('span') or time_settings.get('timestep') or time_settings.get('time_step')
+    span = span or dates_span
+    key = (str(start), str(end), dates_span, span, data_type)
+
+    grid = timestep_grids.get(key)
+    if grid is None:
+        dates = make_timesteps(data_type=data_type, as_index=True, start=start, end=end, span=dates_span)
+        grid = TimestepGrid(dates, span=span)
+        timestep_grids.set(key, grid)
+
+    return grid
 
 
 def make_default_value(data_type='timeseries', dates=None, nblocks=1, default_value=0, flavor='json',
@@ -101,10 +238,13 @@ def empty_data_timeseries(dates, nblocks=1, flavor='json', date_format='iso', de
         timeseries = None
         values = [default_value] * len(dates)
         if flavor == 'json':
-            vals = {str(b): values for b in range(nblocks or 1)}
             if date_format == 'iso':
-                timeseries = pandas.DataFrame(vals, index=dates).to_json(date_format='iso')
+                blocks = list(range(nblocks or 1))
+                fill = numpy.nan if default_value is None else default_value
+                timeseries = codec.dumps(pandas.DatetimeIndex(pandas.to_datetime(list(dates))), blocks,
+                                         numpy.full((len(dates), len(blocks)), fill, dtype=numpy.float64))
             elif date_format == 'original':
+                vals = {str(b): values for b in range(nblocks or 1)}
                 timeseries = pandas.DataFrame(vals, index=dates)
         elif flavor == 'native':
             vals = {b: values for b in range(nblocks)}
@@ -142,31 +282,32 @@ def eval_timeseries(timeseries, dates, fill_value=None, fill_method=None, flatte
                     date_format='%Y-%m-%d %H:%M:%S'):
     try:
 
-        df = pandas.read_json(timeseries)
-        if df.empty:
-            df = pandas.DataFrame(index=dates, columns=['0'])
+        ts = codec.loads(timeseries)
+        values = ts.values
+        if not len(ts.dates):
+            ts = codec.Timeseries(pandas.DatetimeIndex(pandas.to_datetime(list(dates))), [0], None, False)
+            values = numpy.full((len(ts.dates), 1), numpy.nan)
         else:
             # TODO: determine if the following reindexing is needed; it's unclear why it was added
-            # this doesn't work with periodic timeseries, as Pandas doesn't like the year 9999
             # df = df.reindex(pandas.DatetimeIndex(dates))
             if fill_value is not None:
-                df.fillna(value=fill_value, inplace=True)
+                values = numpy.where(numpy.isnan(values), fill_value, values)
             elif fill_method:
-                df.fillna(method=fill_method)
+                values = pandas.DataFrame(values).fillna(method=fill_method).to_numpy()
 
         result = None
-        if flatten:
-            df = df.sum(axis=1)
-
-        if flavor == 'pandas':
-            result = df
+        if flavor == 'codec':
+            if flatten:
+                values = numpy.nansum(values, axis=1).reshape(-1, 1)
+                ts = ts._replace(blocks=[0])
+            result = ts._replace(values=values)
+        elif flavor == 'pandas':
+            result = codec.to_pandas(ts.dates, ts.blocks, values, flatten=flatten)
         elif flavor == 'native':
-            df.index = df.index.strftime(date_format=date_format)
-            result = df.to_dict()
-        elif flavor == 'json':
-            result = df.to_json(date_format='iso')
+            result = codec.to_native(ts.dates, ts.blocks, values, date_format=date_format, periodic=ts.periodic,
+                                     flatten=flatten)
         else:
-            result = df.to_json(date_format='iso')
+            result = codec.dumps(ts.dates, ts.blocks, values, periodic=ts.periodic, flatten=flatten)
 
     except:
 
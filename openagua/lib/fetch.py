@@ -0,0 +1,91 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+log = logging.getLogger(__name__)
+
+FETCH_WORKERS = int(environ.get('OA_FETCH_WORKERS', 16))
+FETCH_RETRIES = int(environ.get('OA_FETCH_RETRIES', 2))
+FETCH_BACKOFF = float(environ.get('OA_FETCH_BACKOFF', 0.2))
+
+# S3 error codes worth retrying
+TRANSIENT_CODES = ['Throttling', 'ThrottlingException', 'SlowDown', 'RequestTimeout', 'RequestTimeTooSkewed',
+                   'InternalError', 'ServiceUnavailable', '500', '502', '503', '504']
+
+# process-wide pool, so concurrent requests share the same bound on open connections
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+
+def is_transient(err):
+    '''Check if a failed fetch might succeed if tried again'''
+    if isinstance(err, ClientError):
+        return str(err.response.get('Error', {}).get('Code')) in TRANSIENT_CODES
+    if isinstance(err, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return False
+    return isinstance(err, (BotoCoreError, ConnectionError, TimeoutError, OSError))
+
+
+def fetch_ordered(fetch, keys, parallel=True, retries=None, backoff=None):
+    """
+    Call fetch(key) for each key, concurrently on the shared fetch pool, retrying transient errors.
+
+    :param fetch: The function to call with each key
+    :param keys: The keys to fetch
+    :param parallel: Fetch concurrently; set this to False for sources that aren't thread safe
+    :param retries: The number of retries after a transient error (default: OA_FETCH_RETRIES)
+    :param backoff: The delay before the first retry, doubled for each retry (default: OA_FETCH_BACKOFF)
+    :return: The results and errors, as lists in the same order as the keys, and a timing for each fetch
+    """
+
+    retries = FETCH_RETRIES if retries is None else retries
+    backoff = FETCH_BACKOFF if backoff is None else backoff
+
+    def attempt(key):
+        start = time.time()
+        attempts = 0
+        result = error = None
+        while True:
+            attempts += 1
+            try:
+                result = fetch(key)
+                error = None
+                break
+            except Exception as err:
+                error = err
+                if attempts > retries or not is_transient(err):
+                    break
+                time.sleep(backoff * 2 ** (attempts - 1))
+        timing = {
+            'key': key,
+            'seconds': round(time.time() - start, 4),
+            'attempts': attempts,
+            'error': str(error) if error else None,
+        }
+        return result, error, timing
+
+    if parallel and len(keys) > 1:
+        fetched = list(fetch_pool.map(attempt, keys))
+    else:
+        fetched = [attempt(key) for key in keys]
+
+    results = [f[0] for f in fetched]
+    errors = [f[1] for f in fetched]
+    timings = [f[2] for f in fetched]
+
+    return results, errors, timings
+
+
+def log_timings(timings, label='fetch'):
+    '''Log each fetch at debug level and a summary at info level'''
+    if not timings:
+        return
+    for timing in timings:
+        log.debug('{} {key}: {seconds}s, {attempts} attempt(s), error: {error}'.format(label, **timing))
+    seconds = [t['seconds'] for t in timings]
+    log.info('{}: {} fetches, {:.3f}s total, {:.3f}s max, {} retries, {} failed'.format(
+        label, len(timings), sum(seconds), max(seconds), sum(t['attempts'] - 1 for t in timings),
+        len([t for t in timings if t['error']])
+    ))
@@ -0,0 +1,149 @@
+"""
+Compact long-form data frames, as used for pivot tables.
+
+In a long frame most columns are labels (scenario, resource, attribute, block, ...) repeated on every row, so
+labels are stored as categoricals, dates as datetime64 and values as numbers where possible. Frames are built from
+pieces of columns with LongFrame and combined once, rather than built as one DataFrame per piece and concatenated.
+"""
+
+import numpy
+import pandas
+from pandas.api.types import union_categoricals
+
+
+def to_dates(values):
+    '''Convert date labels to datetime64, parsing each distinct label only once'''
+    if pandas.api.types.is_datetime64_any_dtype(values):
+        return pandas.DatetimeIndex(values)
+    codes, uniques = pandas.factorize(numpy.asarray(values))
+    return pandas.DatetimeIndex(pandas.to_datetime(uniques)[codes])
+
+
+def format_dates(dates, date_format):
+    '''Format dates as a categorical of strings, formatting each distinct date only once'''
+    codes, uniques = pandas.factorize(pandas.DatetimeIndex(dates))
+    labels = pandas.DatetimeIndex(uniques).strftime(date_format)
+    label_codes, categories = pandas.factorize(labels)
+    return pandas.Categorical.from_codes(label_codes[codes] if len(codes) else codes, categories=categories)
+
+
+def to_categoricals(df, columns):
+    '''Convert label columns to categoricals, with missing labels as "", in a shallow copy of a frame'''
+    df = df.copy(deep=False)
+    for name in columns:
+        column = df[name]
+        if column.dtype.name != 'category':
+            column = column.astype('category')
+        if column.isnull().any():
+            if '' not in column.cat.categories:
+                column = column.cat.add_categories([''])
+            column = column.fillna('')
+        df[name] = column
+    return df
+
+
+def concat_frames(dfs):
+    '''Concatenate frames, keeping categorical columns categorical even if their categories differ'''
+    if len(dfs) == 1:
+        return dfs[0]
+    columns = {}
+    for df in dfs:
+        for name in df.columns:
+            columns.setdefault(name, []).append(df[name])
+    data = {}
+    for name, parts in columns.items():
+        if len(parts) == len(dfs) and all(part.dtype.name == 'category' for part in parts):
+            try:
+                data[name] = union_categoricals([part.values for part in parts])
+            except TypeError:
+                # categories of different types, e.g. IDs as numbers and as strings
+                data[name] = pandas.concat([part.astype(object) for part in parts], ignore_index=True)
+                data[name] = data[name].astype('category')
+        else:
+            data[name] = pandas.concat([df[name] if name in df else pandas.Series(None, index=df.index, dtype=object)
+                                        for df in dfs], ignore_index=True)
+    return pandas.DataFrame(data)
+
+
+class LongFrame(object):
+    """
+    Build a long data frame from pieces, each a set of columns of the same length.
+
+    Labels are given for each piece either as one value for all of its rows or as an array, and are stored as
+    codes, so a piece doesn't repeat its labels. Labels that are missing, or not given for a piece, are "". Other
+    columns are given as arrays and must be given for every piece.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.categories = {}
+        self.codes = {}
+        self.columns = {}
+        self.nrows = 0
+        for name in labels:
+            self.add_label(name)
+
+    def add_label(self, name):
+        if name in self.categories:
+            return
+        self.labels.append(name)
+        self.categories[name] = {'': 0}
+        self.codes[name] = [numpy.zeros(self.nrows, dtype=numpy.int32)]
+
+    def get_code(self, name, value):
+        if value is None or value != value:
+            value = ''
+        categories = self.categories[name]
+        code = categories.get(value)
+        if code is None:
+            code = categories[value] = len(categories)
+        return code
+
+    def append(self, labels, **columns):
+        """
+        Add a piece.
+
+        :param labels: The labels, as a dictionary of values or arrays
+        :param columns: The other columns, as arrays
+        """
+
+        n = len(next(iter(columns.values())))
+        for name, value in labels.items():
+            self.add_label(name)
+        for name in self.labels:
+            value = labels.get(name)
+            if isinstance(value, (list, tuple, numpy.ndarray, pandas.Index, pandas.Series)):
+                codes, uniques = pandas.factorize(numpy.asarray(value, dtype=object))
+                # missing values have the code -1, which picks the last code: ""
+                lookup = numpy.array([self.get_code(name, u) for u in uniques] + [0], dtype=numpy.int32)
+                self.codes[name].append(lookup[codes])
+            else:
+                self.codes[name].append(numpy.full(n, self.get_code(name, value), dtype=numpy.int32))
+        for name, values in columns.items():
+            self.columns.setdefault(name, []).append(numpy.asarray(values))
+        self.nrows += n
+
+    def to_frame(self, columns=None):
+        """
+        Combine the pieces into a DataFrame.
+
+        :param columns: The column order; by default the labels, then the other columns
+        :return: The DataFrame
+        """
+
+        data = {}
+        for name in self.labels:
+            categories = pandas.Index(list(self.categories[name]), dtype=object)
+            column = pandas.Categorical.from_codes(numpy.concatenate(self.codes[name]), categories=categories)
+            data[name] = column.remove_unused_categories()
+        for name, parts in self.columns.items():
+            kinds = set(part.dtype.kind for part in parts)
+            if len(kinds) > 1 or kinds & {'U', 'S', 'O'}:
+                # e.g. a mix of numbers and strings, which numpy would otherwise make all strings
+                parts = [part.astype(object) for part in parts]
+            data[name] = numpy.concatenate(parts)
+
+        df = pandas.DataFrame(data, index=pandas.RangeIndex(self.nrows))
+        if columns is not None:
+            df = df[[c for c in columns if c in df] + [c for c in df.columns if c not in columns]]
+        return df
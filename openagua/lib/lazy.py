@@ -0,0 +1,105 @@
+"""
+Lazy attribute access for Hydra responses.
+
+Hydra responses can be large (e.g., a network with its data), and most of a response is often only passed on, e.g.,
+with jsonify. Rather than converting a whole response up front, a response is wrapped as a LazyAttrDict or LazyList,
+which wrap the dictionaries and lists in them only when they are accessed.
+
+Nested dictionaries that already allow attribute access (e.g., Hydra's JSONObjects) are left as they are, so they
+behave as they did before; only plain dictionaries are wrapped.
+"""
+
+from munch import Munch
+
+
+WRAPPED_TYPES = (dict, list)
+
+
+def wrap_nested(value):
+    '''Wrap a value found inside a response, if it is a plain dictionary or list'''
+    value_type = type(value)
+    if value_type is dict:
+        return LazyAttrDict(value)
+    elif value_type is list:
+        return LazyList(value)
+    return value
+
+
+class LazyAttrDict(Munch):
+    """
+    A Munch whose nested dictionaries and lists are wrapped when they are first accessed.
+
+    Creating one copies only the top-level keys. Values are wrapped however they are accessed (by key, attribute,
+    get, items or values), and wrapped values replace the originals, so changes to them are kept.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # as Munch's, but without setting each key in Python
+        dict.__init__(self, *args, **kwargs)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        wrapped = wrap_nested(value)
+        if wrapped is not value:
+            dict.__setitem__(self, key, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(key, self[key] if type(value) in WRAPPED_TYPES else value) for key, value in dict.items(self)]
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def pop(self, key, *args):
+        return wrap_nested(dict.pop(self, key, *args))
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class LazyList(list):
+    """
+    A list whose dictionaries and lists are wrapped when they are first accessed.
+
+    :param wrap_all: Wrap all dictionaries as LazyAttrDicts, not just plain ones, as for lists returned by Hydra
+    """
+
+    def __init__(self, items=(), wrap_all=False):
+        super(LazyList, self).__init__(items)
+        self.wrap_all = wrap_all
+
+    def _wrap(self, i, value):
+        if self.wrap_all and isinstance(value, dict) and not isinstance(value, LazyAttrDict):
+            wrapped = LazyAttrDict(value)
+        else:
+            wrapped = wrap_nested(value)
+        if wrapped is not value:
+            list.__setitem__(self, i, wrapped)
+        return wrapped
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return LazyList([self[j] for j in range(*i.indices(len(self)))], wrap_all=self.wrap_all)
+        value = list.__getitem__(self, i)
+        return self._wrap(i, value)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._wrap(i, list.__getitem__(self, i))
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self._wrap(i, list.__getitem__(self, i))
+
+    def pop(self, i=-1):
+        value = self[i]
+        list.pop(self, i)
+        return value
+
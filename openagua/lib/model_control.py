@@ -6,6 +6,7 @@ from datetime import datetime
 from flask import current_app as app, g, request
 
 from openagua import db, socketio
+from openagua.lib.results_cache import invalidate_results
 from openagua.lib.runners import run_model_rabbitmq, run_model_local, run_model_ec2
 from openagua.models import Ping, Run
 from openagua.utils import get_utc, get_model, get_network_model
@@ -300,6 +301,8 @@ def end_model_run(sid, status, data, report_to_browser=False):
     data.pop('sid', None)
     data.pop('status', None)
     ping = add_ping(sid, status, **data)
+    if data.get('network_id'):
+        invalidate_results(data['network_id'])
     if report_to_browser:
         ping = ping.to_json()
         for key in data:
@@ -16,6 +16,7 @@ import pendulum
 
 from openagua.lib.network_editor import repair_network_references, update_links2, make_feature_collection
 from openagua.lib.templates import clean_template, clean_template2, add_template
+from openagua.lib.template_cache import get_template
 from openagua.lib.files import add_storage, upload_network_data, duplicate_folder
 from openagua.utils import change_active_template
 from openagua.request_functions import _load_datauser, _make_connection
@@ -327,7 +328,7 @@ def repair_network(conn, source_id, network_id=None, network=None, options=None)
 
     else:
         template_id = network.layout.get('active_template_id')
-        template = conn.call('get_template', template_id)
+        template = get_template(conn, template_id)
 
     # repair missing attributes
     if {'types-attrs', 'topology'} & set(options):
@@ -800,7 +801,7 @@ def move_network(source, destination, project_id, network_id):
         cleaned_template = None
         old_template = None
         if template_id:
-            old_template = g.conn.call('get_template', template_id)
+            old_template = get_template(g.conn, template_id)
             cleaned_template = clean_template(template=old_template)
 
         _load_datauser(url=destination)
@@ -848,7 +849,7 @@ def clone_network(conn, network_id, **kwargs):
     old_template = new_template = None
     if duplicate_template:
         if template_id:
-            old_template = conn.call('get_template', template_id)
+            old_template = get_template(conn, template_id)
 
     net = clean_network(net, old_template=old_template, new_template=new_template, purpose='clone')
 
@@ -1157,7 +1158,7 @@ def get_network_for_export(conn, network_id, options, file_format):
         network = conn.call('get_network', network_id, include_data=False, include_resources=True,
                             summary=True)
         template_id = network.layout.get('active_template_id')
-        template = conn.call('get_template', template_id)
+        template = get_template(conn, template_id)
         if normalize:
             network = normalize_network(network)
         content = make_zipped_csv(network, template)
@@ -1166,7 +1167,7 @@ def get_network_for_export(conn, network_id, options, file_format):
         network = conn.call('get_network', network_id, include_data=False, include_resources=True,
                             summary=True)
         template_id = network.layout.get('active_template_id')
-        template = conn.call('get_template', template_id)
+        template = get_template(conn, template_id)
         if normalize:
             network = normalize_network(network)
         content = make_xlsx(network, template)
@@ -1185,7 +1186,7 @@ def get_network_for_export(conn, network_id, options, file_format):
 
         if include_template:
             template_id = network.layout.get('active_template_id')
-            template = conn.call('get_template', template_id)
+            template = get_template(conn, template_id)
 
             if preserve:
                 cleaned_template = template
@@ -1211,7 +1212,7 @@ def get_network_for_export(conn, network_id, options, file_format):
                             summary=True)
         network = normalize_network(network)
         template_id = network.layout.get('active_template_id')
-        template = conn.call('get_template', template_id)
+        template = get_template(conn, template_id)
         if file_format == 'geojson':
             geojson = make_feature_collection(network, template, icon=False)
             pretty = options.get('pretty', False)
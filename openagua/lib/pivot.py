@@ -5,6 +5,8 @@ from munch import Munch as AttrDict
 
 from flask import g
 
+from openagua.lib.evaluators import codec
+
 NULL_VALUES = {
     'timeseries': '{}',
     'array': '[[]]',
@@ -21,7 +23,7 @@ def save_pivot_input(pivot, filters, data, network, template, data_date_format):
 
     # for now, this is a requirement
     if not {'Scenario', 'Feature', 'Variable'}.issubset(pfilters):
-        return -1
+        return -1, {'written': 0, 'unchanged': 0, 'skipped': 0}
 
     filters = AttrDict(filters)
 
@@ -75,7 +77,7 @@ def save_pivot_input(pivot, filters, data, network, template, data_date_format):
     else:
         resources = [network]
 
-    resource_lookup = {r.name: r for r in resources}
+    rattr_lookup = make_rattr_lookup(resources, template)
 
     # create dictionary to store resource attribute information (units, etc.)
     # NOTE: For larger networks, we may want to use a more efficient way of getting resource attribute information,
@@ -126,76 +128,147 @@ def save_pivot_input(pivot, filters, data, network, template, data_date_format):
             df.dropna(axis=0, inplace=True)
             df.dropna(axis=1, inplace=True)
 
-            dates = pd.DatetimeIndex(df.index.levels[0]).strftime(data_date_format)
-            df['date'] = dates
-            df.set_index('date', inplace=True)
-
+            # each (scenario, feature, variable) is one timeseries, with a column for each block
+            dates = pd.DatetimeIndex(df.index.get_level_values('Date'))
             cols = df.columns.names
-            for col in df:
-                scenario = col[cols.index('Scenario')]
-                resource_name = col[cols.index('Feature')]
-                variable = col[cols.index('Variable')]
-
-                ts = {date: val for date, val in df[col].iteritems()}
-
-                idx = (scenario, resource_name, variable)
-                if idx not in values:
-                    values[idx] = {}
-                if 'Block' in cols:
-                    block = col[cols.index('Block')]
-                else:
-                    block = '0'
-                values[idx][block] = ts
-            for idx, value in values.items():
-                values[idx] = json.dumps(value)
-
+            array = df.to_numpy()
+            columns = {}
+            for i, col in enumerate(df.columns):
+                idx = (col[cols.index('Scenario')], col[cols.index('Feature')], col[cols.index('Variable')])
+                block = col[cols.index('Block')] if 'Block' in cols else '0'
+                columns.setdefault(idx, []).append((block, i))
+            for idx, blocks in columns.items():
+                block_values = np.column_stack([codec.to_floats(array[:, i]) for block, i in blocks])
+                values[idx] = codec.dumps(dates, [block for block, i in blocks], block_values,
+                                          date_format=data_date_format)
+
+    # only send back data that has changed
+    current = get_current_data(network, rattr_lookup, values.keys(), scenario_lookup)
+
+    written = 0
+    unchanged = 0
+    skipped = 0
     for idx, value in values.items():
         (scenario_name, resource_name, variable) = idx
 
-        scenario = scenario_lookup[scenario_name]
-        if scenario.id not in updated_scenarios:
-            updated_scenarios[scenario.id] = scenario
-            updated_scenarios[scenario.id]['resourcescenarios'] = []  # only send back added data
+        scenario = scenario_lookup.get(scenario_name)
+        rattr, tattr = rattr_lookup.get((resource_name, variable), (None, None))
+        if scenario is None or rattr is None:
+            skipped += 1
+            continue
 
         # dataset name
         name = '{n} - {r} - {v} ({s})'.format(n=network.name, r=resource_name, v=variable, s=scenario_name)
 
-        # get res_attr info (units and dimension)
-        # res_attr = res_attrs[(filters.type, resource_name, variable)]
-        # js equivalent: rattr = network[filters.type.lower + 's'].find(r => r.name===resource_name).attributes.find(ra => ra.attr_name===variable)
-        # TODO: revert back to lookup? It's unclear which is more efficient: an initial lookup, or on-the-fly-filtering
-        resource = resource_lookup[resource_name]
-        rtype = list(filter(lambda rt: rt.template_id == template.id, resource.types))[0]
-        ttype = list(filter(lambda tt: tt.id == rtype.id, template.templatetypes))[0]
-        tattr = list(filter(lambda ta: ta.attr.name == variable, ttype.typeattrs))[0]
-        rattr = list(filter(lambda ra: ra.attr_id == tattr.attr_id, resource.attributes))[0]
-
         metadata = {
             'input_method': input_method,
             'data': value
         }
+        dataset_value = NULL_VALUES.get(data_type, '') if input_method != 'native' else value
+
+        if is_unchanged(current.get((scenario.id, rattr.id)), dataset_value, metadata, data_type):
+            unchanged += 1
+            continue
 
         rs = {
-            'dataset_id': None,
             'resource_attr_id': rattr.id,
-            'attr_id': tattr.attr_id,
-            'value': {
-                'type': tattr.data_type,
+            'dataset': {
+                'id': None,
+                'type': tattr.get('data_type'),
                 'name': name,
-                'unit': tattr.unit,
-                'dimension': tattr.dimension,
-                'value': NULL_VALUES.get(data_type, '') if input_method != 'native' else value,
+                'unit': tattr.get('unit'),
+                'dimension': tattr.get('dimension'),
+                'value': dataset_value,
                 'metadata': json.dumps(metadata)
             }
         }
 
-        updated_scenarios[scenario.id]['resourcescenarios'].append(rs)
+        updated_scenarios.setdefault(scenario.id, []).append(rs)
+        written += 1
 
     if not error:
-        for sid, scenario in updated_scenarios.items():
-            g.conn.call('update_scenario', scenario)
-
-    return error
+        for scenario_id, resource_scenarios in updated_scenarios.items():
+            result = g.conn.call('update_resourcedata', scenario_id, resource_scenarios)
+            if 'error' in result:
+                error = -3
+                written -= len(resource_scenarios)
+
+    return error, {'written': written, 'unchanged': unchanged, 'skipped': skipped}
+
+
+def make_rattr_lookup(resources, template):
+    '''Map each (resource name, variable name) to its resource attribute and template type attribute'''
+    ttypes = {tt.id: tt for tt in template.templatetypes}
+    lookup = {}
+    for resource in resources:
+        rtypes = [rt for rt in resource.types if rt.template_id == template.id]
+        ttype = ttypes.get(rtypes[0].id) if rtypes else None
+        if not ttype:
+            continue
+        rattrs = {ra.attr_id: ra for ra in resource.attributes}
+        for tattr in ttype.typeattrs:
+            rattr = rattrs.get(tattr.attr_id)
+            if rattr:
+                lookup[(resource.name, tattr.attr.name)] = (rattr, tattr)
+    return lookup
+
+
+def get_current_data(network, rattr_lookup, keys, scenario_lookup):
+    '''Get the current datasets of the (scenario, feature, variable) keys, by (scenario ID, resource attribute ID)'''
+    scenario_ids = set()
+    attr_ids = set()
+    resource_ids = {}
+    for (scenario_name, resource_name, variable) in keys:
+        scenario = scenario_lookup.get(scenario_name)
+        rattr, tattr = rattr_lookup.get((resource_name, variable), (None, None))
+        if scenario is None or rattr is None:
+            continue
+        scenario_ids.add(scenario.id)
+        attr_ids.add(rattr.attr_id)
+        ref_key = rattr.ref_key.lower()
+        resource_ids.setdefault('{}_ids'.format(ref_key), set()).add(rattr['{}_id'.format(ref_key)])
+
+    if not scenario_ids:
+        return {}
+
+    kwargs = {key: list(ids) for key, ids in resource_ids.items()}
+    scenarios = g.conn.call('get_scenarios_data', scenario_id=list(scenario_ids), attr_id=list(attr_ids), **kwargs)
+    if 'error' in scenarios:
+        return {}
+
+    current = {}
+    for scenario in scenarios:
+        for rs in scenario.get('resourcescenarios', []):
+            dataset = rs.get('value') or rs.get('dataset')
+            if dataset:
+                current[(scenario['id'], rs['resource_attr_id'])] = dataset
+    return current
+
+
+def is_unchanged(dataset, value, metadata, data_type):
+    '''Check if a dataset already has a value and input metadata'''
+    if not dataset:
+        return False
+    try:
+        current_metadata = json.loads(dataset.get('metadata') or '{}')
+    except (TypeError, ValueError):
+        return False
+    if current_metadata.get('input_method') != metadata['input_method']:
+        return False
+    current_value = dataset.get('value')
+    if metadata['data'] is not value and current_metadata.get('data') != metadata['data']:
+        return False
+    if current_value == value:
+        return True
+    if data_type == 'timeseries' and isinstance(value, str) and isinstance(current_value, str):
+        try:
+            current_ts = codec.loads(current_value)
+            ts = codec.loads(value)
+        except (TypeError, ValueError):
+            return False
+        return current_ts.dates.equals(ts.dates) and current_ts.blocks == ts.blocks \
+            and np.array_equal(current_ts.values, ts.values, equal_nan=True)
+    return False
 
 
 def hot_to_pd(data, cols, rows, dtype=object):
@@ -4,6 +4,7 @@ from urllib.parse import urlparse
 from openagua.security import current_user
 from openagua.lib.users import get_datauser, get_dataurl
 from openagua.lib.templates import clean_template, clean_template2
+from openagua.lib.template_cache import get_template, get_template_by_name
 from openagua.lib.model_editor import get_models, get_active_network_model
 from openagua.utils import decrypt
 from openagua.connection import HydraConnection
@@ -56,8 +57,8 @@ def move_project(key, **kwargs):
                            summary=False)
     for network1 in networks1:
         try:
-            template1 = conn1.call('get_template', network1.types[0].template_id)
-            template2 = conn2.call('get_template_by_name', template_name=template1.name)
+            template1 = get_template(conn1, network1.types[0].template_id)
+            template2 = get_template_by_name(conn2, template1.name)
 
             ttypes2 = {tt['name']: tt['id'] for tt in template2.templatetypes}
 
@@ -168,7 +169,7 @@ def copy_project(project):
         tmpl = clean_template2(old_template.copy())
         tmpl['project_id'] = new_project_id
         new_template = conn.call('add_template', tmpl, check_dimensions=False)
-        new_template = conn.call('get_template', new_template['id'])
+        new_template = get_template(conn, new_template['id'])
         old_templates[old_template['id']] = old_template
         new_templates[old_template['id']] = new_template
 
@@ -189,11 +190,11 @@ def copy_project(project):
                 old_template = old_templates[old_template_id]
                 new_template = new_templates[old_template_id]
             else:
-                old_template = conn.call('get_template', old_template_id)
+                old_template = get_template(conn, old_template_id)
                 cleaned_template = clean_template2(old_template)
                 cleaned_template['project_id'] = new_project_id  # make sure it is scoped to the project
                 new_template = conn.call('add_template', cleaned_template, check_dimensions=False)
-                new_template = conn.call('get_template', new_template['id'])
+                new_template = get_template(conn, new_template['id'])
                 old_templates[old_template_id] = old_template
                 new_templates[old_template_id] = new_template
 
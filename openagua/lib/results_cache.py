@@ -0,0 +1,138 @@
+"""
+Cache of the long-form results data read for each results source (see data.iter_results_sources), so that viewing
+the same results again, e.g., with a different chart or aggregation, doesn't read and reshape them again.
+
+Entries are kept in memory and, if pyarrow is available, as Parquet files on local disk. Sources are keyed by their
+scenario and version (for stored results) or by the scenario's latest run version (for results in Hydra), so a new
+run's results get new entries. Each network also has a generation, stored on disk so that all processes on the host
+share it; ending a model run starts a new generation for its network on the host that records it. Since other hosts
+don't see that, and not every run reports its network, entries also expire after OA_RESULTS_CACHE_SECONDS.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from os import environ
+
+import pandas
+
+from openagua.lib.cache import LRUCache
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = environ.get('OA_RESULTS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'openagua-results'))
+
+RESULTS_CACHE_SECONDS = int(environ.get('OA_RESULTS_CACHE_SECONDS', 600))
+
+entries = LRUCache(maxsize=int(environ.get('OA_RESULTS_CACHE_SIZE', 20)))
+
+
+def make_key(*parts):
+    return hashlib.sha224(str.encode(repr(parts))).hexdigest()
+
+
+def get_network_dir(network_id):
+    return os.path.join(CACHE_DIR, str(network_id))
+
+
+def get_generation(network_id):
+    try:
+        with open(os.path.join(get_network_dir(network_id), 'generation')) as f:
+            return f.read()
+    except OSError:
+        return ''
+
+
+def read_entry(path):
+    if pyarrow is None or not os.path.exists(path):
+        return None
+    if time.time() - os.path.getmtime(path) > RESULTS_CACHE_SECONDS:
+        return None
+    try:
+        table = pq.read_table(path)
+        meta = json.loads(table.schema.metadata[b'openagua'])
+        return [table.to_pandas()], meta['perturbations'], meta['tag_names']
+    except Exception as err:
+        log.warning('Could not read cached results {}: {}'.format(path, err))
+        return None
+
+
+def write_entry(path, df, perturbations, tag_names):
+    if pyarrow is None:
+        return
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        meta = json.dumps({'perturbations': perturbations, 'tag_names': tag_names})
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, openagua=meta))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as err:
+        # e.g., columns of mixed types can't be stored as Parquet; the memory tier still works
+        log.warning('Could not cache results {}: {}'.format(path, err))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_results(network_id, key, read):
+    """
+    Get the results of a source from the cache, or read and cache them.
+
+    :param network_id: The network the results belong to; results without a network aren't cached
+    :param key: A tuple identifying the source (e.g., the data URL, scenario and version) and the filters
+    :param read: A function to read the results, returning (dataframes, perturbations, tag names) or an error code
+    :return: The result of read, with the dataframes combined into one. The dataframe is shared and should not be
+        modified.
+    """
+
+    if network_id is None:
+        return read()
+
+    generation = get_generation(network_id)
+    filekey = make_key(generation, key)
+
+    entry = entries.get((network_id, filekey))
+    if entry is not None and time.time() - entry[0] <= RESULTS_CACHE_SECONDS:
+        return entry[1]
+
+    path = os.path.join(get_network_dir(network_id), filekey + '.parquet')
+    result = read_entry(path)
+    stamp = os.path.getmtime(path) if result is not None else time.time()
+    if result is None:
+        result = read()
+        if type(result) == int:
+            return result
+        dfs, perturbations, tag_names = result
+        if not dfs:
+            return result
+        df = pandas.concat(dfs, ignore_index=True)
+        write_entry(path, df, perturbations, tag_names)
+        result = [df], perturbations, tag_names
+    entries.set((network_id, filekey), (stamp, result))
+
+    return result
+
+
+def invalidate_results(network_id):
+    '''Start a new generation of cached results for a network, deleting cached results of the old one'''
+
+    network_dir = get_network_dir(network_id)
+    shutil.rmtree(network_dir, ignore_errors=True)
+    try:
+        os.makedirs(network_dir, exist_ok=True)
+        with open(os.path.join(network_dir, 'generation'), 'w') as f:
+            f.write(uuid.uuid4().hex)
+    except OSError as err:
+        log.warning('Could not invalidate cached results for network {}: {}'.format(network_id, err))
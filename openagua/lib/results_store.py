@@ -0,0 +1,260 @@
+"""
+Columnar results store: one Parquet dataset per run version, partitioned by scenario and attribute.
+
+Each row is a single value, with the columns scenario, subscenario, resource_key, attr_id, block, date and value.
+Scenarios, attributes and resources are stored as they are named in the CSV results tree (IDs, or names if the
+version is human readable). Network-level results have the resource key "network".
+
+Monthly and annual rollups can also be stored, as datasets with the sum, mean, min and max of each period in place
+of the value, dated to the start of each period.
+"""
+
+import glob
+import logging
+import os
+import posixpath
+from os import environ
+
+import pandas as pd
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet as pq
+
+from openagua.lib.fetch import fetch_ordered, log_timings
+
+log = logging.getLogger(__name__)
+
+DATASET_NAME = 'results.parquet'
+ROLLUP_DATASET_NAME = 'results-{}.parquet'
+PARTITION_COLS = ['scenario', 'attr_id']
+
+# rollup steps, as the numpy units that dates are truncated to
+ROLLUP_STEPS = {'month': 'datetime64[M]', 'year': 'datetime64[Y]'}
+ROLLUP_FUNCTIONS = ['sum', 'mean', 'min', 'max']
+
+SCHEMA = pyarrow.schema([
+    ('scenario', pyarrow.string()),
+    ('subscenario', pyarrow.int64()),
+    ('resource_key', pyarrow.string()),
+    ('attr_id', pyarrow.string()),
+    ('block', pyarrow.int64()),
+    ('date', pyarrow.timestamp('ns')),
+    ('value', pyarrow.float64()),
+])
+
+ROLLUP_SCHEMA = pyarrow.schema(
+    [field for field in SCHEMA if field.name != 'value'] + [(f, pyarrow.float64()) for f in ROLLUP_FUNCTIONS])
+
+# partition values are always read as strings, even if they look like IDs
+PARTITIONING = pyarrow.dataset.partitioning(
+    pyarrow.schema([(col, pyarrow.string()) for col in PARTITION_COLS]), flavor='hive')
+
+# CSV files read at a time when compacting
+COMPACTION_BATCH_FILES = int(environ.get('OA_COMPACTION_BATCH_FILES', 500))
+
+
+def split_path(path):
+    '''Split a path into a filesystem-relative path and whether it is local'''
+    if path.startswith('s3://'):
+        return path[len('s3://'):], False
+    return path, True
+
+
+def get_dataset_path(version_path, step=None):
+    return posixpath.join(version_path, ROLLUP_DATASET_NAME.format(step) if step else DATASET_NAME)
+
+
+def has_rollup(fs, version_path, step):
+    path, is_local = split_path(get_dataset_path(version_path, step))
+    return os.path.exists(path) if is_local else fs.exists(path)
+
+
+def get_rollup(agg):
+    """
+    Get the rollup that gives the same aggregated results as the full results, if any.
+
+    This is the case if results are aggregated by month or year with a rollup function and without a custom time
+    range, as long as any spatial aggregation gives the same result before or after the temporal one.
+
+    :param agg: The aggregation (see data.aggregate_data)
+    :return: The rollup, as a tuple of step and function, or None
+    """
+
+    if not agg:
+        return None
+    temporal = agg.get('time', {})
+    step = temporal.get('step')
+    f = temporal.get('function')
+    if step not in ROLLUP_STEPS or f not in ROLLUP_FUNCTIONS:
+        return None
+    if agg.get('range', {}).get('mode') == 'custom':
+        return None
+    spatial = agg.get('space', {}).get('function')
+    if spatial and not (spatial in ['sum', 'mean'] and f in ['sum', 'mean'] or spatial == f in ['min', 'max']):
+        return None
+    return step, f
+
+
+def get_date_range(agg):
+    '''Get the first and last dates of an aggregation's custom time range (see data.aggregate_data), if any'''
+    date_range = (agg or {}).get('range') or {}
+    if date_range.get('mode') != 'custom':
+        return None, None
+    return date_range.get('start') or None, date_range.get('end') or None
+
+
+def make_rollup(df, step):
+    '''Aggregate results to the start of each period, with a column for each rollup function'''
+    df = df.assign(date=df['date'].values.astype(ROLLUP_STEPS[step]).astype('datetime64[ns]'))
+    by = [name for name in SCHEMA.names if name != 'value']
+    return df.groupby(by, sort=False)['value'].agg(ROLLUP_FUNCTIONS).reset_index()
+
+
+def read_results(fs, version_path, scenario, resource_keys=None, attrs=None, start=None, end=None, rollup=None):
+    """
+    Read the results of a scenario from a run version's dataset.
+
+    The scenario and attributes select partitions, and the resources and dates are pushed down as row group
+    filters, so only the matching parts of the dataset are read.
+
+    :param fs: The S3 filesystem, for datasets on S3
+    :param version_path: The path of the run version, e.g. s3://bucket/folder/results/run/version
+    :param scenario: The scenario, as named in the results tree
+    :param resource_keys: Resource keys (e.g. "node/12") to include
+    :param attrs: Attribute IDs or names to include
+    :param start: The first date to include
+    :param end: The last date to include
+    :param rollup: The rollup to read instead of the full results, as a tuple of step and function (see get_rollup).
+        The function's values are returned as the value column.
+    :return: A dataframe of results
+    """
+
+    step, f = rollup or (None, None)
+    path, is_local = split_path(get_dataset_path(version_path, step))
+
+    filters = [('scenario', '=', str(scenario))]
+    if attrs:
+        filters.append(('attr_id', 'in', [str(a) for a in attrs]))
+    if resource_keys:
+        filters.append(('resource_key', 'in', list(resource_keys)))
+    if start:
+        filters.append(('date', '>=', pd.Timestamp(start)))
+    if end:
+        filters.append(('date', '<=', pd.Timestamp(end)))
+
+    columns = None
+    if rollup:
+        columns = [name for name in SCHEMA.names if name != 'value'] + [f]
+
+    table = pq.read_table(path, filesystem=None if is_local else fs, columns=columns, filters=filters,
+                          partitioning=PARTITIONING)
+    df = table.to_pandas()
+    for col in PARTITION_COLS:
+        df[col] = df[col].astype(str)
+    if rollup:
+        df.rename(columns={f: 'value'}, inplace=True)
+
+    return df
+
+
+def parse_results_key(key):
+    """
+    Parse a CSV results key, relative to its run version, into its scenario, subscenario, resource key and attribute.
+
+    Keys are either {scenario}/{subscenario}/network/{attr}.csv or
+    {scenario}/{subscenario}/{type}/{subtype}/{resource}/{attr}.csv
+    """
+
+    parts = key[:-len('.csv')].split('/')
+    if len(parts) == 4:
+        scenario, subscenario, resource_type, attr = parts
+        resource_key = resource_type
+    elif len(parts) == 6:
+        scenario, subscenario, resource_type, subtype, resource, attr = parts
+        resource_key = '{}/{}'.format(resource_type, resource)
+    else:
+        return None
+    return scenario, int(subscenario), resource_key, attr
+
+
+def write_dataset(df, path, schema, filesystem):
+    table = pyarrow.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    pq.write_to_dataset(table, path, partition_cols=PARTITION_COLS, filesystem=filesystem,
+                        existing_data_behavior='delete_matching')
+
+
+def compact_results(fs, version_path, delete=False, rollups=False):
+    """
+    Convert a run version's CSV results tree into its Parquet dataset.
+
+    Scenarios are converted one at a time, replacing any data already in the dataset for the scenario, so the job can
+    be rerun safely.
+
+    :param fs: The S3 filesystem, for results on S3
+    :param version_path: The path of the run version, e.g. s3://bucket/folder/results/run/version
+    :param delete: Delete the CSV files once converted
+    :param rollups: Also store the monthly and annual rollups
+    :return: The number of files and rows converted
+    """
+
+    root, is_local = split_path(version_path)
+    filesystem = None if is_local else fs
+
+    if is_local:
+        files = glob.glob(posixpath.join(root, '**', '*.csv'), recursive=True)
+    else:
+        files = fs.find(root)
+
+    keys = {}
+    for path in files:
+        key = posixpath.relpath(path, root)
+        if not key.endswith('.csv') or key.split('/')[0].endswith('.parquet'):
+            continue
+        parsed = parse_results_key(key)
+        if parsed:
+            keys.setdefault(parsed[0], []).append((path, parsed))
+
+    def read_csv(path):
+        if is_local:
+            return pd.read_csv(path, skiprows=1, names=['date', 0])
+        with fs.open(path, mode='rb') as f:
+            return pd.read_csv(f, skiprows=1, names=['date', 0])
+
+    nfiles = 0
+    nrows = 0
+    for scenario, scenario_files in keys.items():
+        frames = []
+        for i in range(0, len(scenario_files), COMPACTION_BATCH_FILES):
+            batch = scenario_files[i:i + COMPACTION_BATCH_FILES]
+            dfs, errors, timings = fetch_ordered(read_csv, [path for path, parsed in batch])
+            log_timings(timings, label='compact {}'.format(scenario))
+            for (path, (_, subscenario, resource_key, attr)), df, error in zip(batch, dfs, errors):
+                if error is not None:
+                    raise Exception('Could not read {}: {}'.format(path, error))
+                df = df.melt(id_vars=['date'], var_name='block', value_name='value')
+                df['scenario'] = scenario
+                df['subscenario'] = subscenario
+                df['resource_key'] = resource_key
+                df['attr_id'] = attr
+                frames.append(df)
+
+        df = pd.concat(frames, ignore_index=True)
+        df['date'] = pd.to_datetime(df['date'])
+        df['block'] = df['block'].astype('int64')
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        write_dataset(df, get_dataset_path(root), SCHEMA, filesystem)
+        if rollups:
+            for step in ROLLUP_STEPS:
+                write_dataset(make_rollup(df, step), get_dataset_path(root, step), ROLLUP_SCHEMA, filesystem)
+
+        nfiles += len(scenario_files)
+        nrows += len(df)
+
+        if delete:
+            for path, parsed in scenario_files:
+                if is_local:
+                    os.remove(path)
+                else:
+                    fs.rm(path)
+
+    return nfiles, nrows
@@ -0,0 +1,131 @@
+"""
+Streaming encoders for tabular data produced in chunks, such as results pivots (see data.iter_results_data).
+
+Both encoders take an iterable of (dataframe, perturbations) chunks and a function that makes the header from the
+first chunk. A chunk of (error code, None) stops the stream with that error.
+"""
+
+import json
+from io import BytesIO
+
+import pandas
+
+from openagua.lib.evaluators import codec
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+ARROW_AVAILABLE = pyarrow is not None
+
+
+def json_default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+
+def rows_to_lines(df):
+    '''Encode the rows of a dataframe as JSON arrays, one per line'''
+    columns = []
+    for name in df.columns:
+        column = df[name]
+        if pandas.api.types.is_datetime64_any_dtype(column):
+            values = codec.format_dates(pandas.DatetimeIndex(column))
+        else:
+            values = column.tolist()
+            if column.dtype.kind == 'f':
+                values = [None if v != v else v for v in values]
+        columns.append(values)
+    return ''.join(json.dumps(row, default=json_default) + '\n' for row in zip(*columns))
+
+
+def iter_ndjson(chunks, make_header):
+    """
+    Stream chunks as newline-delimited JSON.
+
+    The first line is the header object, including the column names. Each following line is a row, as an array. If
+    a chunk has different columns, a {"columns": [...]} object precedes its rows. The last line is a trailer object
+    with the number of rows, the perturbations and any error.
+    """
+
+    columns = None
+    nrows = 0
+    perturbations = None
+    for df, perturbations in chunks:
+        if type(df) == int:
+            yield json.dumps({'error': df, 'rows': nrows}) + '\n'
+            return
+        if columns is None:
+            columns = list(df.columns)
+            header = make_header(df, perturbations)
+            header['columns'] = columns
+            yield json.dumps(header) + '\n'
+        elif list(df.columns) != columns:
+            columns = list(df.columns)
+            yield json.dumps({'columns': columns}) + '\n'
+        nrows += len(df)
+        yield rows_to_lines(df)
+
+    yield json.dumps({'rows': nrows, 'perturbations': perturbations, 'error': None if nrows else -3}) + '\n'
+
+
+def to_arrow_frame(df):
+    '''Make a dataframe Arrow-friendly: numeric values and string labels'''
+    df = df.copy()
+    for name in df.columns:
+        if name == 'value':
+            df[name] = pandas.to_numeric(df[name], errors='coerce')
+        elif df[name].dtype == object:
+            df[name] = df[name].astype(str)
+    return df
+
+
+def iter_arrow(chunks, make_header):
+    """
+    Stream chunks as Arrow IPC record batches. This requires pyarrow (see ARROW_AVAILABLE).
+
+    The header is stored as JSON in the schema metadata, under "header". The schema is set by the first chunk, so
+    columns missing from later chunks are left empty and columns not in the first chunk are dropped.
+    """
+
+    sink = BytesIO()
+    writer = None
+    schema = None
+
+    def flush():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate(0)
+        return data
+
+    for df, perturbations in chunks:
+        if type(df) == int:
+            if writer is None:
+                schema = pyarrow.schema([], metadata={'header': json.dumps({'error': df})})
+                writer = pyarrow.ipc.new_stream(sink, schema)
+            break
+        df = to_arrow_frame(df)
+        if writer is None:
+            header = make_header(df, perturbations)
+            schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+            schema = schema.remove_metadata().with_metadata({'header': json.dumps(header)})
+            writer = pyarrow.ipc.new_stream(sink, schema)
+        else:
+            df = df.reindex(columns=schema.names)
+        batch = pyarrow.RecordBatch.from_pandas(df, schema=schema, preserve_index=False)
+        writer.write_batch(batch)
+        yield flush()
+
+    if writer is None:
+        schema = pyarrow.schema([], metadata={'header': json.dumps({'error': -3})})
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    writer.close()
+    yield flush()
@@ -0,0 +1,201 @@
+"""
+Cache of Hydra templates shared by all requests, keyed by data source, Hydra user and template ID, so that a template
+is only ever returned to a user Hydra returned it to.
+
+Templates change rarely, and only through Hydra's template functions. Calling one of them through HydraConnection
+bumps the version of the source's templates (see invalidate), which invalidates all of its cached templates. Entries
+also expire after OA_TEMPLATE_CACHE_SECONDS, in case a template is changed other than through this app.
+
+Entries are kept in memory and, if OA_TEMPLATE_CACHE_REDIS_URL is set and redis is installed, in Redis, so that all
+processes share them and their versions. An entry holds a template as JSON, from which get_template gives every
+caller its own copy to modify, and, in memory, the lookups derived from it (see make_lookups), built once and shared.
+"""
+
+import json
+import logging
+import time
+from os import environ
+from threading import Lock
+
+from munch import Munch as AttrDict, munchify
+
+from openagua.lib.cache import LRUCache
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+log = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_SIZE = int(environ.get('OA_TEMPLATE_CACHE_SIZE', 200))
+TEMPLATE_CACHE_SECONDS = int(environ.get('OA_TEMPLATE_CACHE_SECONDS', 3600))
+TEMPLATE_CACHE_REDIS_URL = environ.get('OA_TEMPLATE_CACHE_REDIS_URL')
+
+entries = LRUCache(maxsize=TEMPLATE_CACHE_SIZE)
+template_ids = LRUCache(maxsize=TEMPLATE_CACHE_SIZE)  # template IDs by name
+
+versions = {}
+versions_lock = Lock()
+
+redis_client = None
+if TEMPLATE_CACHE_REDIS_URL:
+    if redis is None:
+        log.warning('OA_TEMPLATE_CACHE_REDIS_URL is set, but redis is not installed; templates are cached in memory')
+    else:
+        redis_client = redis.Redis.from_url(TEMPLATE_CACHE_REDIS_URL)
+
+
+def is_template_write(fn):
+    '''Check if a Hydra function might change a template, its types or their attributes'''
+    return fn[:4] != 'get_' and ('template' in fn or 'typeattr' in fn or 'attr_from_type' in fn)
+
+
+def get_version(source):
+    version = versions.get(source, 0)
+    if redis_client is not None:
+        try:
+            return version, int(redis_client.get('openagua:template-version:{}'.format(source)) or 0)
+        except Exception as err:
+            log.warning('Could not get the template version from Redis: {}'.format(err))
+            return version, None
+    return version, 0
+
+
+def invalidate(source):
+    '''Invalidate the cached templates of a data source, by bumping its version'''
+    with versions_lock:
+        versions[source] = versions.get(source, 0) + 1
+    if redis_client is not None:
+        try:
+            redis_client.incr('openagua:template-version:{}'.format(source))
+        except Exception as err:
+            log.warning('Could not bump the template version in Redis: {}'.format(err))
+
+
+def make_lookups(template):
+    """
+    Make the lookups commonly derived from a template.
+
+    :param template: The template
+    :return: The template and its lookups: ttypes (types by ID, as make_ttypes), ttypes_by_name (types by name, as
+        make_ttype_dict), tattrs (typeattrs by attribute ID, as get_tattrs), typeattrs_by_type (typeattrs by type ID,
+        then attribute ID) and typeattrs_by_name (typeattrs by attribute name)
+    """
+
+    from openagua.utils import make_ttypes, make_ttype_dict, get_tattrs
+
+    return AttrDict(
+        template=template,
+        ttypes=make_ttypes(template),
+        ttypes_by_name=make_ttype_dict(template),
+        tattrs=get_tattrs(template),
+        typeattrs_by_type={tt.id: {ta.attr_id: ta for ta in tt.typeattrs} for tt in template.templatetypes},
+        typeattrs_by_name={ta.attr.name: ta for tt in template.templatetypes for ta in tt.typeattrs
+                           if ta.get('attr')},
+    )
+
+
+def get_entry(conn, template_id, template=None):
+    """
+    Get the cached JSON of a template and its lookups, adding them to the cache from Redis or Hydra if needed.
+
+    :param template: The template, if it was already read from Hydra
+    :return: The template's JSON (None if it couldn't be serialized, in which case the lookups aren't cached) and
+        lookups, or the error from Hydra
+    """
+
+    source = conn.url
+    version = get_version(source)
+    key = (source, version, conn.user_id, template_id)
+
+    entry = entries.get(key)
+    if entry is not None and time.time() - entry[0] > TEMPLATE_CACHE_SECONDS:
+        entry = None
+    if entry is not None:
+        return entry[1:]
+
+    redis_key = None
+    if version[1] is not None and redis_client is not None:
+        redis_key = 'openagua:template:{}:{}:{}:{}'.format(source, version[1], conn.user_id, template_id)
+    if redis_key and template is None:
+        try:
+            data = redis_client.get(redis_key)
+            if data is not None:
+                entry = time.time(), data, make_lookups(munchify(json.loads(data)))
+                entries.set(key, entry)
+                return entry[1:]
+        except Exception as err:
+            log.warning('Could not get template {} from Redis: {}'.format(template_id, err))
+
+    if template is None:
+        template = conn.call('get_template', template_id, raw=True)
+    if 'error' in template:
+        return template
+    try:
+        data = json.dumps(template)
+    except Exception as err:
+        log.warning('Could not cache template {}: {}'.format(template_id, err))
+        return None, make_lookups(munchify(template))
+
+    # the lookups are built from the JSON, as they are on a hit, so they are the same either way
+    entry = time.time(), data, make_lookups(munchify(json.loads(data)))
+
+    # a template written while this one was read may not be in it, so it is only cached if still current
+    if get_version(source) == version:
+        entries.set(key, entry)
+        if redis_key:
+            try:
+                redis_client.set(redis_key, data, ex=TEMPLATE_CACHE_SECONDS)
+            except Exception as err:
+                log.warning('Could not cache template {} in Redis: {}'.format(template_id, err))
+
+    return entry[1:]
+
+
+def get_template_lookups(conn, template_id):
+    """
+    Get a template and its lookups (see make_lookups) from the cache, or from Hydra.
+
+    The lookups are built once per cache entry and shared by all callers, so they must not be modified; use
+    get_template for a template to modify.
+
+    :param conn: The Hydra connection
+    :param template_id: The template ID
+    :return: The template and its lookups, or the error from Hydra
+    """
+
+    entry = get_entry(conn, template_id)
+    if isinstance(entry, dict):
+        return entry
+    return entry[1]
+
+
+def copy_template(entry):
+    '''Make a copy of the template in a cache entry (see get_entry), or return the error'''
+    if isinstance(entry, dict):
+        return entry
+    data, lookups = entry
+    if data is None:
+        return lookups.template  # not cached, so not shared
+    return munchify(json.loads(data))
+
+
+def get_template(conn, template_id):
+    '''Get a copy of a template from the cache, or from Hydra'''
+    return copy_template(get_entry(conn, template_id))
+
+
+def get_template_by_name(conn, template_name):
+    '''Get a copy of a template, by name, from the cache, or from Hydra'''
+    source = conn.url
+    key = (source, get_version(source), conn.user_id, template_name)
+    cached = template_ids.get(key)
+    if cached is not None and time.time() - cached[0] <= TEMPLATE_CACHE_SECONDS:
+        return get_template(conn, cached[1])
+
+    template = conn.call('get_template_by_name', template_name, raw=True)
+    if not template or 'error' in template:
+        return template
+    template_ids.set(key, (time.time(), template['id']))
+    return copy_template(get_entry(conn, template['id'], template=template))
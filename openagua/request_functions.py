@@ -1,9 +1,13 @@
+import logging
+
 from flask import g, request, current_app, session
 from openagua.security import current_user
-from openagua.connection import HydraConnection, root_connection
+from openagua.connection import HydraConnection, connection_pool, pooled_root_connection
 from openagua.lib.users import get_datauser
 from openagua.lib.studies import load_active_study
 
+log = logging.getLogger(__name__)
+
 
 def get_value_from_request(key, dtype=int, default=None):
     args = request.args
@@ -52,7 +56,7 @@ def _load_datauser(url=None, user_id=None, source_id=None):
 
 def _make_connection(is_public_user=False, user_id=None):
     if is_public_user:
-        g.conn = root_connection()
+        make_root_connection()
         return
     elif user_id and not g.get('datauser'):
         _load_datauser(user_id=user_id)
@@ -62,19 +66,53 @@ def _make_connection(is_public_user=False, user_id=None):
 
 
 def make_root_connection():
-    g.conn = root_connection()
+    release_connection()
+    g.conn, g.conn_key = pooled_root_connection()
 
 
 def make_user_connection():
+    release_connection()
     if g.get('datauser'):
-        g.conn = HydraConnection(
-            url=g.datauser.data_url,
-            session_id=g.datauser.sessionid,
-            username=g.datauser.username,
-            user_id=g.datauser.userid,
+        datauser = g.datauser
+        make = lambda: HydraConnection(
+            url=datauser.data_url,
+            session_id=datauser.sessionid,
+            username=datauser.username,
+            user_id=datauser.userid,
             app_name=current_app.config.get('APP_NAME')
         )
+        if datauser.sessionid is None:
+            # a connection without a data session gets a new one, so it isn't pooled
+            g.conn = make()
+        else:
+            key = (datauser.data_url, datauser.userid, datauser.sessionid)
+            g.conn = connection_pool.checkout(key, make)
+            g.conn_key = key
     else:
         g.conn = None
 
     return
+
+
+def release_connection(exc=None):
+    '''Return the request's connection to the connection pool; registered to run at the end of each request'''
+    conn = g.pop('conn', None)
+    key = g.pop('conn_key', None)
+    if conn is not None:
+        report = conn.report
+        if report['calls'] or report['hits']:
+            log.info('{} {}: {} Hydra calls in {:.3f}s, {} repeated reads from memo'.format(
+                request.method, request.path, report['calls'], report['seconds'], report['hits']))
+        conn.reset_memo()
+    if conn is not None and key is not None and exc is None:
+        connection_pool.checkin(conn, key)
+
+
+def add_hydra_timing(response):
+    '''Report the request's Hydra calls in a Server-Timing header; registered to run after each request'''
+    conn = g.get('conn')
+    if conn is not None:
+        report = conn.report
+        response.headers.add('Server-Timing', 'hydra;dur={:.1f};desc="{} calls, {} memo hits"'.format(
+            report['seconds'] * 1000, report['calls'], report['hits']))
+    return response
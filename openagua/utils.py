@@ -9,6 +9,7 @@ from flask import g
 from openagua.security import current_user
 from openagua.lib.users import get_datauser
 from openagua.lib.model_editor import get_model, add_model
+from openagua.lib.template_cache import get_template
 
 from openagua import db
 from openagua.models import DataUrl, NetworkModel
@@ -133,7 +134,7 @@ def change_active_template(conn, source_id, network=None, network_id=None, new_t
 
     new_template_id = new_template_id or network.layout.get('active_template_id')
 
-    new_tpl = conn.call('get_template', new_template_id)
+    new_tpl = get_template(conn, new_template_id)
 
     # update network types
     existing_types = [rt.id for rt in network.types]
@@ -181,7 +182,7 @@ def change_active_template(conn, source_id, network=None, network_id=None, new_t
             if not tt and resource.types:
                 old_rt = resource.types[-1]
                 if old_types is None and old_template_id is not None:
-                    old_tpl = conn.call('get_template', old_template_id)
+                    old_tpl = get_template(conn, old_template_id)
                     old_types = AttrDict({(resource_class, tt.name.lower()): tt for tt in old_tpl.templatetypes})
                 else:
                     old_types = {}
@@ -273,7 +274,7 @@ def set_active_model(conn, source_id, network):
     if network_model:
         model = get_model(id=network_model.model_id)
         if model is None:
-            template = conn.call('get_template', template_id)
+            template = get_template(conn, template_id)
             if model_name is None:
                 model_name = template.name
             model = get_model(source_id=source_id, project_id=network['project_id'], name=model_name)
@@ -0,0 +1,120 @@
+"""
+Benchmark of the ways Hydra responses can be wrapped (see openagua.lib.lazy), on a large synthetic network with data.
+
+Each path wraps the response, touches the data of some resources (as a view does) and serializes it (as jsonify does):
+
+- munchify: convert the whole response to Munches
+- eager: convert the response, or each item of a list response, to a Munch, as HydraConnection.call used to
+- lazy: wrap the response, converting values only as they are accessed
+- raw: use the response as it is, as the Hydra pass-through does
+
+Usage: python -m tests.benchmark_wrapping [--nodes 5000] [--attrs 10] [--used 100] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from munch import Munch, munchify
+
+from openagua.lib.lazy import LazyAttrDict, LazyList
+
+
+def make_network(nnodes, nattrs):
+    nodes = []
+    links = []
+    resourcescenarios = []
+    for i in range(nnodes):
+        attributes = [{'id': i * nattrs + j, 'attr_id': j, 'ref_key': 'NODE', 'node_id': i} for j in range(nattrs)]
+        nodes.append({'id': i, 'name': 'Node {}'.format(i), 'x': i, 'y': -i, 'layout': {'color': 'blue'},
+                      'types': [{'id': 1, 'name': 'Reservoir'}], 'attributes': attributes})
+        if i:
+            links.append({'id': i, 'name': 'Link {}'.format(i), 'node_1_id': i - 1, 'node_2_id': i,
+                          'layout': {}, 'types': [{'id': 2, 'name': 'River'}], 'attributes': []})
+        for attribute in attributes:
+            resourcescenarios.append({
+                'resource_attr_id': attribute['id'],
+                'dataset': {'type': 'timeseries', 'unit': 'cfs', 'metadata': {'source': 'benchmark'},
+                            'value': json.dumps({'0': {'2000-01-{:02}'.format(d): d for d in range(1, 29)}})}
+            })
+    return {
+        'id': 1, 'name': 'Benchmark network', 'layout': {}, 'types': [{'id': 1}],
+        'nodes': nodes, 'links': links,
+        'scenarios': [{'id': 1, 'name': 'Baseline', 'resourcescenarios': resourcescenarios}],
+    }
+
+
+def eager(resp):
+    if type(resp) == list:
+        return [Munch(x) for x in resp]
+    return Munch(resp)
+
+
+def lazy(resp):
+    if type(resp) == list:
+        return LazyList(resp, wrap_all=True)
+    return LazyAttrDict(resp)
+
+
+PATHS = [
+    ('munchify', munchify),
+    ('eager', eager),
+    ('lazy', lazy),
+    ('raw', lambda resp: resp),
+]
+
+
+def use(resp, nused):
+    # touch a few resources, then serialize the whole response
+    if isinstance(resp, list):
+        for item in resp[:nused]:
+            item['dataset']['type']
+    else:
+        for node in resp['nodes'][:nused]:
+            node['layout']['color']
+    return json.dumps(resp)
+
+
+def run(name, wrap, make, repeat, nused):
+    seconds = []
+    for i in range(repeat):
+        resp = make()
+        start = time.perf_counter()
+        use(wrap(resp), nused)
+        seconds.append(time.perf_counter() - start)
+
+    # memory is measured separately, since tracing slows everything down
+    resp = make()
+    tracemalloc.start()
+    use(wrap(resp), nused)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print('{:<30} {:>10.4f}s {:>10.1f} MB'.format(name, min(seconds), peak / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--attrs', type=int, default=10)
+    parser.add_argument('--used', type=int, default=100, help='resources accessed after wrapping')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    network = make_network(args.nodes, args.attrs)
+    print('{} nodes, {} resource scenarios'.format(
+        len(network['nodes']), len(network['scenarios'][0]['resourcescenarios'])))
+    print('{:<30} {:>11} {:>13}'.format('path', 'time (min)', 'peak memory'))
+
+    # each run gets a fresh copy, since wrapping can replace values in the response
+    for name, wrap in PATHS:
+        run('get_network: ' + name, wrap, lambda: json.loads(json.dumps(network)), args.repeat, args.used)
+    resourcescenarios = network['scenarios'][0]['resourcescenarios']
+    for name, wrap in PATHS:
+        run('get_resource_data: ' + name, wrap, lambda: json.loads(json.dumps(resourcescenarios)), args.repeat,
+            args.used)
+
+
+if __name__ == '__main__':
+    main()
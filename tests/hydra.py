@@ -55,6 +55,30 @@ class Hydra(object):
         except:
             return resp.content.decode()
 
+    def batch(self, calls, concurrent=False):
+        """
+        Run several calls in one request.
+
+        Example:
+
+        results = hydra.batch([
+            ('get_project', [], {'project_id': 123}),
+            ('get_networks', [], {'project_id': 123}),
+        ], concurrent=True)
+
+        :param calls: The calls, as (function, args, kwargs) tuples
+        :param concurrent: Run consecutive get_ calls concurrently
+        :return: The results, each a dictionary with either result, error or skipped
+        """
+        payload = {
+            'calls': [{'function': func, 'args': list(args), 'kwargs': kwargs} for func, args, kwargs in calls],
+            'concurrent': concurrent,
+        }
+        resp = requests.post(self.endpoint + '_batch', auth=self.auth, headers=self.headers, json=payload)
+        if not resp.ok:
+            raise Exception('{}: {}'.format(resp.status_code, resp.content.decode()))
+        return resp.json()['results']
+
     def __getattr__(self, name):
         def method(*args, **kwargs):
             if name == 'call':
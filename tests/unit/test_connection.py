@@ -0,0 +1,31 @@
+from openagua import connection
+
+
+class FakeClient(object):
+    def __init__(self, url):
+        self.session_id = None
+        self.calls = []
+
+    def call(self, fn, *args, **kwargs):
+        self.calls.append(fn)
+        return {'id': args[0], 'fn': fn, 'layout': {'color': 'blue'}}
+
+
+def test_repeated_reads_call_hydra_once(monkeypatch):
+    monkeypatch.setattr(connection.hc, 'RemoteJSONConnection', FakeClient)
+    conn = connection.HydraConnection(url='http://hydra.test', session_id='session', user_id=1)
+
+    first = conn.call('get_network', 1)
+    second = conn.call('get_network', 1)
+    assert conn.hc.calls == ['get_network']
+    assert conn.report['calls'] == 1 and conn.report['hits'] == 1
+
+    # each caller gets its own copy
+    second['layout']['color'] = 'red'
+    assert conn.call('get_network', 1)['layout']['color'] == 'blue'
+    assert first['id'] == second['id'] == 1
+
+    # a write forgets what was read
+    conn.call('update_network', {'id': 1})
+    conn.call('get_network', 1)
+    assert conn.hc.calls == ['get_network', 'update_network', 'get_network']
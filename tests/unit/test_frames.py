@@ -0,0 +1,60 @@
+import numpy
+import pandas
+
+from openagua.lib.frames import LongFrame, concat_frames, format_dates, to_categoricals
+
+
+def test_long_frame_matches_melted_frames():
+    dates = pandas.date_range('2000-01-01', periods=4)
+    values = numpy.arange(8, dtype=float).reshape(4, 2)
+
+    frame = LongFrame()
+    dfs = []
+    for resource_key in ['node/1', 'node/2']:
+        blocks = [0, 1]
+        frame.append({'scenario_id': 3, 'resource_key': resource_key, 'block': numpy.repeat(blocks, 4)},
+                     date=numpy.tile(dates.values, 2), value=values.T.ravel())
+
+        df = pandas.DataFrame(values, index=dates, columns=blocks)
+        df.index.name = 'date'
+        df = df.reset_index()
+        df['scenario_id'] = 3
+        df['resource_key'] = resource_key
+        dfs.append(pandas.melt(df, id_vars=['scenario_id', 'resource_key', 'date'], var_name='block'))
+
+    expected = pandas.concat(dfs, ignore_index=True)
+    data = frame.to_frame(columns=list(expected.columns))
+
+    assert frame.nrows == 16
+    assert list(data.columns) == list(expected.columns)
+    for name in ['scenario_id', 'resource_key', 'block']:
+        assert data[name].dtype.name == 'category'
+        assert data[name].tolist() == expected[name].tolist()
+    assert (data['date'] == expected['date']).all()
+    assert numpy.array_equal(data['value'].values, expected['value'].values)
+
+
+def test_long_frame_missing_labels():
+    frame = LongFrame(labels=['Scenario'])
+    frame.append({'Scenario': 'A'}, value=numpy.array([1.0]))
+    frame.append({'Scenario': None, 'tag': 'x'}, value=numpy.array(['text'], dtype=object))
+    data = frame.to_frame()
+
+    assert data['Scenario'].tolist() == ['A', '']
+    assert data['tag'].tolist() == ['', 'x']
+    assert data['value'].tolist() == [1.0, 'text']
+
+
+def test_concat_frames_keeps_categoricals():
+    df1 = to_categoricals(pandas.DataFrame({'attr_id': [1, 2], 'value': [1.0, 2.0]}), ['attr_id'])
+    df2 = to_categoricals(pandas.DataFrame({'attr_id': [2, 3], 'value': [3.0, 4.0]}), ['attr_id'])
+    data = concat_frames([df1, df2])
+
+    assert data['attr_id'].dtype.name == 'category'
+    assert data['attr_id'].tolist() == [1, 2, 2, 3]
+    assert data['value'].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_format_dates():
+    dates = pandas.DatetimeIndex(['2000-01-02', '2000-01-01', '2000-01-02'])
+    assert list(format_dates(dates, '%Y-%m-%d')) == ['2000-01-02', '2000-01-01', '2000-01-02']
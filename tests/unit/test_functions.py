@@ -0,0 +1,20 @@
+import pytest
+
+from openagua.lib.evaluators.openagua_evaluator import ARGNAMES, is_vectorized, parse_function
+
+
+@pytest.mark.parametrize('code,vectorized', [
+    ('return numpy.where(months > 6, 1.0, 0.0)', True),
+    ('return [d.year for d in dates]', True),
+    ('# flow over 30 days\nreturn timestep.timestep * 2', False),
+    ('months = 3\nreturn months * timestep.month', False),
+    ('name = "years"\nreturn 1', False),
+])
+def test_is_vectorized(code, vectorized):
+    assert is_vectorized(code) == vectorized
+
+
+def test_parse_function_skips_vector_args_not_read():
+    func = parse_function('# flow over 30 days\nreturn timestep.timestep * 2', 'f', ARGNAMES)
+    assert 'days = kwargs.get("days")' not in func
+    assert 'timestep = kwargs.get("timestep")' in func
@@ -0,0 +1,49 @@
+import json
+
+from openagua.lib.lazy import LazyAttrDict, LazyList
+
+
+def test_lazy_attr_dict_wraps_on_access():
+    data = {'id': 1, 'layout': {'color': 'blue'}, 'nodes': [{'id': 2, 'types': [{'id': 3}]}]}
+    network = LazyAttrDict(data)
+
+    assert dict.__getitem__(network, 'layout') is data['layout']
+    assert network.layout.color == 'blue'
+    assert network.nodes[0].types[0].id == 3
+    assert network.get('missing') is None
+
+    network.layout.color = 'red'
+    assert network['layout']['color'] == 'red'
+    assert json.loads(json.dumps(network)) == {'id': 1, 'layout': {'color': 'red'},
+                                               'nodes': [{'id': 2, 'types': [{'id': 3}]}]}
+
+
+def test_lazy_list_wraps_items():
+    class Obj(dict):
+        pass
+
+    items = LazyList([Obj(id=1), Obj(id=2)], wrap_all=True)
+    assert [item.id for item in items] == [1, 2]
+    assert isinstance(items[0], LazyAttrDict)
+
+    # nested dictionaries with their own type are left as they are
+    nested = LazyList([Obj(id=1)])
+    assert type(nested[0]) is Obj
+
+
+def test_lazy_attr_dict_wraps_items_and_values():
+    network = LazyAttrDict({'id': 1, 'layout': {'color': 'blue'}, 'nodes': [{'name': 'A'}]})
+
+    items = dict(network.items())
+    assert items['layout'].color == 'blue'
+    assert items['nodes'][0].name == 'A'
+    assert [value for value in network.values() if isinstance(value, dict)][0].color == 'blue'
+    assert json.loads(json.dumps(network)) == {'id': 1, 'layout': {'color': 'blue'}, 'nodes': [{'name': 'A'}]}
+
+
+def test_lazy_list_wraps_slices_and_reversed():
+    items = LazyList([{'id': 1}, {'id': 2}, {'id': 3}])
+
+    assert [item.id for item in items[1:]] == [2, 3]
+    assert isinstance(items[::2], LazyList)
+    assert [item.id for item in reversed(items)] == [3, 2, 1]
@@ -0,0 +1,26 @@
+import pandas
+
+from openagua.lib.results_store import SCHEMA, get_date_range, read_results, write_dataset
+
+
+def test_read_results_date_range(tmp_path):
+    dates = pandas.date_range('2000-01-01', periods=6, freq='MS')
+    df = pandas.DataFrame({
+        'scenario': '1',
+        'subscenario': 1,
+        'resource_key': 'node/2',
+        'attr_id': '3',
+        'block': 0,
+        'date': dates,
+        'value': range(6),
+    })
+    write_dataset(df, str(tmp_path / 'results.parquet'), SCHEMA, None)
+
+    agg = {'range': {'mode': 'custom', 'start': '2000-02-01', 'end': '2000-04-01'}}
+    start, end = get_date_range(agg)
+    results = read_results(None, str(tmp_path), 1, start=start, end=end)
+    assert list(results['date']) == list(dates[1:4])
+    assert list(results['value']) == [1, 2, 3]
+
+    assert get_date_range({'range': {'mode': 'all', 'start': '2000-02-01'}}) == (None, None)
+    assert len(read_results(None, str(tmp_path), 1)) == 6
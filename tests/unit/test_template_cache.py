@@ -0,0 +1,65 @@
+from munch import Munch as AttrDict
+
+from openagua.lib import template_cache
+from openagua.lib.lazy import LazyAttrDict
+
+
+class FakeConnection(object):
+    url = 'test'
+
+    def __init__(self, user_id=1):
+        self.user_id = user_id
+        self.calls = 0
+
+    def call(self, fn, template_id, raw=False):
+        self.calls += 1
+        if fn == 'get_template_by_name':
+            template_id = 5
+        return LazyAttrDict({
+            'id': template_id,
+            'name': 'Template',
+            'templatetypes': [AttrDict(id=1, name='Reservoir', typeattrs=[
+                AttrDict(attr_id=10, attr=AttrDict(name='Storage')),
+            ])],
+        })
+
+
+def test_template_cache():
+    template_cache.entries.clear()
+    template_cache.template_ids.clear()
+    conn = FakeConnection()
+
+    lookups = template_cache.get_template_lookups(conn, 5)
+    assert lookups.ttypes[1].name == 'Reservoir'
+    assert lookups.ttypes_by_name['Reservoir'].id == 1
+    assert lookups.typeattrs_by_type[1][10].attr.name == 'Storage'
+    assert lookups.typeattrs_by_name['Storage'].attr_id == 10
+
+    # the lookups are built once and shared, and get_template gives each caller its own copy
+    assert template_cache.get_template_lookups(conn, 5) is lookups
+    template = template_cache.get_template(conn, 5)
+    assert type(template) is type(lookups.template)
+    template['name'] = 'Changed'
+    assert template_cache.get_template(conn, 5).name == 'Template'
+    assert lookups.template.name == 'Template'
+    assert conn.calls == 1
+
+    assert template_cache.get_template_by_name(conn, 'Template').id == 5
+    assert template_cache.get_template_by_name(conn, 'Template').id == 5
+    assert conn.calls == 2
+
+    # templates are cached per Hydra user, since Hydra checks who may read them
+    other = FakeConnection(user_id=2)
+    template_cache.get_template(other, 5)
+    assert other.calls == 1
+
+    template_cache.invalidate(conn.url)
+    template_cache.get_template(conn, 5)
+    assert conn.calls == 3
+
+
+def test_is_template_write():
+    assert template_cache.is_template_write('update_templatetype')
+    assert template_cache.is_template_write('delete_typeattr')
+    assert not template_cache.is_template_write('get_template')
+    assert not template_cache.is_template_write('update_network')
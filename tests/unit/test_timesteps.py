@@ -0,0 +1,152 @@
+import random
+from calendar import isleap
+from datetime import datetime
+
+import numpy
+import pandas
+import pytest
+
+from openagua.lib.evaluators import codec
+from openagua.lib.evaluators.series import DateIndex, Series
+from openagua.lib.evaluators.utils import get_timestep_grid, make_timesteps
+
+SPANS = ['day', 'week', 'month', 'thricemonthly']
+
+
+def legacy_make_timesteps(data_type='timeseries', **kwargs):
+    """The original loop-based make_timesteps, kept as a reference calendar."""
+
+    span = kwargs.get('span') or kwargs.get('timestep') or kwargs.get('time_step')
+    start = kwargs.get('start') or kwargs.get('start_time')
+    end = kwargs.get('end') or kwargs.get('end_time')
+
+    dates = []
+
+    if start and end and span:
+
+        start_date = pandas.to_datetime(start)
+        end_date = pandas.to_datetime(end)
+        span = span.lower()
+
+        if data_type == 'periodic timeseries':
+            start_date = datetime(1678, 1, 1)
+            end_date = datetime(1678, 12, 31, 23, 59)
+
+        if span == 'day':
+            dates = pandas.date_range(start=start, end=end, freq='D')
+        elif span == 'week':
+            dates = []
+            for i in range(52 * (end_date.year - start_date.year)):
+                if i == 0:
+                    date = start_date
+                else:
+                    date = dates[-1] + pandas.DateOffset(days=7)
+                if isleap(date.year) and date.month == 3 and date.day == 4:
+                    date += pandas.DateOffset(days=1)
+                if date.month == 12 and date.day == 31:
+                    date += pandas.DateOffset(days=1)
+                dates.append(date)
+        elif span == 'month':
+            dates = pandas.date_range(start=start, end=end, freq=pandas.offsets.MonthEnd())
+        elif span == 'thricemonthly':
+            dates = []
+            for date in pandas.date_range(start=start, end=end, freq=pandas.offsets.MonthEnd()):
+                d1 = datetime(date.year, date.month, 10)
+                d2 = datetime(date.year, date.month, 20)
+                d3 = datetime(date.year, date.month, date.daysinmonth)
+                dates.extend([d1, d2, d3])
+
+    return [pandas.Timestamp(d) for d in dates]
+
+
+def random_time_settings(seed, count=25):
+    rng = random.Random(seed)
+    settings = []
+    for i in range(count):
+        start = pandas.Timestamp(rng.randint(1900, 2090), rng.randint(1, 12), rng.randint(1, 28))
+        end = start + pandas.Timedelta(days=rng.randint(0, 365 * 40))
+        settings.append((start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+    return settings
+
+
+# edge cases: leap days, the skipped Mar 4 and Dec 31, and single-year horizons
+EDGE_CASES = [
+    ('2000-01-01', '2000-12-31'),
+    ('2000-02-26', '2010-12-31'),
+    ('1999-12-31', '2005-01-01'),
+    ('2003-12-24', '2004-03-04'),
+    ('2004-03-04', '2030-03-04'),
+    ('1980-10-01', '2019-09-30'),
+]
+
+
+@pytest.mark.parametrize('span', SPANS)
+@pytest.mark.parametrize('start,end', EDGE_CASES + random_time_settings(seed=42))
+def test_calendar_matches_legacy(span, start, end):
+    """
+    GIVEN a start date, end date and span
+    WHEN the timesteps are made
+    THEN the dates are identical to the original loop-based calendar
+    """
+    expected = legacy_make_timesteps(start=start, end=end, span=span)
+    dates = make_timesteps(start=start, end=end, span=span)
+    assert dates == expected
+
+
+@pytest.mark.parametrize('span', SPANS)
+@pytest.mark.parametrize('start,end', EDGE_CASES)
+def test_as_index(span, start, end):
+    """
+    GIVEN a start date, end date and span
+    WHEN the timesteps are made as an index
+    THEN a DatetimeIndex with the same dates as the list is returned
+    """
+    index = make_timesteps(start=start, end=end, span=span, as_index=True)
+    assert isinstance(index, pandas.DatetimeIndex)
+    assert list(index) == make_timesteps(start=start, end=end, span=span)
+
+
+@pytest.mark.parametrize('span', SPANS)
+def test_periodic_timeseries_matches_legacy(span):
+    kwargs = dict(data_type='periodic timeseries', start='2000-01-01', end='2010-12-31', span=span)
+    assert make_timesteps(**kwargs) == legacy_make_timesteps(**kwargs)
+
+
+def test_weekly_skips():
+    dates = make_timesteps(start='1950-01-01', end='2050-12-31', span='week', as_index=True)
+    assert not ((dates.month == 12) & (dates.day == 31)).any()
+    assert not (dates.is_leap_year & (dates.month == 3) & (dates.day == 4)).any()
+    assert dates.is_monotonic_increasing and dates.is_unique
+
+
+def test_iso_format():
+    dates = make_timesteps(start='2000-01-01', end='2000-03-31', span='month', format='iso')
+    assert dates == ['2000-01-31T00:00:00', '2000-02-29T00:00:00', '2000-03-31T00:00:00']
+
+
+def test_missing_settings():
+    assert make_timesteps(start='2000-01-01', end=None, span='day') == []
+    assert len(make_timesteps(start='2000-01-01', end=None, span='day', as_index=True)) == 0
+
+
+def test_timestep_grid_span():
+    time_settings = {'start': '2000-01-01', 'end': '2000-03-31', 'span': 'month'}
+    grid = get_timestep_grid(time_settings)
+    other = get_timestep_grid(time_settings, span='day')
+    assert grid is not other
+    assert other.span == 'day'
+    assert list(other.dates) == list(grid.dates) == make_timesteps(**time_settings)
+
+
+def test_flatten_skips_missing_values():
+    dates = pandas.date_range('2000-01-01', periods=3)
+    values = numpy.array([[1.0, 2.0], [numpy.nan, 3.0], [numpy.nan, numpy.nan]])
+    expected = [3.0, 3.0, 0.0]
+
+    series = Series(DateIndex(dates), values)
+    assert list(series.flatten().values[:, 0]) == expected
+    assert list(series.to_native(flatten=True).values()) == expected
+    assert list(codec.to_native(dates, [0, 1], values, flatten=True).values()) == expected
+
+    single = Series(DateIndex(dates), values[:, :1])
+    assert list(single.flatten().values[:, 0]) == [1.0, 0.0, 0.0]